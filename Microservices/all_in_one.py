@@ -0,0 +1,63 @@
+"""Runs device-management and monitoring in a single process on the memory bus
+
+Device events published by device-management are handed to the monitoring
+consumer as Python objects, without a broker hop or serialization. Useful for
+dev loops and single-node deployments:
+
+    python Microservices/all_in_one.py
+
+Both services keep their own configuration (Postgres, Mongo, MQTT) from the
+environment. The API and the Socket.IO endpoint are served on ALL_IN_ONE_PORT.
+"""
+import importlib.util
+import os
+import sys
+
+import uvicorn
+from fastapi.responses import PlainTextResponse
+
+os.environ.setdefault("MESSAGE_BUS", "memory")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEVICE_MANAGEMENT_DIR = os.path.join(HERE, "device-management")
+MONITORING_DIR = os.path.join(HERE, "monitoring")
+
+
+def load_main(service_dir: str, name: str):
+    # config.database is the only module path both services define, the
+    # modules already imported keep their references to their own copy
+    for module in list(sys.modules):
+        if module == "config" or module.startswith("config."):
+            del sys.modules[module]
+    sys.path.insert(0, service_dir)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(service_dir, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_app():
+    device_management = load_main(DEVICE_MANAGEMENT_DIR, "device_management_main")
+    monitoring = load_main(MONITORING_DIR, "monitoring_main")
+
+    app = monitoring.app
+    for route in device_management.app.router.routes:
+        # the monitoring app keeps its own root, health and metrics routes
+        if getattr(route, "path", None) not in ("/", "/healthz", "/readyz", "/metrics"):
+            app.router.routes.append(route)
+    # one /metrics for both : the trace histograms (one registry, the helpers
+    # are shared) followed by the admission counters of the MQTT bridge
+    app.router.routes = [route for route in app.router.routes if getattr(route, "path", None) != "/metrics"]
+    app.add_api_route(
+        "/metrics", lambda: monitoring.metrics() + device_management.metrics(), response_class=PlainTextResponse
+    )
+    app.router.on_startup.extend(device_management.app.router.on_startup)
+    app.router.on_shutdown.extend(device_management.app.router.on_shutdown)
+    return monitoring.socket_app
+
+
+socket_app = build_app()
+
+if __name__ == "__main__":
+    uvicorn.run(socket_app, host="0.0.0.0", port=int(os.getenv("ALL_IN_ONE_PORT", 8002)))
@@ -0,0 +1,164 @@
+import os
+import random
+import threading
+import time
+from helpers.log import get_logger, LOG_RATE_LIMIT
+
+# Admission control of the MQTT sensor messages, before they reach the bus.
+# Every message takes a token from the bucket of its device and from the bucket
+# of its device type (when the type has a limit), it is admitted when both have
+# one. Over the limit, INGEST_OVER_LIMIT decides :
+#     drop        the message is discarded
+#     sample      INGEST_OVER_LIMIT_SAMPLE of the messages are forwarded, the rest dropped
+#     downgrade   forwarded as device.telemetry.throttled : stored, but neither
+#                 broadcast to the dashboards nor scored for anomalies
+# With INGEST_LIMITER_URL the buckets live in Redis and are shared by the
+# replicas, otherwise each replica limits the traffic it receives.
+INGEST_DEVICE_RATE = float(os.getenv("INGEST_DEVICE_RATE", 10))
+INGEST_DEVICE_BURST = float(os.getenv("INGEST_DEVICE_BURST", 20))
+# "TYPE=rate:burst,..." : limits shared by every device of a type
+INGEST_TYPE_LIMITS = os.getenv("INGEST_TYPE_LIMITS", "")
+INGEST_OVER_LIMIT = os.getenv("INGEST_OVER_LIMIT", "drop")
+INGEST_OVER_LIMIT_SAMPLE = float(os.getenv("INGEST_OVER_LIMIT_SAMPLE", 0.1))
+INGEST_LIMITER_URL = os.getenv("INGEST_LIMITER_URL", "")
+# after a Redis error, the local buckets are used this long before retrying
+INGEST_LIMITER_RETRY = float(os.getenv("INGEST_LIMITER_RETRY", 5))
+THROTTLED_ROUTING_KEY = "device.telemetry.throttled"
+logger = get_logger("device_management.admission", rate_limit=LOG_RATE_LIMIT)
+
+# Takes one token from every bucket of KEYS when each has one.
+# ARGV : rate and burst of each key, in order. Redis time, replicas may drift.
+TAKE_TOKENS = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+    local bucket = redis.call('HMGET', key, 'tokens', 'at')
+    local level = tonumber(bucket[1]) or burst
+    local at = tonumber(bucket[2]) or now
+    tokens[i] = math.min(burst, level + math.max(0, now - at) * rate)
+    if tokens[i] < 1 then allowed = 0 end
+end
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+    redis.call('HSET', key, 'tokens', tokens[i] - allowed, 'at', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return allowed
+"""
+
+
+def parse_type_limits(value: str) -> dict:
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        device_type, limit = item.split("=")
+        rate, _, burst = limit.partition(":")
+        limits[device_type.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class LocalBuckets:
+    """In-process token buckets"""
+
+    def __init__(self, max_buckets: int = 100000):
+        # key -> (tokens, updated at, full again at)
+        self.buckets = {}
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+
+    def take(self, limits: list) -> bool:
+        """limits : (key, rate, burst) of every bucket to take a token from"""
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, rate, burst in limits:
+                tokens, at, _ = self.buckets.get(key, (burst, now, now))
+                levels.append(min(burst, tokens + (now - at) * rate))
+            allowed = all(level >= 1 for level in levels)
+            for (key, rate, burst), level in zip(limits, levels):
+                level -= allowed
+                self.buckets[key] = (level, now, now + (burst - level) / rate)
+            if len(self.buckets) > self.max_buckets:
+                # spoofed device ids must not grow the table, full buckets are the default state
+                self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+            return allowed
+
+
+class RedisBuckets:
+    """Token buckets shared by the replicas, updated atomically by a script"""
+
+    def __init__(self, url: str):
+        import redis
+        self.redis = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.script = self.redis.register_script(TAKE_TOKENS)
+
+    def take(self, limits: list) -> bool:
+        args = []
+        for _, rate, burst in limits:
+            args += [rate, burst]
+        return bool(self.script(keys=[f"ingest:{key}" for key, _, _ in limits], args=args))
+
+
+class AdmissionController:
+    def __init__(self, device_rate: float = INGEST_DEVICE_RATE, device_burst: float = INGEST_DEVICE_BURST,
+                 type_limits: str = INGEST_TYPE_LIMITS, over_limit: str = INGEST_OVER_LIMIT,
+                 sample_rate: float = INGEST_OVER_LIMIT_SAMPLE, redis_url: str = INGEST_LIMITER_URL):
+        if over_limit not in ("drop", "sample", "downgrade"):
+            raise ValueError(f"Unsupported INGEST_OVER_LIMIT: {over_limit}")
+        self.device_limit = (device_rate, device_burst)
+        self.type_limits = parse_type_limits(type_limits)
+        self.over_limit = over_limit
+        self.sample_rate = sample_rate
+        self.local = LocalBuckets()
+        self.shared = RedisBuckets(redis_url) if redis_url else None
+        self.shared_retry_at = 0.0
+        # (outcome, device type) -> messages
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def limits(self, data: dict) -> list:
+        limits = [(f"device:{data.get('device_id')}",) + self.device_limit]
+        device_type = data.get("type")
+        if device_type in self.type_limits:
+            limits.append((f"type:{device_type}",) + self.type_limits[device_type])
+        return limits
+
+    def take(self, limits: list) -> bool:
+        if self.shared is not None and time.monotonic() >= self.shared_retry_at:
+            try:
+                return self.shared.take(limits)
+            except Exception as e:
+                # the edge keeps limiting, per replica, while Redis is unavailable
+                self.shared_retry_at = time.monotonic() + INGEST_LIMITER_RETRY
+                logger.error("Shared rate limiter unavailable: %s", e)
+        return self.local.take(limits)
+
+    def admit(self, data: dict) -> str:
+        """accepted, dropped, sampled (forwarded) or downgraded (forwarded throttled)"""
+        if self.take(self.limits(data)):
+            outcome = "accepted"
+        elif self.over_limit == "sample":
+            outcome = "sampled" if random.random() < self.sample_rate else "dropped"
+        elif self.over_limit == "downgrade":
+            outcome = "downgraded"
+        else:
+            outcome = "dropped"
+        # only the configured types are labels, device types are sent by the devices
+        key = (outcome, data.get("type") if data.get("type") in self.type_limits else "other")
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+        return outcome
+
+    def render(self) -> str:
+        name = "ingest_messages_total"
+        lines = [f"# HELP {name} Sensor messages by admission outcome and device type",
+                 f"# TYPE {name} counter"]
+        with self._lock:
+            for (outcome, device_type), count in sorted(self.counters.items()):
+                lines.append(f'{name}{{outcome="{outcome}",type="{device_type}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+admission = AdmissionController()
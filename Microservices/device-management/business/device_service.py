@@ -1,7 +1,7 @@
 from sqlalchemy.orm import Session
 from dal.device_dal import DeviceDAL
 from dto.device_dto import DeviceCreate, DeviceUpdate
-from helpers.rabbitmq_helper import rabbitmq_helper
+from helpers.message_bus import get_bus
 
 class DeviceService:
     def __init__(self, db: Session):
@@ -10,9 +10,15 @@ class DeviceService:
     def create_device(self, device: DeviceCreate):
         created_device = self.dal.create_device(device)
         # Publish event
-        rabbitmq_helper.publish_event(
+        get_bus().publish(
             routing_key="device.created",
-            message={"device_id": created_device.device_id, "status": created_device.status}
+            message={
+                "device_id": created_device.device_id,
+                "status": created_device.status,
+                "name": created_device.name,
+                "type": created_device.type,
+                "city": created_device.city
+            }
         )
         return created_device
 
@@ -26,11 +32,14 @@ class DeviceService:
         updated_device = self.dal.update_device(device_id, device_update)
         if updated_device:
              # Publish event
-            rabbitmq_helper.publish_event(
+            get_bus().publish(
                 routing_key="device.updated",
                 message={
                     "device_id": updated_device.device_id, 
                     "status": updated_device.status,
+                    "name": updated_device.name,
+                    "type": updated_device.type,
+                    "city": updated_device.city,
                     "updated_fields": list(device_update.model_dump(exclude_unset=True).keys())
                 }
             )
@@ -39,7 +48,7 @@ class DeviceService:
     def delete_device(self, device_id: str):
         deleted_device = self.dal.delete_device(device_id)
         if deleted_device:
-             rabbitmq_helper.publish_event(
+             get_bus().publish(
                 routing_key="device.deleted",
                 message={"device_id": device_id}
             )
@@ -0,0 +1,22 @@
+import json
+from business.admission import admission, THROTTLED_ROUTING_KEY
+from helpers import tracing
+from helpers.message_bus import get_bus
+
+
+def forward_telemetry(payload: bytes):
+    """Forward one MQTT sensor message to the message bus (for Monitoring),
+    within the rate limits of its device and device type"""
+    data = json.loads(payload.decode())
+    outcome = admission.admit(data)
+    if outcome == "dropped":
+        return None
+    # MQTT sensors can not send headers, sampled traces start here
+    # the bus stamps broker_publish when the message is handed to the broker
+    trace = tracing.start_trace("bridge_receive", source_timestamp=data.get("timestamp"))
+    get_bus().publish(
+        routing_key=THROTTLED_ROUTING_KEY if outcome == "downgraded" else "device.telemetry",
+        message=data,
+        headers=tracing.to_headers(trace)
+    )
+    return data
@@ -14,12 +14,27 @@ NAME_DB = os.getenv("NAME_DB", "device_db")
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{USER_DB}:{PASSWORD_DB}@{SERVER_DB}:5432/{NAME_DB}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 3))
+
+# The engine is built on first use, importing the app opens no connection
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+_engine = None
 
 Base = declarative_base()
 
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            SQLALCHEMY_DATABASE_URL,
+            pool_pre_ping=True,
+            connect_args={"connect_timeout": DB_CONNECT_TIMEOUT}
+        )
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
 def get_db():
+    get_engine()
     db = SessionLocal()
     try:
         yield db
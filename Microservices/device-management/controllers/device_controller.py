@@ -3,11 +3,13 @@ from sqlalchemy.orm import Session
 from dto.device_dto import DeviceCreate, DeviceResponse, DeviceUpdate
 from config.database import get_db
 from business.device_service import DeviceService
+from helpers.auth import require_token
 from typing import List
 
 router = APIRouter(
     prefix="/devices",
-    tags=["devices"]
+    tags=["devices"],
+    dependencies=[Depends(require_token)]
 )
 
 @router.post("/", response_model=DeviceResponse)
@@ -0,0 +1,144 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+# Structured logging for the message and request paths.
+# Records are handed to a bounded queue and written by a background listener,
+# a slow stdout or disk never stalls message handling (records are dropped instead).
+# Per-message and per-request loggers are sampled and rate limited, warnings
+# and errors go to a separate logger without filters so none of them is lost.
+# This file is shared verbatim by device-management, monitoring and signing,
+# Microservices/tests/test_shared_helpers.py fails when the copies diverge.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# per-message and per-request loggers : fraction of records kept and max records per second
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 20))
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        # fields passed with extra={...}
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records instead of blocking when the listener falls behind"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # message and traceback stay apart for the JSON formatter
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """Keeps a fraction of the records below WARNING"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket of rate records per second, the next record kept reports
+    how many were suppressed"""
+
+    def __init__(self, rate: float, burst: float = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return False
+            self.tokens -= 1
+            if self.suppressed:
+                record.suppressed, self.suppressed = self.suppressed, 0
+        return True
+
+
+def get_logger(name: str, sample_rate: float = None, rate_limit: float = None) -> logging.Logger:
+    """Logger for per-message or per-request records, sampled and/or rate limited"""
+    logger = logging.getLogger(name)
+    if not logger.filters:
+        if sample_rate is not None and sample_rate < 1:
+            logger.addFilter(SampleFilter(sample_rate))
+        if rate_limit:
+            logger.addFilter(RateLimitFilter(rate_limit))
+    return logger
+
+
+_listener = None
+
+
+def setup_logging(*handlers: logging.Handler) -> logging.Logger:
+    """Route the root logger through a queue to handlers (stdout by default)"""
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    if _listener is not None:
+        return root
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(fmt="%(asctime)s %(levelname)s %(name)s %(message)s")
+    handlers = handlers or (logging.StreamHandler(),)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return root
@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.request
+
+# Per-message latency tracing across the telemetry pipeline.
+# The first hop (simulator, local_monitor or the MQTT bridge) decides whether a
+# message is sampled and starts a context carried in the "x-trace" message
+# header. Every stage appends a (stage, unix ns) stamp, the last stage turns the
+# stamps into per-hop spans and latency histograms.
+# This file is shared verbatim by device-management and monitoring,
+# Microservices/tests/test_shared_helpers.py fails when the copies diverge.
+TRACE_HEADER = "x-trace"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+# OTLP/HTTP collector base url (e.g. http://otel-collector:4318) and/or a JSON lines file
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "iot-pipeline")
+logger = logging.getLogger("tracing")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def start_trace(stage: str, source_timestamp: float = None, sample_rate: float = TRACE_SAMPLE_RATE):
+    """New context stamped at stage, or None when the message is not sampled"""
+    if random.random() >= sample_rate:
+        return None
+    stamps = []
+    if source_timestamp:
+        # sensors over MQTT can not carry headers, their payload timestamp is the first stamp
+        stamps.append(["source_publish", int(float(source_timestamp) * 1e9)])
+    stamps.append([stage, time.time_ns()])
+    return {"trace_id": secrets.token_hex(16), "stamps": stamps}
+
+
+def stamp(context, stage: str):
+    if context is not None:
+        context["stamps"].append([stage, time.time_ns()])
+
+
+def to_headers(context) -> dict:
+    if context is None:
+        return None
+    return {TRACE_HEADER: json.dumps(context)}
+
+
+def from_headers(headers):
+    if not headers or TRACE_HEADER not in headers:
+        return None
+    value = headers[TRACE_HEADER]
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class HopMetrics:
+    """Per-hop latency histograms, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, hop: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(hop)
+            if histogram is None:
+                histogram = self.histograms[hop] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self) -> str:
+        name = "pipeline_hop_latency_seconds"
+        lines = [f"# HELP {name} Latency between two pipeline stages of sampled messages",
+                 f"# TYPE {name} histogram"]
+        with self._lock:
+            for hop, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{hop="{hop}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{hop="{hop}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{hop="{hop}"}} {histogram.total}')
+                lines.append(f'{name}_count{{hop="{hop}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+class SpanExporter(threading.Thread):
+    """Background export of finished traces, never blocks the message path"""
+
+    def __init__(self, endpoint: str = OTLP_ENDPOINT, path: str = TRACE_FILE, max_batch: int = 512):
+        threading.Thread.__init__(self, name="span-exporter", daemon=True)
+        self.endpoint = endpoint.rstrip("/")
+        self.path = path
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize=10000)
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.endpoint or self.path)
+
+    def submit(self, spans: list):
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            deadline = time.monotonic() + 2
+            while len(batch) < self.max_batch and time.monotonic() < deadline:
+                try:
+                    batch.extend(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                if self.path:
+                    with open(self.path, "a") as f:
+                        for span in batch:
+                            f.write(json.dumps(span) + "\n")
+                if self.endpoint:
+                    self._post(batch)
+            except Exception as e:
+                logger.error("Span export failed: %s", e)
+
+    def _post(self, spans: list):
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "pipeline-tracing"}, "spans": spans}]
+        }]}
+        request = urllib.request.Request(
+            f"{self.endpoint}/v1/traces", data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        urllib.request.urlopen(request, timeout=5).close()
+
+
+def build_spans(context, attributes: dict) -> list:
+    """One root span covering the whole trip plus one child span per hop (OTLP JSON)"""
+    stamps = context["stamps"]
+    trace_id = context["trace_id"]
+    root_id = secrets.token_hex(8)
+    attrs = [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items()]
+    spans = [{
+        "traceId": trace_id, "spanId": root_id, "name": "pipeline", "kind": 1,
+        "startTimeUnixNano": str(stamps[0][1]), "endTimeUnixNano": str(stamps[-1][1]), "attributes": attrs
+    }]
+    for (previous, start), (stage, end) in zip(stamps, stamps[1:]):
+        spans.append({
+            "traceId": trace_id, "spanId": secrets.token_hex(8), "parentSpanId": root_id,
+            "name": f"{previous}->{stage}", "kind": 1,
+            "startTimeUnixNano": str(start), "endTimeUnixNano": str(end), "attributes": attrs
+        })
+    return spans
+
+
+metrics = HopMetrics()
+exporter = SpanExporter()
+
+
+def finish(context, **attributes):
+    """Record the hop latencies of a finished trace and export its spans"""
+    if context is None:
+        return
+    stamps = context["stamps"]
+    for (previous, start), (stage, end) in zip(stamps, stamps[1:]):
+        metrics.observe(f"{previous}->{stage}", max(0, end - start) / 1e9)
+    if len(stamps) > 1:
+        metrics.observe("end_to_end", max(0, stamps[-1][1] - stamps[0][1]) / 1e9)
+    if exporter.enabled:
+        if not exporter.is_alive():
+            try:
+                exporter.start()
+            except RuntimeError:
+                pass
+        exporter.submit(build_spans(context, attributes))
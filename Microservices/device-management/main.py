@@ -1,18 +1,24 @@
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi_mqtt import FastMQTT, MQTTConfig
-from config.database import Base, engine
+from sqlalchemy import text
+from config.database import get_engine
 from controllers import device_controller
-from helpers.rabbitmq_helper import rabbitmq_helper
-import json
+from business.telemetry_bridge import forward_telemetry
+from business.admission import admission
+from helpers.log import setup_logging, get_logger, LOG_SAMPLE_RATE, LOG_RATE_LIMIT
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
-
-# Create tables
-Base.metadata.create_all(bind=engine)
+setup_logging()
+logger = get_logger("device_management.mqtt", rate_limit=LOG_RATE_LIMIT)
+# one record per sensor message, sampled
+message_logger = get_logger("device_management.mqtt.messages", sample_rate=LOG_SAMPLE_RATE, rate_limit=LOG_RATE_LIMIT)
 
 app = FastAPI(
     title="Device Management Service",
@@ -39,31 +45,80 @@ mqtt_config = MQTTConfig(
 )
 
 mqtt = FastMQTT(config=mqtt_config)
+MQTT_RETRY_SECONDS = float(os.getenv("MQTT_RETRY_SECONDS", 5))
+# Admission (a Redis round-trip with INGEST_LIMITER_URL) and publishing block,
+# they run off the event loop. One thread keeps the messages in arrival order,
+# more raise the throughput but a device's messages may be reordered.
+MQTT_BRIDGE_THREADS = int(os.getenv("MQTT_BRIDGE_THREADS", 1))
+bridge_executor = ThreadPoolExecutor(max_workers=MQTT_BRIDGE_THREADS, thread_name_prefix="mqtt-bridge")
+
+# The broker connection is made in the background (instead of mqtt.init_app),
+# a broker outage delays the bridge but does not fail the startup
+@app.on_event("startup")
+async def start_mqtt():
+    async def connect_with_retry():
+        while True:
+            try:
+                await mqtt.mqtt_startup()
+                return
+            except Exception as e:
+                logger.error("MQTT connection failed, retrying in %ss: %s", MQTT_RETRY_SECONDS, e)
+                await asyncio.sleep(MQTT_RETRY_SECONDS)
+    app.state.mqtt_task = asyncio.create_task(connect_with_retry())
 
-mqtt.init_app(app)
+@app.on_event("shutdown")
+async def stop_mqtt():
+    app.state.mqtt_task.cancel()
+    if getattr(mqtt.client, "is_connected", False):
+        await mqtt.mqtt_shutdown()
+    # messages already received are still forwarded
+    bridge_executor.shutdown(wait=True)
 
 @mqtt.on_connect()
 def connect(client, flags, rc, properties):
     mqtt.client.subscribe("sensors/data")
-    print("Connected to MQTT Broker: ", rc)
+    logger.info("Connected to MQTT Broker: %s", rc)
 
 @mqtt.on_message()
 async def message(client, topic, payload, qos, properties):
-    print("Received message: ", topic, payload.decode())
+    message_logger.info("Received message", extra={"topic": topic, "bytes": len(payload)})
     try:
-        data = json.loads(payload.decode())
-        
         # 1. Forward to RabbitMQ (for Monitoring)
-        rabbitmq_helper.publish_event(
-            routing_key="device.telemetry",
-            message=data
-        )
-    except Exception as e:
-        print(f"Error processing MQTT message: {e}")
+        await asyncio.get_running_loop().run_in_executor(bridge_executor, forward_telemetry, payload)
+    except Exception:
+        logger.exception("Error processing MQTT message", extra={"topic": topic})
 
 @app.get("/")
 def root():
     return {"message": "Device Management Service Running"}
 
+# Tables are created by migrate.py, run once before the app.
+# Connections are opened on first use, startup does not wait for dependencies.
+@app.get("/healthz", tags=["health"])
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz", tags=["health"])
+def readyz():
+    checks = {}
+    try:
+        with get_engine().connect() as connection:
+            connection.execute(text("SELECT 1"))
+        checks["database"] = "ok"
+    except Exception as e:
+        checks["database"] = f"error: {e.__class__.__name__}"
+    # sensors keep publishing while the bridge reconnects, only reported
+    checks["mqtt"] = "ok" if getattr(mqtt.client, "is_connected", False) else "connecting"
+    ready = not checks["database"].startswith("error")
+    return JSONResponse(
+        {"status": "ready" if ready else "not ready", "checks": checks},
+        status_code=200 if ready else 503
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Admission counters of the MQTT bridge (Prometheus format)
+    return admission.render()
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
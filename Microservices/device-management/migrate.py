@@ -0,0 +1,12 @@
+"""One-shot schema creation, run before the app starts
+(k8s init container, docker-compose migrate service)"""
+from config.database import Base, get_engine
+from helpers.log import setup_logging, get_logger
+import models.device  # registers the tables on Base
+
+logger = get_logger("migrate")
+
+if __name__ == "__main__":
+    setup_logging()
+    Base.metadata.create_all(bind=get_engine())
+    logger.info("Schema up to date")
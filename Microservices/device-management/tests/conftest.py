@@ -0,0 +1,6 @@
+# The service modules import each other from the service root (business,
+# helpers, ...), as in the image. Run from the service directory : python -m pytest tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,99 @@
+import pytest
+from business import admission as admission_module
+from business.admission import AdmissionController, LocalBuckets, RedisBuckets, TAKE_TOKENS, parse_type_limits
+
+DEVICE = ("device:d1", 10.0, 3.0)
+TYPE = ("type:Camera", 1.0, 2.0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_local_buckets_allow_the_burst_then_refill_at_the_rate(clock):
+    buckets = LocalBuckets()
+    assert [buckets.take([DEVICE]) for _ in range(4)] == [True, True, True, False]
+    clock[0] += 0.1
+    assert [buckets.take([DEVICE]) for _ in range(2)] == [True, False]
+    clock[0] += 60
+    assert sum(buckets.take([DEVICE]) for _ in range(10)) == 3
+
+
+def test_local_buckets_take_from_every_bucket_or_none(clock):
+    buckets = LocalBuckets()
+    assert [buckets.take([DEVICE, TYPE]) for _ in range(3)] == [True, True, False]
+    # the refused message took no token from the device bucket
+    assert buckets.take([DEVICE]) is True
+    assert buckets.take([DEVICE]) is False
+
+
+def test_local_buckets_forget_full_buckets_past_the_limit(clock):
+    buckets = LocalBuckets(max_buckets=2)
+    for i in range(3):
+        buckets.take([(f"device:{i}", 10.0, 3.0)])
+    clock[0] += 60
+    buckets.take([DEVICE])
+    assert list(buckets.buckets) == ["device:d1"]
+
+
+@pytest.fixture
+def shared():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    buckets = RedisBuckets("redis://localhost:6379/0")
+    buckets.redis = fakeredis.FakeRedis()
+    buckets.script = buckets.redis.register_script(TAKE_TOKENS)
+    return buckets
+
+
+def test_token_script_allows_the_burst_and_takes_atomically(shared):
+    assert [shared.take([DEVICE, TYPE]) for _ in range(3)] == [True, True, False]
+    assert shared.take([DEVICE]) is True
+    assert shared.take([DEVICE]) is False
+    tokens, at = shared.redis.hmget("ingest:device:d1", "tokens", "at")
+    assert float(tokens) < 1
+    # kept until the bucket would be full again, plus a second
+    assert 0 < shared.redis.pttl("ingest:device:d1") <= 3 / 10 * 1000 + 1000
+
+
+def test_token_script_refills_on_redis_time(shared):
+    fast = ("device:d2", 1000.0, 1.0)
+    assert shared.take([fast]) is True
+    shared.redis.hset("ingest:device:d2", "at", float(shared.redis.hget("ingest:device:d2", "at")) - 1)
+    assert shared.take([fast]) is True
+
+
+def test_over_limit_outcomes_and_counters(clock, monkeypatch):
+    monkeypatch.setattr(admission_module.random, "random", lambda: 0.05)
+    message = {"device_id": "d1", "type": "Camera"}
+    outcomes = {}
+    for over_limit in ("drop", "sample", "downgrade"):
+        controller = AdmissionController(device_rate=1, device_burst=1, type_limits="Camera=100", over_limit=over_limit)
+        outcomes[over_limit] = [controller.admit(message) for _ in range(2)]
+    assert outcomes == {"drop": ["accepted", "dropped"], "sample": ["accepted", "sampled"],
+                        "downgrade": ["accepted", "downgraded"]}
+    controller.admit({"device_id": "d2", "type": "Spoofed"})
+    assert controller.render().splitlines()[2:] == [
+        'ingest_messages_total{outcome="accepted",type="Camera"} 1',
+        'ingest_messages_total{outcome="accepted",type="other"} 1',
+        'ingest_messages_total{outcome="downgraded",type="Camera"} 1',
+    ]
+
+
+def test_local_buckets_take_over_while_redis_is_unavailable(clock):
+    class Unavailable:
+        def take(self, limits):
+            raise ConnectionError("redis down")
+    controller = AdmissionController(device_rate=1, device_burst=1)
+    controller.shared = Unavailable()
+    assert [controller.admit({"device_id": "d1"}) for _ in range(2)] == ["accepted", "dropped"]
+    assert controller.shared_retry_at > clock[0]
+
+
+def test_type_limits_parse_rate_and_optional_burst():
+    assert parse_type_limits(" Camera=5:20, Sensor=2 ,") == {"Camera": (5.0, 20.0), "Sensor": (2.0, 2.0)}
+    with pytest.raises(ValueError):
+        AdmissionController(over_limit="queue")
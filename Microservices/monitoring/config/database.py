@@ -6,10 +6,25 @@ load_dotenv()
 
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("MONGO_DB_NAME", "monitoring_db")
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", 2000))
 
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
-collection = db["device_events"]
+# The client is built on first use, importing the app opens no connection
+_client = None
+
+def get_client() -> MongoClient:
+    global _client
+    if _client is None:
+        _client = MongoClient(MONGO_URL, connect=False, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+    return _client
 
 def get_db():
-    return db
+    return get_client()[DB_NAME]
+
+def get_collection(name: str = "device_events"):
+    return get_db()[name]
+
+def close_client():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -1,22 +1,45 @@
-from fastapi import APIRouter
-from config.database import collection
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from helpers.auth import require_token
+from services.archive import find_events, export_events
+from services.fleet import fleet
 
 router = APIRouter(
     prefix="/monitoring",
-    tags=["monitoring"]
+    tags=["monitoring"],
+    dependencies=[Depends(require_token)]
 )
 
 @router.get("/events")
-def get_events(limit: int = 100):
-    events = list(collection.find({}, {"_id": 0}).sort("timestamp", -1).limit(limit))
-    return events
+def get_events(
+    limit: int = Query(default=100, ge=1, le=10000),
+    device_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """Newest events first, ranges older than the hot retention are read from the archive"""
+    return find_events(limit, device_id, since, until)
+
+@router.get("/export")
+def export(device_id: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Every event of the range as NDJSON, oldest first"""
+    lines = (json.dumps(event, default=str) + "\n" for event in export_events(device_id, since, until))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@router.get("/fleet/summary")
+def fleet_summary():
+    """Devices by status/city/type, average usage and hottest cities, maintained event by event"""
+    return fleet.summary()
 
 # Integration of Prediction Service
-from services.prediction_service import prediction_service
+from services.prediction_service import get_prediction_service
 
 @router.get("/predict/{city}", tags=["machine-learning"])
-async def predict_city(city: str):
+def predict_city(city: str):
     """
     Predicts temperature for the next hour using Open-Meteo API and Scikit-Learn.
     """
-    return prediction_service.predict_temperature(city)
+    return get_prediction_service().predict_temperature(city)
@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+from fastapi import HTTPException, Security
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from jose import jwt, JWTError
+from helpers.log import get_logger
+
+# Verifies access tokens in-process with the public keys published by the
+# signing service, so no network call to /users/verify-token is needed per request.
+# Revocation is not checked here: access tokens are short-lived.
+# This file is shared verbatim by device-management and monitoring,
+# Microservices/tests/test_shared_helpers.py fails when the copies diverge.
+JWKS_URL = os.getenv("JWKS_URL", "http://signing:8000/.well-known/jwks.json")
+JWKS_CACHE_SECONDS = int(os.getenv("JWKS_CACHE_SECONDS", 300))
+JWKS_MIN_REFRESH_SECONDS = int(os.getenv("JWKS_MIN_REFRESH_SECONDS", 10))
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "false").lower() == "true"
+# unreachable signing service, or a body that is not a JWKS (proxy error page, key without kid)
+JWKS_ERRORS = (OSError, ValueError, KeyError)
+logger = get_logger("auth")
+
+
+class JWKSVerifier:
+    def __init__(self, url: str = JWKS_URL, cache_seconds: int = JWKS_CACHE_SECONDS):
+        self.url = url
+        self.cache_seconds = cache_seconds
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if self._fetched_at is not None:
+                age = now - self._fetched_at
+                # Unknown kids force a refresh (key rotation) but never more than once per interval
+                if age < (JWKS_MIN_REFRESH_SECONDS if force else self.cache_seconds):
+                    return
+            try:
+                with urllib.request.urlopen(self.url, timeout=5) as response:
+                    jwks = json.load(response)
+                if not isinstance(jwks, dict):
+                    raise ValueError("JWKS is not a JSON object")
+                keys = {key["kid"]: key for key in jwks.get("keys", [])}
+            except JWKS_ERRORS as e:
+                if not self._keys:
+                    raise
+                # Keep serving with the last known keys while signing is unreachable
+                logger.warning("JWKS refresh failed, using cached keys: %s", e)
+                self._fetched_at = now
+                return
+            self._keys = keys
+            self._fetched_at = now
+
+    def verify(self, token: str) -> dict:
+        kid = jwt.get_unverified_header(token).get("kid")
+        self._refresh()
+        key = self._keys.get(kid)
+        if key is None:
+            self._refresh(force=True)
+            key = self._keys.get(kid)
+        if key is None:
+            raise JWTError(f"Unknown signing key {kid}")
+        return jwt.decode(token, key, algorithms=[key.get("alg", "RS256")])
+
+
+verifier = JWKSVerifier()
+http_bearer = HTTPBearer(auto_error=False)
+
+
+def require_token(credentials: HTTPAuthorizationCredentials = Security(http_bearer)):
+    """FastAPI dependency returning the token claims, or None when AUTH_REQUIRED is off"""
+    if not AUTH_REQUIRED:
+        return None
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Missing token")
+    try:
+        return verifier.verify(credentials.credentials)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    except JWKS_ERRORS:
+        raise HTTPException(status_code=503, detail="Signing keys unavailable")
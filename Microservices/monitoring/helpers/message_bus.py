@@ -0,0 +1,508 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+from functools import partial
+from helpers import tracing
+from helpers.log import get_logger, LOG_RATE_LIMIT
+
+# Small message bus used by the services instead of hand-rolled pika code.
+# MESSAGE_BUS selects the backend : "rabbitmq" (default), "mqtt" or "memory".
+# The memory backend hands the published dict itself to subscribers (no
+# serialization), it is used by tests, the benchmark and the all-in-one mode.
+# This file is shared verbatim by device-management and monitoring,
+# Microservices/tests/test_shared_helpers.py fails when the copies diverge.
+MESSAGE_BUS = os.getenv("MESSAGE_BUS", "rabbitmq")
+EXCHANGE_NAME = os.getenv("BUS_EXCHANGE", "device_events")
+# publish and handler errors happen per message, they are rate limited
+logger = get_logger("message_bus", rate_limit=LOG_RATE_LIMIT)
+# Partitioned queues : messages are spread over N queues by hashing this header,
+# set from the message's device id when publishing through the bus. Each
+# partition has a single active consumer, a device's events stay in order.
+PARTITION_HEADER = "device_id"
+
+
+def topic_regex(pattern: str):
+    """AMQP topic pattern : '*' matches one word, '#' any number of words"""
+    words = []
+    for word in pattern.split("."):
+        if word == "#":
+            words.append(".*")
+        elif word == "*":
+            words.append("[^.]+")
+        else:
+            words.append(re.escape(word))
+    return re.compile("^" + r"\.".join(words) + "$")
+
+
+def partition_queue(queue_name: str, partition: int) -> str:
+    return f"{queue_name}.p{partition}"
+
+
+def partition_of(key, partitions: int) -> int:
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % partitions
+
+
+def with_partition_key(message, headers: dict = None):
+    """headers, plus the partition key of message when it has one"""
+    if isinstance(message, dict) and message.get(PARTITION_HEADER) is not None:
+        headers = dict(headers or {})
+        headers.setdefault(PARTITION_HEADER, str(message[PARTITION_HEADER]))
+    return headers
+
+
+def stamp_publish(headers: dict):
+    """headers with the broker_publish stamp of a sampled trace, taken by the
+    backend once the connection is up and the body serialized, just before the
+    message is handed to the broker : lock waits and reconnects are not counted
+    as broker transit. A stamp taken after the call returns could not travel
+    with the message"""
+    context = tracing.from_headers(headers)
+    if context is None:
+        return headers
+    tracing.stamp(context, "broker_publish")
+    return dict(headers, **tracing.to_headers(context))
+
+
+class Message:
+    __slots__ = ("routing_key", "body", "headers", "_ack", "_nack")
+
+    def __init__(self, routing_key: str, body, headers=None, ack=None, nack=None):
+        self.routing_key = routing_key
+        self.body = body
+        self.headers = headers or {}
+        self._ack = ack
+        self._nack = nack
+
+    def ack(self):
+        if self._ack:
+            self._ack()
+            self._ack = self._nack = None
+
+    def nack(self, requeue: bool = True):
+        if self._nack:
+            self._nack(requeue)
+            self._ack = self._nack = None
+
+
+class Subscription:
+    def __init__(self, cancel=None):
+        self._cancel = cancel
+
+    def cancel(self):
+        """Stop consuming, unacked messages go back to the queue"""
+        if self._cancel:
+            self._cancel()
+            self._cancel = None
+
+
+class MessageBus:
+    def publish(self, routing_key: str, message: dict, headers: dict = None):
+        raise NotImplementedError
+
+    def publish_batch(self, messages, headers: dict = None):
+        """messages : iterable of (routing_key, message)"""
+        for routing_key, message in messages:
+            self.publish(routing_key, message, headers)
+
+    def subscribe(self, queue_name: str, bindings, handler, prefetch: int = 100):
+        """Deliver every message matching one of the binding patterns to handler(Message).
+        Subscribers of the same queue_name compete for messages, at most prefetch
+        messages per subscriber are waiting for their ack"""
+        raise NotImplementedError
+
+    def declare_partitions(self, queue_name: str, bindings, partitions: int):
+        """Spread the messages matching bindings over partitions queues by partition key"""
+        raise NotImplementedError
+
+    def subscribe_partition(self, queue_name: str, partition: int, handler, prefetch: int = 100) -> Subscription:
+        """Consume one partition queue in order. Of the subscribers of a partition
+        only one is active, another one takes over when it cancels or dies"""
+        raise NotImplementedError
+
+    def retire_queue(self, queue_name: str, bindings) -> int:
+        """Unbind the unpartitioned queue replaced by the partitions of queue_name
+        (declare_partitions first) and move the messages it still holds to them.
+        Returns the messages moved, nothing outlives the process of in-memory backends"""
+        return 0
+
+    def close(self):
+        pass
+
+
+class MemoryBus(MessageBus):
+    def __init__(self, serialize: bool = False):
+        # serialize=True round-trips bodies through JSON like a real broker would
+        self.serialize = serialize
+        self._queues = {}
+        self._partitions = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def _declare(self, queue_name, bindings):
+        with self._lock:
+            if queue_name not in self._queues:
+                self._queues[queue_name] = (queue.Queue(), [])
+            target, patterns = self._queues[queue_name]
+            for binding in bindings:
+                patterns.append(topic_regex(binding))
+            return target
+
+    def publish(self, routing_key: str, message: dict, headers: dict = None):
+        body = json.dumps(message) if self.serialize else message
+        headers = with_partition_key(message, stamp_publish(headers))
+        for target, patterns in list(self._queues.values()):
+            if any(pattern.match(routing_key) for pattern in patterns):
+                target.put((routing_key, body, headers))
+        for patterns, targets, _ in list(self._partitions.values()):
+            if any(pattern.match(routing_key) for pattern in patterns):
+                key = (headers or {}).get(PARTITION_HEADER, routing_key)
+                targets[partition_of(key, len(targets))].put((routing_key, body, headers))
+
+    def _start_worker(self, target, handler, prefetch, name, stopped, active=None):
+        credits = threading.Semaphore(prefetch)
+
+        def nack(item, requeue):
+            if requeue:
+                target.put(item)
+            credits.release()
+
+        def worker():
+            # single active consumer : the worker holding the partition lock consumes
+            while active is not None and not active.acquire(timeout=0.5):
+                if stopped.is_set() or self._closed.is_set():
+                    return
+            try:
+                while not stopped.is_set() and not self._closed.is_set():
+                    credits.acquire()
+                    try:
+                        item = target.get(timeout=0.5)
+                    except queue.Empty:
+                        credits.release()
+                        continue
+                    routing_key, body, headers = item
+                    if self.serialize:
+                        body = json.loads(body)
+                    message = Message(routing_key, body, headers, ack=credits.release, nack=partial(nack, item))
+                    try:
+                        handler(message)
+                    except Exception:
+                        logger.exception("Error in bus handler")
+                        message.nack(requeue=False)
+            finally:
+                if active is not None:
+                    active.release()
+
+        threading.Thread(target=worker, name=f"bus-{name}", daemon=True).start()
+
+    def subscribe(self, queue_name: str, bindings, handler, prefetch: int = 100):
+        target = self._declare(queue_name, bindings)
+        self._start_worker(target, handler, prefetch, queue_name, threading.Event())
+
+    def declare_partitions(self, queue_name: str, bindings, partitions: int):
+        with self._lock:
+            if queue_name not in self._partitions:
+                self._partitions[queue_name] = (
+                    [topic_regex(binding) for binding in bindings],
+                    [queue.Queue() for _ in range(partitions)],
+                    [threading.Lock() for _ in range(partitions)]
+                )
+
+    def subscribe_partition(self, queue_name: str, partition: int, handler, prefetch: int = 100) -> Subscription:
+        _, targets, locks = self._partitions[queue_name]
+        stopped = threading.Event()
+        self._start_worker(
+            targets[partition], handler, prefetch, partition_queue(queue_name, partition), stopped, locks[partition]
+        )
+        return Subscription(stopped.set)
+
+    def close(self):
+        self._closed.set()
+
+
+class RabbitMQBus(MessageBus):
+    def __init__(self):
+        self.host = os.getenv("RABBITMQ_HOST", "rabbitmq")
+        self.port = int(os.getenv("RABBITMQ_PORT", 5672))
+        self.user = os.getenv("RABBITMQ_USER", "guest")
+        self.password = os.getenv("RABBITMQ_PASSWORD", "guest")
+        self.exchange = EXCHANGE_NAME
+        self.connection = None
+        self.channel = None
+        # pika connections are not thread safe, publishers share one behind a lock
+        self._lock = threading.Lock()
+        self._consumers = []
+        self._partitions = {}
+
+    def _parameters(self):
+        import pika
+        credentials = pika.PlainCredentials(self.user, self.password)
+        return pika.ConnectionParameters(host=self.host, port=self.port, credentials=credentials)
+
+    def _connect(self):
+        import pika
+        try:
+            self.connection = pika.BlockingConnection(self._parameters())
+            self.channel = self.connection.channel()
+            self.channel.exchange_declare(exchange=self.exchange, exchange_type='topic', durable=True)
+            logger.info("Connected to RabbitMQ")
+        except Exception as e:
+            logger.error("Failed to connect to RabbitMQ: %s", e)
+            self.connection = self.channel = None
+
+    def _publish_locked(self, routing_key, message, headers):
+        import pika
+        if not self.connection or self.connection.is_closed:
+            self._connect()
+        if self.channel and self.channel.is_open:
+            body = json.dumps(message)
+            self.channel.basic_publish(
+                exchange=self.exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=pika.BasicProperties(
+                    content_type="application/json", headers=with_partition_key(message, stamp_publish(headers))
+                )
+            )
+
+    def publish(self, routing_key: str, message: dict, headers: dict = None):
+        with self._lock:
+            try:
+                self._publish_locked(routing_key, message, headers)
+            except Exception as e:
+                logger.error("Failed to publish message: %s", e, extra={"routing_key": routing_key})
+
+    def publish_batch(self, messages, headers: dict = None):
+        with self._lock:
+            try:
+                for routing_key, message in messages:
+                    self._publish_locked(routing_key, message, headers)
+            except Exception as e:
+                logger.error("Failed to publish batch: %s", e)
+
+    def subscribe(self, queue_name: str, bindings, handler, prefetch: int = 100):
+        bindings = list(bindings)
+
+        def setup(channel):
+            channel.exchange_declare(exchange=self.exchange, exchange_type='topic', durable=True)
+            channel.queue_declare(queue=queue_name, exclusive=False, durable=True)
+            for binding in bindings:
+                channel.queue_bind(exchange=self.exchange, queue=queue_name, routing_key=binding)
+
+        thread = threading.Thread(
+            target=self._consume, args=(queue_name, setup, handler, prefetch, threading.Event(), {}),
+            name=f"bus-{queue_name}", daemon=True
+        )
+        self._consumers.append(thread)
+        thread.start()
+
+    def declare_partitions(self, queue_name: str, bindings, partitions: int):
+        # declared by every partition consumer when it connects, see _setup_partitions
+        self._partitions[queue_name] = (list(bindings), partitions)
+
+    def _setup_partitions(self, channel, queue_name):
+        """Consistent-hash exchange (rabbitmq_consistent_hash_exchange plugin) fed by the
+        bindings, hashing the partition header to partition queues of equal weight"""
+        bindings, partitions = self._partitions[queue_name]
+        hash_exchange = f"{queue_name}.partitions"
+        channel.exchange_declare(exchange=self.exchange, exchange_type='topic', durable=True)
+        channel.exchange_declare(
+            exchange=hash_exchange, exchange_type='x-consistent-hash', durable=True,
+            arguments={"hash-header": PARTITION_HEADER}
+        )
+        for binding in bindings:
+            channel.exchange_bind(destination=hash_exchange, source=self.exchange, routing_key=binding)
+        for partition in range(partitions):
+            name = partition_queue(queue_name, partition)
+            channel.queue_declare(queue=name, durable=True, arguments={"x-single-active-consumer": True})
+            channel.queue_bind(exchange=hash_exchange, queue=name, routing_key="1")
+
+    def retire_queue(self, queue_name: str, bindings) -> int:
+        import pika
+        connection = pika.BlockingConnection(self._parameters())
+        try:
+            channel = connection.channel()
+            # a moved message is acked once the broker has it
+            channel.confirm_delivery()
+            if queue_name in self._partitions:
+                # the partitions must be bound before anything is moved to them
+                self._setup_partitions(channel, queue_name)
+            try:
+                declared = channel.queue_declare(queue=queue_name, durable=True, passive=True)
+            except pika.exceptions.ChannelClosedByBroker:
+                return 0
+            for binding in bindings:
+                channel.queue_unbind(queue=queue_name, exchange=self.exchange, routing_key=binding)
+            consumers = declared.method.consumer_count
+            if consumers:
+                # replicas of the previous version drain it, deleted on the next run
+                logger.warning("%s unbound, still consumed by %d consumers", queue_name, consumers)
+                return 0
+            moved = 0
+            while True:
+                method, properties, body = channel.basic_get(queue_name)
+                if method is None:
+                    break
+                channel.basic_publish(exchange=self.exchange, routing_key=method.routing_key, body=body,
+                                      properties=properties)
+                channel.basic_ack(method.delivery_tag)
+                moved += 1
+            channel.queue_delete(queue=queue_name)
+            logger.info("%s deleted, %d messages moved to its partitions", queue_name, moved)
+            return moved
+        finally:
+            connection.close()
+
+    def subscribe_partition(self, queue_name: str, partition: int, handler, prefetch: int = 100) -> Subscription:
+        name = partition_queue(queue_name, partition)
+        stopped = threading.Event()
+        current = {}
+
+        def cancel():
+            stopped.set()
+            connection = current.get("connection")
+            if connection is not None and connection.is_open:
+                connection.add_callback_threadsafe(current["channel"].stop_consuming)
+
+        threading.Thread(
+            target=self._consume,
+            args=(name, partial(self._setup_partitions, queue_name=queue_name), handler, prefetch, stopped, current),
+            name=f"bus-{name}", daemon=True
+        ).start()
+        return Subscription(cancel)
+
+    def _consume(self, queue_name, setup, handler, prefetch, stopped, current):
+        import pika
+        while not stopped.is_set():
+            try:
+                connection = pika.BlockingConnection(self._parameters())
+                channel = connection.channel()
+                channel.basic_qos(prefetch_count=prefetch)
+                setup(channel)
+
+                def callback(ch, method, properties, body):
+                    tag = method.delivery_tag
+                    # acks may come from another thread, pika requires them on the connection thread
+                    ack = partial(connection.add_callback_threadsafe, partial(ch.basic_ack, delivery_tag=tag))
+
+                    def nack(requeue):
+                        connection.add_callback_threadsafe(partial(ch.basic_nack, delivery_tag=tag, requeue=requeue))
+
+                    try:
+                        message = Message(method.routing_key, json.loads(body), properties.headers, ack=ack, nack=nack)
+                    except ValueError as e:
+                        logger.error("Dropping undecodable message: %s", e, extra={"routing_key": method.routing_key})
+                        ch.basic_nack(delivery_tag=tag, requeue=False)
+                        return
+                    try:
+                        handler(message)
+                    except Exception:
+                        logger.exception("Error in bus handler")
+                        message.nack(requeue=False)
+
+                channel.basic_consume(queue=queue_name, on_message_callback=callback)
+                # published before the stop check, a cancel in between still stops the loop below
+                current["connection"], current["channel"] = connection, channel
+                if stopped.is_set():
+                    break
+                logger.info("Consuming %s", queue_name)
+                channel.start_consuming()
+            except pika.exceptions.AMQPConnectionError as e:
+                logger.error("RabbitMQ Connection failed, retrying in 5s: %s", e)
+                stopped.wait(5)
+            except Exception as e:
+                logger.error("RabbitMQ Consumer Error: %s, retrying in 5s", e)
+                stopped.wait(5)
+        # cancelled : closing the connection returns the unacked messages to the queue
+        connection = current.get("connection")
+        if connection is not None and connection.is_open:
+            connection.process_data_events(time_limit=0)  # pending acks
+            connection.close()
+        logger.info("Stopped consuming %s", queue_name)
+
+    def close(self):
+        with self._lock:
+            if self.connection and not self.connection.is_closed:
+                self.connection.close()
+
+
+class MqttBus(MessageBus):
+    """Routing keys map to MQTT topics ('.' -> '/'). Queue names become shared
+    subscriptions so subscribers of a queue compete. QoS 1 messages are acked
+    by the client library on receipt, ack() is a no-op"""
+
+    def __init__(self):
+        import paho.mqtt.client as mqtt
+        self.host = os.getenv("MQTT_HOST", "mosquitto")
+        self.port = int(os.getenv("MQTT_PORT", 1883))
+        try:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            self.client = mqtt.Client()
+        if os.getenv("MQTT_USER"):
+            self.client.username_pw_set(os.getenv("MQTT_USER"), os.getenv("MQTT_PASSWORD"))
+        self._subscriptions = []
+        self.client.on_connect = self._on_connect
+        self.client.connect_async(self.host, self.port, keepalive=60)
+        self.client.loop_start()
+
+    @staticmethod
+    def _topic(routing_key: str) -> str:
+        return routing_key.replace(".", "/")
+
+    @staticmethod
+    def _filter(binding: str) -> str:
+        return "/".join("+" if word == "*" else word for word in binding.split("."))
+
+    def _on_connect(self, client, userdata, *args):
+        for topic_filter, _ in self._subscriptions:
+            client.subscribe(topic_filter, qos=1)
+
+    def publish(self, routing_key: str, message: dict, headers: dict = None):
+        body = {"headers": stamp_publish(headers), "body": message} if headers else message
+        self.client.publish(self._topic(routing_key), json.dumps(body), qos=1)
+
+    def subscribe(self, queue_name: str, bindings, handler, prefetch: int = 100):
+        for binding in bindings:
+            topic_filter = f"$share/{queue_name}/{self._filter(binding)}"
+            self._subscriptions.append((topic_filter, handler))
+
+            def on_message(client, userdata, msg, handler=handler):
+                body = json.loads(msg.payload)
+                headers = None
+                if isinstance(body, dict) and set(body) == {"headers", "body"}:
+                    headers, body = body["headers"], body["body"]
+                try:
+                    handler(Message(msg.topic.replace("/", "."), body, headers))
+                except Exception:
+                    logger.exception("Error in bus handler")
+
+            self.client.message_callback_add(self._filter(binding), on_message)
+            self.client.subscribe(topic_filter, qos=1)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+BACKENDS = {"rabbitmq": RabbitMQBus, "mqtt": MqttBus, "memory": MemoryBus}
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus() -> MessageBus:
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = BACKENDS[MESSAGE_BUS]()
+    return _bus
+
+
+def set_bus(bus: MessageBus):
+    """Install a bus instance, e.g. a MemoryBus shared by services running in one process"""
+    global _bus
+    _bus = bus
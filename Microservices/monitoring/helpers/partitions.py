@@ -0,0 +1,101 @@
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from helpers.log import get_logger
+
+# Assignment of the partition queues (see helpers/message_bus.py) to the live
+# consumers. Members heartbeat in a Redis sorted set, every member computes the
+# same rendezvous-hash assignment and starts/stops its partition consumers.
+# Partition queues also have a single active consumer on the broker side, during
+# a handover the new owner waits until the previous one has let go.
+# Without PARTITION_COORDINATOR_URL a consumer owns every partition.
+PARTITION_COORDINATOR_URL = os.getenv("PARTITION_COORDINATOR_URL", "")
+PARTITION_HEARTBEAT = float(os.getenv("PARTITION_HEARTBEAT", 3))
+PARTITION_MEMBER_TTL = float(os.getenv("PARTITION_MEMBER_TTL", 10))
+logger = get_logger("partitions")
+
+
+def rendezvous_owner(partition: int, members) -> str:
+    return max(members, key=lambda member: hashlib.blake2b(f"{member}:{partition}".encode(), digest_size=8).digest())
+
+
+def assign(partitions: int, members, member: str) -> set:
+    """Partitions owned by member, identical on every member for the same membership"""
+    return {partition for partition in range(partitions) if rendezvous_owner(partition, members) == member}
+
+
+class PartitionCoordinator(threading.Thread):
+    def __init__(self, group: str, partitions: int, on_assign, on_revoke, redis_url: str = PARTITION_COORDINATOR_URL):
+        threading.Thread.__init__(self, name=f"partitions-{group}", daemon=True)
+        self.partitions = partitions
+        self.on_assign = on_assign
+        self.on_revoke = on_revoke
+        self.member = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.key = f"partitions:{group}:members"
+        self.owned = set()
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+        # a rebalance and the final revoke never interleave
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def members(self) -> list:
+        if self.redis is None:
+            return [self.member]
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.key, {self.member: now})
+        pipe.zremrangebyscore(self.key, "-inf", now - PARTITION_MEMBER_TTL)
+        pipe.zrange(self.key, 0, -1)
+        return [member.decode() for member in pipe.execute()[2]]
+
+    def rebalance(self):
+        with self._lock:
+            if self._stopped.is_set():
+                return
+            try:
+                members = self.members()
+            except Exception as e:
+                # keep the current partitions, the broker still allows a single active consumer each
+                logger.error("Partition membership unavailable: %s", e)
+                if self.owned:
+                    return
+                # unknown from the start : subscribe to every partition, single active
+                # consumer picks one replica per partition until the membership is back
+                members = [self.member]
+            owned = assign(self.partitions, members, self.member)
+            if owned == self.owned:
+                return
+            for partition in sorted(self.owned - owned):
+                self.on_revoke(partition)
+            for partition in sorted(owned - self.owned):
+                self.on_assign(partition)
+            self.owned = owned
+            logger.info("Owning %d/%d partitions with %d members", len(owned), self.partitions, len(members),
+                        extra={"partitions": sorted(owned)})
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.rebalance()
+            self._stopped.wait(PARTITION_HEARTBEAT)
+
+    def stop(self):
+        """Leave the group, the other members take the partitions over on their next heartbeat"""
+        self._stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout=PARTITION_HEARTBEAT + 5)
+        # waits for a rebalance still in flight, its heartbeat must not follow the zrem
+        with self._lock:
+            for partition in sorted(self.owned):
+                self.on_revoke(partition)
+            self.owned = set()
+            if self.redis is not None:
+                try:
+                    self.redis.zrem(self.key, self.member)
+                except Exception as e:
+                    logger.error("Could not leave partition group: %s", e)
@@ -1,11 +1,24 @@
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 import socketio
 from services.consumer import DeviceEventConsumer
+from config.database import get_client, close_client
+from services.archive import Archiver, ARCHIVE_ENABLED
+from services.fleet import FleetPersister
 import asyncio
+import os
 
 from controllers import monitoring_controller
+from helpers.auth import AUTH_REQUIRED, verifier
+from helpers import tracing
+from helpers.log import setup_logging, get_logger, LOG_RATE_LIMIT
+
+setup_logging()
+logger = get_logger("monitoring")
+# one record per dashboard connection or failed emit, rate limited
+socket_logger = get_logger("monitoring.socketio", rate_limit=LOG_RATE_LIMIT)
 
 app = FastAPI(title="Monitoring Service")
 
@@ -19,8 +32,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Replicas roles : "all" consumes, stores and serves dashboards, "worker" only
+# consumes and stores, "api" only serves dashboards
+MONITORING_ROLE = os.getenv("MONITORING_ROLE", "all")
+# redis://... or amqp://... : emits go through this queue and reach the
+# dashboards connected to any replica. Empty for a single replica.
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+
+def make_client_manager():
+    if not SOCKETIO_MESSAGE_QUEUE:
+        return None
+    # workers have no dashboards, they only publish
+    write_only = MONITORING_ROLE == "worker"
+    if SOCKETIO_MESSAGE_QUEUE.startswith(("redis://", "rediss://")):
+        return socketio.AsyncRedisManager(SOCKETIO_MESSAGE_QUEUE, write_only=write_only)
+    if SOCKETIO_MESSAGE_QUEUE.startswith(("amqp://", "amqps://")):
+        return socketio.AsyncAioPikaManager(SOCKETIO_MESSAGE_QUEUE, write_only=write_only)
+    raise ValueError(f"Unsupported SOCKETIO_MESSAGE_QUEUE: {SOCKETIO_MESSAGE_QUEUE}")
+
 # Socket.IO Setup
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', client_manager=make_client_manager())
 socket_app = socketio.ASGIApp(sio, app)
 
 # Helper to emit from sync thread
@@ -29,7 +60,7 @@ def emit_event(event, data):
         loop = asyncio.get_event_loop()
         asyncio.run_coroutine_threadsafe(sio.emit(event, data), loop)
     except Exception as e:
-        print(f"Emit error: {e}")
+        socket_logger.error("Emit error: %s", e)
 
 # Pass a wrapper or the raw object.
 # Since existing consumer code in previous step had issues with async emit, 
@@ -42,7 +73,7 @@ async def startup_event():
     # The consumer is in a thread, so it can't await. 
     # We will redefine Consumer to accept a loop.
     loop = asyncio.get_running_loop()
-    print("STARTUP: Monitoring Service Starting...")
+    logger.info("Monitoring service starting, role %s", MONITORING_ROLE)
 
     # Wrapper to bridge sync consumer thread -> async sio emit
     class SioWrapper:
@@ -54,26 +85,87 @@ async def startup_event():
             # Schedule the coroutine in the main event loop
             asyncio.run_coroutine_threadsafe(self.original_sio.emit(event, data), self.loop)
              
+    # Fleet summary : every role serves it, loaded and kept in sync from Mongo in the background
+    app.state.fleet_persister = FleetPersister()
+    app.state.fleet_persister.start()
+
     # Start Consumer
+    # The bus connects from its consumer thread, startup does not wait for RabbitMQ or Mongo
+    app.state.consumer = None
+    if MONITORING_ROLE == "api":
+        logger.info("api role, events come from the other replicas through the Socket.IO queue")
+        return
     try:
-        print("STARTUP: Initializing DeviceEventConsumer...")
         consumer = DeviceEventConsumer(SioWrapper(sio, loop))
         consumer.start()
-        print("STARTUP: DeviceEventConsumer started.")
-    except Exception as e:
-        print(f"STARTUP ERROR: Could not start consumer: {e}")
+        app.state.consumer = consumer
+        logger.info("DeviceEventConsumer started")
+    except Exception:
+        logger.exception("Could not start consumer")
+    # rolls the events older than the hot retention into the archive files
+    app.state.archiver = None
+    if ARCHIVE_ENABLED:
+        app.state.archiver = Archiver()
+        app.state.archiver.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    consumer = getattr(app.state, "consumer", None)
+    if consumer is not None:
+        consumer.stop()
+        consumer.bus.close()
+    if getattr(app.state, "archiver", None) is not None:
+        app.state.archiver.stop()
+    if getattr(app.state, "fleet_persister", None) is not None:
+        # last flush of the fleet state before the client closes
+        app.state.fleet_persister.stop()
+        app.state.fleet_persister.join(timeout=5)
+    close_client()
 
 @sio.event
-async def connect(sid, environ):
-    print("Client connected", sid)
+async def connect(sid, environ, auth=None):
+    if AUTH_REQUIRED:
+        token = (auth or {}).get("token")
+        if not token:
+            raise socketio.exceptions.ConnectionRefusedError("Missing token")
+        try:
+            await asyncio.to_thread(verifier.verify, token)
+        except Exception:
+            raise socketio.exceptions.ConnectionRefusedError("Invalid token")
+    socket_logger.info("Client connected", extra={"sid": sid})
 
 @sio.event
 async def disconnect(sid):
-    print("Client disconnected", sid)
+    socket_logger.info("Client disconnected", extra={"sid": sid})
 
 @app.get("/")
 def root():
     return {"message": "Monitoring Service Running"}
 
+@app.get("/healthz", tags=["health"])
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz", tags=["health"])
+def readyz():
+    checks = {}
+    if MONITORING_ROLE != "api":
+        checks["consumer"] = "ok" if getattr(app.state, "consumer", None) else "error: not started"
+    try:
+        get_client().admin.command("ping")
+        checks["mongo"] = "ok"
+    except Exception as e:
+        checks["mongo"] = f"error: {e.__class__.__name__}"
+    ready = all(state == "ok" for state in checks.values())
+    return JSONResponse(
+        {"status": "ready" if ready else "not ready", "checks": checks},
+        status_code=200 if ready else 503
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Per-hop latency histograms of the sampled pipeline traces (Prometheus format)
+    return tracing.metrics.render()
+
 if __name__ == "__main__":
     uvicorn.run("main:socket_app", host="0.0.0.0", port=8002, reload=True)
@@ -0,0 +1,39 @@
+"""One-shot schema setup (hot retention TTL, compact event documents, fleet
+sync index, partitioned queues), run before the app starts (k8s init
+container, docker-compose migrate service)"""
+from helpers.log import setup_logging, get_logger
+from helpers.message_bus import get_bus
+from services.archive import ensure_indexes, drop_legacy_indexes
+from services.consumer import BUS_PARTITIONS, QUEUE_NAME, BINDINGS
+from services.event_schema import migrate_events
+from services import fleet
+
+logger = get_logger("migrate")
+
+
+def retire_unpartitioned_queue() -> int:
+    """With BUS_PARTITIONS the durable unpartitioned queue is no longer
+    consumed, left bound it would pile up every event"""
+    bus = get_bus()
+    try:
+        bus.declare_partitions(QUEUE_NAME, BINDINGS, BUS_PARTITIONS)
+    except NotImplementedError:
+        return 0
+    try:
+        return bus.retire_queue(QUEUE_NAME, BINDINGS)
+    finally:
+        bus.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    ensure_indexes()
+    fleet.ensure_indexes()
+    migrated = migrate_events()
+    # events written meanwhile by a replica of the previous version are
+    # converted on the next run
+    drop_legacy_indexes()
+    logger.info("Indexes up to date, %d events migrated to the compact schema", migrated)
+    if BUS_PARTITIONS:
+        moved = retire_unpartitioned_queue()
+        logger.info("%d events moved from %s to its %d partitions", moved, QUEUE_NAME, BUS_PARTITIONS)
@@ -0,0 +1,196 @@
+"""Rebuilds derived data by replaying the stored device events
+
+The devices are spread by hash over --units work units, each unit replays the
+history of its devices (Mongo and the Parquet archive, in time order) through
+the selected stages in a worker process:
+
+    anomaly   scores the telemetry with the live detector and stores the
+              device.anomaly events, replacing those of the replayed range
+    fleet     rebuilds the latest state of every device for the fleet summary,
+              as of --until : the devices written live since are not replaced
+
+A finished unit is checkpointed in replay_checkpoints, running the same command
+again resumes the run (--restart starts over):
+
+    python replay.py --stages anomaly,fleet --since 2024-01-01 --workers 8
+"""
+import argparse
+import heapq
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pymongo import InsertOne
+from config.database import get_collection
+from helpers.message_bus import partition_of
+from services.anomaly import AnomalyDetector, is_telemetry, ANOMALY_BATCH_SIZE
+from services.archive import archived_until, export_events, to_naive_utc
+from services.event_schema import ROUTING_KINDS, split_event
+from services.fleet import FleetSummary
+
+REPLAY_WRITE_BATCH = int(os.getenv("REPLAY_WRITE_BATCH", 1000))
+# devices read side by side (one open cursor each), the detector vectorizes across them
+REPLAY_MERGE_DEVICES = int(os.getenv("REPLAY_MERGE_DEVICES", 256))
+ANOMALY_KIND = ROUTING_KINDS.index("device.anomaly")
+
+
+class AnomalyReplay:
+    """Detector state carried over the whole history of the unit. Only the hot
+    range is rewritten, archived days are immutable and expire from Mongo"""
+
+    def __init__(self, devices: list, since, until):
+        self.detector = AnomalyDetector(capacity=max(1, len(devices)))
+        self.batch = []
+        self.received = []
+        self.writes = []
+        boundary = archived_until()
+        self.write_since = max(since, boundary) if since and boundary else since or boundary
+        query = {"d": {"$in": devices}, "k": ANOMALY_KIND}
+        time_range = {key: value for key, value in (("$gte", self.write_since), ("$lt", until)) if value}
+        if time_range:
+            query["t"] = time_range
+        get_collection().delete_many(query)
+
+    def process(self, event: dict):
+        if is_telemetry(event["routing_key"]):
+            self.batch.append(event["data"])
+            self.received.append(event["timestamp"])
+            if len(self.batch) >= ANOMALY_BATCH_SIZE:
+                self.score()
+
+    def score(self):
+        if not self.batch:
+            return
+        # the cooldown runs on the receive times, device clocks may drift or replay
+        now = [received.replace(tzinfo=timezone.utc).timestamp() for received in self.received]
+        for alert in self.detector.alerts(self.batch, now):
+            row = alert.pop("row")
+            alert["timestamp"] = self.batch[row].get("timestamp") or now[row]
+            # stored as if raised live, when its sample was received
+            document, _ = split_event("device.anomaly", alert, self.received[row])
+            if self.write_since is None or document["t"] >= self.write_since:
+                self.writes.append(InsertOne(document))
+        self.batch = []
+        self.received = []
+        if len(self.writes) >= REPLAY_WRITE_BATCH:
+            self.write()
+
+    def write(self):
+        if self.writes:
+            get_collection().bulk_write(self.writes, ordered=False)
+            self.writes = []
+
+    def finish(self):
+        self.score()
+        self.write()
+
+
+class FleetReplay:
+    """Latest state of the devices, written back in bulk by the summary flush"""
+
+    def __init__(self, devices: list, since, until):
+        self.summary = FleetSummary()
+        self.until = until
+
+    def process(self, event: dict):
+        self.summary.apply(event["routing_key"], event["data"])
+
+    def finish(self):
+        self.summary.flush(until=self.until)
+
+
+STAGES = {"anomaly": AnomalyReplay, "fleet": FleetReplay}
+
+
+def replay_unit(unit: dict) -> dict:
+    started = time.perf_counter()
+    devices, since, until = unit["devices"], unit["since"], unit["until"]
+    stages = [STAGES[name](devices, since, until) for name in unit["stages"]]
+    events = 0
+    for i in range(0, len(devices), REPLAY_MERGE_DEVICES):
+        # every device in time order, interleaved with the others of the group
+        streams = [export_events(device_id, since, until) for device_id in devices[i:i + REPLAY_MERGE_DEVICES]]
+        for event in heapq.merge(*streams, key=lambda event: event["timestamp"]):
+            for stage in stages:
+                stage.process(event)
+            events += 1
+    for stage in stages:
+        stage.finish()
+    get_collection("replay_checkpoints").replace_one(
+        {"_id": unit["checkpoint"]},
+        {"run": unit["run"], "unit": unit["index"], "devices": len(devices), "events": events,
+         "finished_at": datetime.utcnow()},
+        upsert=True
+    )
+    return {"index": unit["index"], "events": events, "seconds": time.perf_counter() - started}
+
+
+def list_devices(selected) -> list:
+    if selected:
+        return sorted(selected)
+    # the catalog has every device ever stored, including the archived ones
+    devices = {document["_id"] for document in get_collection("devices").find({}, {"_id": 1})}
+    devices.update(device_id for device_id in get_collection().distinct("d") if device_id is not None)
+    return sorted(devices)
+
+
+def parse_date(value: str):
+    return to_naive_utc(datetime.fromisoformat(value)) if value else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default="anomaly,fleet", help=f"comma separated, among {', '.join(STAGES)}")
+    parser.add_argument("--since", default=None, help="ISO date, the whole history by default")
+    parser.add_argument("--until", default=None, help="ISO date, today 00:00 UTC by default")
+    parser.add_argument("--device", action="append", help="replay only this device (repeatable)")
+    parser.add_argument("--units", type=int, default=64, help="work units the devices are hashed into")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--run-id", default=None, help="checkpoint name, derived from the arguments by default")
+    parser.add_argument("--restart", action="store_true", help="drop the checkpoints of the run first")
+    args = parser.parse_args(argv)
+
+    stages = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    since = parse_date(args.since)
+    # a fixed default end keeps the run id, and its checkpoints, stable for the day
+    until = parse_date(args.until) or datetime.now(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0, tzinfo=None
+    )
+    run = args.run_id or f"{'+'.join(stages)}:{since or 'start'}:{until}"
+
+    checkpoints = get_collection("replay_checkpoints")
+    if args.restart:
+        checkpoints.delete_many({"run": run})
+    done = {document["unit"] for document in checkpoints.find({"run": run}, {"unit": 1})}
+
+    groups = [[] for _ in range(args.units)]
+    for device_id in list_devices(args.device):
+        groups[partition_of(device_id, args.units)].append(device_id)
+    units = [
+        {"index": index, "run": run, "checkpoint": f"{run}/{index}", "devices": devices,
+         "since": since, "until": until, "stages": stages}
+        for index, devices in enumerate(groups) if devices and index not in done
+    ]
+    print(f"Run {run}: {len(units)} units to replay, {len(done)} already done", flush=True)
+
+    started = time.perf_counter()
+    events = 0
+    # spawned workers open their own Mongo clients
+    with multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+        for finished, result in enumerate(pool.imap_unordered(replay_unit, units), 1):
+            events += result["events"]
+            elapsed = time.perf_counter() - started
+            rate = events / elapsed if elapsed else 0
+            eta = elapsed / finished * (len(units) - finished)
+            print(f"[{finished}/{len(units)}] unit {result['index']}: {result['events']} events in "
+                  f"{result['seconds']:.1f}s | total {events} events, {rate:,.0f} events/s, eta {eta:.0f}s", flush=True)
+    print(f"Replayed {events} events in {time.perf_counter() - started:.1f}s", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
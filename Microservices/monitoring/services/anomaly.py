@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+from helpers.log import get_logger, LOG_RATE_LIMIT
+
+# Streaming anomaly detection on the telemetry metrics.
+# Every device owns a slot (a row) in contiguous arrays holding the EWMA mean
+# and variance of each metric. Events are buffered and scored a micro-batch at
+# a time : one vectorized update per batch, O(1) work per event. A sample is
+# anomalous when its z-score against the device history or a fixed threshold
+# is crossed, it is published as a device.anomaly event.
+# With BUS_PARTITIONS every device is scored by a single replica, otherwise each
+# replica keeps the history of the share of events it consumes.
+ANOMALY_ENABLED = os.getenv("ANOMALY_ENABLED", "true").lower() == "true"
+ANOMALY_METRICS = ("temperature", "cpu_usage", "ram_usage", "disk_usage")
+# weight of the newest sample in the moving averages
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", 0.05))
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", 4))
+# samples seen before the z-score of a metric is trusted
+ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", 30))
+# standard deviation floor, flat signals do not alert on noise
+ANOMALY_MIN_STD = float(os.getenv("ANOMALY_MIN_STD", 0.5))
+# at most one alert per device and metric in this many seconds
+ANOMALY_COOLDOWN = float(os.getenv("ANOMALY_COOLDOWN", 60))
+ANOMALY_BATCH_SIZE = int(os.getenv("ANOMALY_BATCH_SIZE", 2048))
+ANOMALY_BATCH_INTERVAL = float(os.getenv("ANOMALY_BATCH_INTERVAL", 0.25))
+# "metric=limit,..." : absolute limits, alerting from the first sample
+ANOMALY_THRESHOLDS = os.getenv("ANOMALY_THRESHOLDS", "temperature=80,cpu_usage=95,ram_usage=95,disk_usage=95")
+logger = get_logger("monitoring.anomaly", rate_limit=LOG_RATE_LIMIT)
+
+
+def parse_thresholds(value: str) -> np.ndarray:
+    limits = np.full(len(ANOMALY_METRICS), np.inf)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        metric, limit = item.split("=")
+        limits[ANOMALY_METRICS.index(metric.strip())] = float(limit)
+    return limits
+
+
+def is_telemetry(routing_key: str) -> bool:
+    return routing_key == "device.telemetry" or routing_key.startswith("cloud-security-iot")
+
+
+class AnomalyDetector:
+    """EWMA mean/variance per device slot and metric, scored in micro-batches"""
+
+    def __init__(self, capacity: int = 1024, alpha: float = ANOMALY_ALPHA, z_threshold: float = ANOMALY_Z_THRESHOLD,
+                 warmup: int = ANOMALY_WARMUP, min_std: float = ANOMALY_MIN_STD, cooldown: float = ANOMALY_COOLDOWN,
+                 thresholds: str = ANOMALY_THRESHOLDS):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.min_std = min_std
+        self.cooldown = cooldown
+        self.limits = parse_thresholds(thresholds)
+        self.slots = {}
+        self.devices = []
+        shape = (capacity, len(ANOMALY_METRICS))
+        self.mean = np.zeros(shape)
+        self.var = np.zeros(shape)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.last_alert = np.full(shape, -np.inf)
+
+    def slot(self, device_id) -> int:
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = self.slots[device_id] = len(self.devices)
+            self.devices.append(device_id)
+            if slot >= len(self.mean):
+                self._grow()
+        return slot
+
+    def _grow(self):
+        for name in ("mean", "var", "count", "last_alert"):
+            array = getattr(self, name)
+            grown = np.full_like(array, -np.inf) if name == "last_alert" else np.zeros_like(array)
+            setattr(self, name, np.concatenate([array, grown]))
+
+    def update(self, slots: np.ndarray, values: np.ndarray, now=None) -> list:
+        """Scores then folds in a batch of samples (NaN for a missing metric).
+        A device seen several times in the batch is updated in order, one
+        vectorized round per occurrence. now : the time of the batch, or of
+        every sample (replays)"""
+        now = np.broadcast_to(np.asarray(time.time() if now is None else now, dtype=float), (len(slots),))
+        alerts = []
+        pending = np.arange(len(slots))
+        while pending.size:
+            _, first = np.unique(slots[pending], return_index=True)
+            rows = pending[first]
+            alerts.extend(self._update_rows(slots[rows], values[rows], rows, now[rows]))
+            pending = np.delete(pending, first)
+        return alerts
+
+    def alerts(self, events: list, now=None) -> list:
+        """Alerts of a batch of telemetry payloads, row : the index of the sample in events"""
+        slots = np.fromiter((self.slot(event.get("device_id")) for event in events), dtype=np.int64, count=len(events))
+        values = np.array([
+            [value if isinstance(value, (int, float)) else np.nan for value in (event.get(metric) for metric in ANOMALY_METRICS)]
+            for event in events
+        ], dtype=float).reshape(len(events), len(ANOMALY_METRICS))
+        return self.update(slots, values, now)
+
+    def score(self, events: list, now=None) -> list:
+        """Alerts of a batch of telemetry payloads, timestamped like their sample"""
+        alerts = self.alerts(events, now)
+        for alert in alerts:
+            alert["timestamp"] = events[alert.pop("row")].get("timestamp") or time.time()
+        return alerts
+
+    def _update_rows(self, slots, values, rows, now) -> list:
+        mean, var, count = self.mean[slots], self.var[slots], self.count[slots]
+        present = ~np.isnan(values)
+        std = np.sqrt(var)
+        deviation = values - mean
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.where(present & (std >= self.min_std), deviation / std, 0.0)
+        statistical = present & (count >= self.warmup) & (np.abs(z) > self.z_threshold)
+        over_limit = present & (values > self.limits)
+        anomalous = (statistical | over_limit) & (now[:, None] - self.last_alert[slots] >= self.cooldown)
+
+        # incremental EWMA, the first sample of a metric initializes it
+        increment = self.alpha * deviation
+        new_mean = np.where(count == 0, values, mean + increment)
+        new_var = np.where(count == 0, 0.0, (1 - self.alpha) * (var + deviation * increment))
+        self.mean[slots] = np.where(present, new_mean, mean)
+        self.var[slots] = np.where(present, new_var, var)
+        self.count[slots] = count + present
+
+        alerts = []
+        for i, metric in zip(*np.nonzero(anomalous)):
+            self.last_alert[slots[i], metric] = now[i]
+            alerts.append({
+                "row": int(rows[i]),
+                "device_id": self.devices[slots[i]],
+                "metric": ANOMALY_METRICS[metric],
+                "value": float(values[i, metric]),
+                "mean": float(mean[i, metric]),
+                "std": float(std[i, metric]),
+                "z_score": round(float(z[i, metric]), 2),
+                "reason": "threshold" if over_limit[i, metric] else "z_score"
+            })
+        return alerts
+
+
+class AnomalyStage(threading.Thread):
+    """Buffers the telemetry handed over by the consumer and publishes the
+    anomalies of every micro-batch as device.anomaly events"""
+
+    def __init__(self, bus, detector: AnomalyDetector = None, batch_size: int = ANOMALY_BATCH_SIZE,
+                 interval: float = ANOMALY_BATCH_INTERVAL):
+        threading.Thread.__init__(self, name="anomaly-stage", daemon=True)
+        self.bus = bus
+        self.detector = detector or AnomalyDetector()
+        self.batch_size = batch_size
+        self.interval = interval
+        # bounded : when scoring falls behind, the oldest samples are skipped
+        self.buffer = deque(maxlen=batch_size * 16)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def submit(self, event_data: dict):
+        self.buffer.append(event_data)
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def drain(self) -> list:
+        batch = []
+        while self.buffer and len(batch) < self.batch_size:
+            batch.append(self.buffer.popleft())
+        return batch
+
+    def process(self, batch: list) -> list:
+        alerts = self.detector.score(batch)
+        if alerts:
+            self.bus.publish_batch([("device.anomaly", alert) for alert in alerts])
+        return alerts
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            while self.buffer:
+                try:
+                    self.process(self.drain())
+                except Exception:
+                    logger.exception("Anomaly scoring failed")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
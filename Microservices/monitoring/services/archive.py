@@ -0,0 +1,288 @@
+import hashlib
+import heapq
+import json
+import os
+import re
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from config.database import get_db, get_collection
+from helpers.log import get_logger
+from services.event_schema import expand_all
+
+# Retention tiering of device_events.
+# Mongo keeps the last HOT_RETENTION_DAYS (TTL index, only while archiving is
+# enabled, otherwise events are kept). Older days are rolled by
+# the archiver into zstd Parquet files, one per day and device :
+#     ARCHIVE_DIR/day=2026-10-19/device=<device_id>-<digest>.parquet
+# archive_state.archived_until is the boundary : older events are read from the
+# archive files, newer ones from Mongo, so no event is returned twice.
+HOT_RETENTION_DAYS = float(os.getenv("HOT_RETENTION_DAYS", 7))
+# documents stay this long in Mongo after their day is due for archiving (see hot_ttl)
+ARCHIVE_GRACE_HOURS = float(os.getenv("ARCHIVE_GRACE_HOURS", 24))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 600))
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+# rows per Parquet row group, the unit a read loads (and skips by its time range)
+ARCHIVE_ROW_GROUP = int(os.getenv("ARCHIVE_ROW_GROUP", 8192))
+ARCHIVE_READ_BATCH = int(os.getenv("ARCHIVE_READ_BATCH", 512))
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true").lower() == "true"
+STATE_ID = "device_events"
+logger = get_logger("archive")
+
+
+def hot_ttl() -> int:
+    """Seconds an event stays in Mongo. The archiver rolls a day once the
+    horizon, rounded down to a day, has passed its end : up to HOT_RETENTION_DAYS
+    + 1 day after its first event. The grace covers the archiver interval and
+    a day that takes long to archive"""
+    return int(((HOT_RETENTION_DAYS + 1) * 24 + ARCHIVE_GRACE_HOURS) * 3600)
+
+
+def ensure_indexes():
+    """TTL on the hot events (run by migrate.py)"""
+    collection = get_collection()
+    if ARCHIVE_ENABLED:
+        ttl = hot_ttl()
+        try:
+            collection.create_index("t", name="ttl_t", expireAfterSeconds=ttl)
+        except OperationFailure:
+            # the retention changed : update the existing TTL in place
+            get_db().command("collMod", collection.name, index={"name": "ttl_t", "expireAfterSeconds": ttl})
+    elif "ttl_t" in collection.index_information():
+        # nothing would archive the expired events
+        collection.drop_index("ttl_t")
+        logger.warning("Archiving disabled, hot events no longer expire")
+    collection.create_index([("d", 1), ("t", -1)], name="device_t")
+
+
+def drop_legacy_indexes():
+    """Indexes of the legacy schema, dropped once every document is migrated"""
+    collection = get_collection()
+    existing = collection.index_information()
+    for name in ("ttl_timestamp", "device_timestamp"):
+        if name in existing:
+            collection.drop_index(name)
+
+
+def to_naive_utc(value):
+    # Mongo stores naive UTC datetimes
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def archived_until():
+    state = get_db()["archive_state"].find_one({"_id": STATE_ID}, {"archived_until": 1})
+    return state.get("archived_until") if state else None
+
+
+def device_file(device_id) -> str:
+    # the readable part is sanitized ("a/b" and "a b" both give a_b), the digest of the id keeps names unique
+    digest = hashlib.blake2b(repr(device_id).encode(), digest_size=6).hexdigest()
+    return f"device={re.sub(r'[^A-Za-z0-9_.-]', '_', str(device_id or '_unknown'))}-{digest}.parquet"
+
+
+def legacy_device_file(device_id) -> str:
+    """Name of the files archived before the digest was added, shared by the ids sanitized alike"""
+    return "device=" + re.sub(r"[^A-Za-z0-9_.-]", "_", str(device_id or "_unknown")) + ".parquet"
+
+
+def day_dir(day: datetime) -> str:
+    return os.path.join(ARCHIVE_DIR, f"day={day:%Y-%m-%d}")
+
+
+def write_partition(day: datetime, device_id, documents: list):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    columns = {
+        "timestamp": pa.array([document["timestamp"] for document in documents], pa.timestamp("ms")),
+        "routing_key": pa.array([document.get("routing_key") for document in documents]).dictionary_encode()
+    }
+    try:
+        columns["data"] = pa.array([document.get("data") for document in documents])
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # a field changed type within the day, keep the payloads as JSON
+        columns["data_json"] = pa.array([json.dumps(document.get("data"), default=str) for document in documents])
+    table = pa.table(columns)
+    directory = day_dir(day)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, device_file(device_id))
+    pq.write_table(table, path + ".tmp", compression=ARCHIVE_COMPRESSION, row_group_size=ARCHIVE_ROW_GROUP)
+    os.replace(path + ".tmp", path)
+
+
+def archive_day(day: datetime) -> int:
+    by_device = {}
+    cursor = get_collection().find(
+        {"t": {"$gte": day, "$lt": day + timedelta(days=1)}}, {"_id": 0}
+    ).sort("t", 1)
+    # archive files keep the expanded events, Parquet dictionary-encodes the repeated metadata
+    for document in expand_all(cursor):
+        device_id = document["data"].get("device_id")
+        by_device.setdefault(device_id, []).append(document)
+    for device_id, documents in by_device.items():
+        write_partition(day, device_id, documents)
+    return sum(len(documents) for documents in by_device.values())
+
+
+def row_groups(metadata, since=None, until=None) -> list:
+    """Row groups of a file that may hold events of [since, until), by their timestamp statistics"""
+    column = next(i for i in range(metadata.num_columns) if metadata.schema.column(i).path == "timestamp")
+    groups = []
+    for group in range(metadata.num_row_groups):
+        statistics = metadata.row_group(group).column(column).statistics
+        if statistics is not None and statistics.has_min_max and (
+                (since is not None and statistics.max < since) or (until is not None and statistics.min >= until)):
+            continue
+        groups.append(group)
+    return groups
+
+
+def read_file(path: str, since=None, until=None, device_id=None, descending: bool = False):
+    """Events of [since, until) in an archive file, in time order (newest first when
+    descending). Read lazily a row group at a time, the file is only open while one
+    is read : a day merges the files of every device"""
+    import pyarrow.parquet as pq
+    with pq.ParquetFile(path) as parquet:
+        groups = row_groups(parquet.metadata, since, until)
+    for group in reversed(groups) if descending else groups:
+        with pq.ParquetFile(path) as parquet:
+            batches = list(parquet.iter_batches(batch_size=ARCHIVE_READ_BATCH, row_groups=[group]))
+        for batch in reversed(batches) if descending else batches:
+            rows = batch.to_pylist()
+            for row in reversed(rows) if descending else rows:
+                if (since is not None and row["timestamp"] < since) or (until is not None and row["timestamp"] >= until):
+                    continue
+                if "data_json" in row:
+                    data = json.loads(row.pop("data_json"))
+                else:
+                    # struct columns hold every field seen that day, drop the absent ones
+                    data = {key: value for key, value in (row.get("data") or {}).items() if value is not None}
+                if device_id is not None and data.get("device_id") != device_id:
+                    # a legacy file may hold the events of several ids
+                    continue
+                yield {"routing_key": row["routing_key"], "data": data, "timestamp": row["timestamp"]}
+
+
+def read_archive(since=None, until=None, device_id=None, descending: bool = True):
+    """Archived events of [since, until), a day at a time, newest first by default"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return
+    days = sorted((name for name in os.listdir(ARCHIVE_DIR) if name.startswith("day=")), reverse=descending)
+    for name in days:
+        day = datetime.strptime(name[4:], "%Y-%m-%d")
+        if (since is not None and day + timedelta(days=1) <= since) or (until is not None and day >= until):
+            continue
+        directory = os.path.join(ARCHIVE_DIR, name)
+        if device_id is not None:
+            names = (device_file(device_id), legacy_device_file(device_id))
+            files = [file for file in names if os.path.exists(os.path.join(directory, file))][:1]
+        else:
+            files = [file for file in os.listdir(directory) if file.endswith(".parquet")]
+        runs = [read_file(os.path.join(directory, file), since, until, device_id, descending) for file in files]
+        yield from heapq.merge(*runs, key=lambda event: event["timestamp"], reverse=descending)
+
+
+def hot_query(since, until, device_id, boundary) -> dict:
+    timestamp = {}
+    if boundary is not None:
+        since = max(since, boundary) if since is not None else boundary
+    if since is not None:
+        timestamp["$gte"] = since
+    if until is not None:
+        timestamp["$lt"] = until
+    query = {"t": timestamp} if timestamp else {}
+    if device_id is not None:
+        query["d"] = device_id
+    return query
+
+
+def find_events(limit: int, device_id=None, since=None, until=None) -> list:
+    """Newest events first, from Mongo then from the archive for older ranges"""
+    since, until = to_naive_utc(since), to_naive_utc(until)
+    boundary = archived_until()
+    events = list(expand_all(
+        get_collection().find(hot_query(since, until, device_id, boundary), {"_id": 0})
+        .sort("t", -1).limit(limit)
+    ))
+    if len(events) < limit and boundary is not None and (since is None or since < boundary):
+        cold_until = min(until, boundary) if until is not None else boundary
+        events.extend(islice(read_archive(since, cold_until, device_id), limit - len(events)))
+    return events
+
+
+def export_events(device_id=None, since=None, until=None):
+    """Every event of the range, oldest first"""
+    since, until = to_naive_utc(since), to_naive_utc(until)
+    boundary = archived_until()
+    if boundary is not None and (since is None or since < boundary):
+        cold_until = min(until, boundary) if until is not None else boundary
+        yield from read_archive(since, cold_until, device_id, descending=False)
+    yield from expand_all(get_collection().find(hot_query(since, until, device_id, boundary), {"_id": 0}).sort("t", 1))
+
+
+class Archiver(threading.Thread):
+    """Rolls the days older than the hot retention into the archive. Replicas
+    share the work through a lease in archive_state, one of them archives"""
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL):
+        threading.Thread.__init__(self, name="archiver", daemon=True)
+        self.interval = interval
+        self.owner = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self._stopped = threading.Event()
+
+    def acquire_lease(self, seconds: float) -> bool:
+        now = datetime.utcnow()
+        try:
+            state = get_db()["archive_state"].find_one_and_update(
+                {"_id": STATE_ID, "$or": [
+                    {"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}, {"lease_owner": self.owner}
+                ]},
+                {"$set": {"lease_owner": self.owner, "lease_until": now + timedelta(seconds=seconds)}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # held by another replica
+            return False
+        return state is not None
+
+    def run_once(self) -> int:
+        if not self.acquire_lease(self.interval * 2):
+            return 0
+        states = get_db()["archive_state"]
+        # days before the horizon are complete and out of the hot retention
+        horizon = (datetime.utcnow() - timedelta(days=HOT_RETENTION_DAYS)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        day = archived_until()
+        if day is None:
+            oldest = get_collection().find_one({}, {"t": 1}, sort=[("t", 1)])
+            if oldest is None:
+                return 0
+            day = oldest["t"].replace(hour=0, minute=0, second=0, microsecond=0)
+        archived = 0
+        while day < horizon and not self._stopped.is_set():
+            if not self.acquire_lease(self.interval * 2):
+                break
+            count = archive_day(day)
+            day += timedelta(days=1)
+            states.update_one({"_id": STATE_ID}, {"$set": {"archived_until": day}})
+            archived += count
+            logger.info("Archived %d events of %s", count, f"{day - timedelta(days=1):%Y-%m-%d}")
+        return archived
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Archiving failed")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
@@ -1,83 +1,111 @@
-import pika
 import os
-import json
-import threading
-from config.database import collection
-from datetime import datetime
+from config.database import get_collection
+from helpers import tracing
+from helpers.log import get_logger, LOG_SAMPLE_RATE, LOG_RATE_LIMIT
+from helpers.message_bus import get_bus
+from helpers.partitions import PartitionCoordinator
+from services.anomaly import AnomalyStage, ANOMALY_ENABLED, is_telemetry
+from services.event_schema import compact
+from services.fleet import fleet
 
-class DeviceEventConsumer(threading.Thread):
-    def __init__(self, sio):
-        threading.Thread.__init__(self)
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", 100))
+# > 0 : events are spread over this many queues by device id, each consumed in order by one replica
+BUS_PARTITIONS = int(os.getenv("BUS_PARTITIONS", 0))
+QUEUE_NAME = "monitoring_queue_v2"
+# Bind to all device events (Legacy + New AMQP)
+BINDINGS = ["device.#", "cloud-security-iot.iot.#"]
+logger = get_logger("monitoring.consumer", rate_limit=LOG_RATE_LIMIT)
+# one record per event, sampled
+event_logger = get_logger("monitoring.consumer.events", sample_rate=LOG_SAMPLE_RATE, rate_limit=LOG_RATE_LIMIT)
+
+class DeviceEventConsumer:
+    def __init__(self, sio, bus=None):
         self.sio = sio
-        self.host = os.getenv("RABBITMQ_HOST", "rabbitmq")
-        self.port = int(os.getenv("RABBITMQ_PORT", 5672))
-        self.user = os.getenv("RABBITMQ_USER", "guest")
-        self.password = os.getenv("RABBITMQ_PASSWORD", "guest")
-        self.exchange = "device_events"
-        self.queue_name = "monitoring_queue"
-        self.daemon = True # Daemon thread to exit when main program exits
+        self.bus = bus or get_bus()
+        self.queue_name = QUEUE_NAME
+        self.bindings = BINDINGS
+        self.coordinator = None
+        self.subscriptions = {}
+        self.anomalies = AnomalyStage(self.bus) if ANOMALY_ENABLED else None
 
-    def run(self):
-        try:
-            # Retry logic for RabbitMQ connection
-            while True:
-                try:
-                    credentials = pika.PlainCredentials(self.user, self.password)
-                    parameters = pika.ConnectionParameters(host=self.host, port=self.port, credentials=credentials)
-                    connection = pika.BlockingConnection(parameters)
-                    break # Connection successful
-                except pika.exceptions.AMQPConnectionError as e:
-                    print(f"RabbitMQ Connection failed, retrying in 5s: {e}")
-                    import time
-                    time.sleep(5)
-            channel = connection.channel()
+    def start(self):
+        """Subscribe to device events, the bus delivers them on its own thread(s)"""
+        if self.anomalies is not None:
+            self.anomalies.start()
+        if BUS_PARTITIONS:
+            try:
+                self.bus.declare_partitions(self.queue_name, self.bindings, BUS_PARTITIONS)
+            except NotImplementedError:
+                logger.warning("%s has no partitioned queues, consuming unpartitioned", type(self.bus).__name__)
+            else:
+                self.coordinator = PartitionCoordinator(self.queue_name, BUS_PARTITIONS, self.assign, self.revoke)
+                self.coordinator.start()
+                logger.info("Starting to consume %s in %d partitions", self.queue_name, BUS_PARTITIONS)
+                return
+        self.bus.subscribe(self.queue_name, self.bindings, self.on_message, prefetch=CONSUMER_PREFETCH)
+        logger.info("Starting to consume %s", self.queue_name)
 
-            self.queue_name = "monitoring_queue_v2" # Force new queue
+    def assign(self, partition):
+        self.subscriptions[partition] = self.bus.subscribe_partition(
+            self.queue_name, partition, self.on_message, prefetch=CONSUMER_PREFETCH
+        )
 
-            channel.exchange_declare(exchange=self.exchange, exchange_type='topic', durable=True)
-            result = channel.queue_declare(queue=self.queue_name, exclusive=False, durable=True)
-            queue_name = result.method.queue
+    def revoke(self, partition):
+        self.subscriptions.pop(partition).cancel()
 
-            # Bind to all device events (Legacy + New AMQP)
-            channel.queue_bind(exchange=self.exchange, queue=queue_name, routing_key="device.#")
-            channel.queue_bind(exchange=self.exchange, queue=queue_name, routing_key="cloud-security-iot.iot.#")
+    def stop(self):
+        if self.coordinator is not None:
+            self.coordinator.stop()
+        if self.anomalies is not None:
+            self.anomalies.stop()
 
-            print(f" [*] Waiting for device events. To exit press CTRL+C", flush=True)
-            
-            def callback(ch, method, properties, body):
-                try:
-                    event_data = json.loads(body)
-                    routing_key = method.routing_key
-                    
-                    # Normalize type for Frontend (which expects 'device.telemetry')
-                    frontend_event_type = routing_key
-                    if routing_key.startswith("cloud-security-iot"):
-                        frontend_event_type = "device.telemetry"
+    def on_message(self, message):
+        trace = tracing.from_headers(message.headers)
+        tracing.stamp(trace, "consumer_receive")
+        try:
+            # Edge spools replay many samples per message
+            if isinstance(message.body, list):
+                for item in message.body:
+                    self.handle_message(message.routing_key, item)
+                tracing.finish(trace, routing_key=message.routing_key, batch=len(message.body))
+            else:
+                self.handle_message(message.routing_key, message.body, trace)
+        except Exception:
+            logger.exception("Error processing message", extra={"routing_key": message.routing_key})
 
-                    # 1. Store in MongoDB
-                    try:
-                        document = {
-                            "routing_key": routing_key,
-                            "data": event_data,
-                            "timestamp": datetime.utcnow()
-                        }
-                        collection.insert_one(document)
-                    except Exception as e:
-                        print(f"Error saving to MongoDB: {e}", flush=True)
+        message.ack()
 
-                    # 2. Emit via Socket.IO
-                    # self.sio is the SioWrapper passed from main.py, so .emit() is thread-safe
-                    print(f"[Consumer] Emitting socket event: {frontend_event_type} for device {event_data.get('device_id')}", flush=True)
-                    self.sio.emit('device_update', {'type': frontend_event_type, 'data': event_data})
-                    
-                except Exception as e:
-                    print(f"Error processing message: {e}", flush=True)
+    def handle_message(self, routing_key, event_data, trace=None):
+        """Store one device event and broadcast it to the dashboards"""
+        # Each event is consumed by one replica only (competing consumers) and
+        # stored once, the broadcast reaches every replica through the Socket.IO manager
+        self.persist(routing_key, event_data, trace)
+        self.broadcast(routing_key, event_data, trace)
+        fleet.apply(routing_key, event_data)
+        if self.anomalies is not None and is_telemetry(routing_key):
+            self.anomalies.submit(event_data)
+        tracing.finish(trace, routing_key=routing_key, device_id=event_data.get('device_id'))
 
-                ch.basic_ack(delivery_tag=method.delivery_tag)
+    def persist(self, routing_key, event_data, trace=None):
+        try:
+            get_collection().insert_one(compact(routing_key, event_data))
+            tracing.stamp(trace, "mongo_write")
+        except Exception as e:
+            logger.error("Error saving to MongoDB: %s", e, extra={"device_id": event_data.get("device_id")})
 
-            print("[Consumer] Starting to consume...", flush=True)
-            channel.basic_consume(queue=queue_name, on_message_callback=callback)
-            channel.start_consuming()
+    def broadcast(self, routing_key, event_data, trace=None):
+        if routing_key == "device.anomaly":
+            self.sio.emit('device_alert', event_data)
+            return
+        if routing_key == "device.telemetry.throttled":
+            # over the ingest rate limit of its device (device-management admission), stored only
+            return
+        # Normalize type for Frontend (which expects 'device.telemetry')
+        frontend_event_type = routing_key
+        if routing_key.startswith("cloud-security-iot"):
+            frontend_event_type = "device.telemetry"
 
-        except Exception as e:
-            print(f"RabbitMQ Consumer Error: {e}")
+        # self.sio is the SioWrapper passed from main.py, so .emit() is thread-safe
+        event_logger.info("Emitting socket event", extra={"event_type": frontend_event_type, "device_id": event_data.get("device_id")})
+        self.sio.emit('device_update', {'type': frontend_event_type, 'data': event_data})
+        tracing.stamp(trace, "socket_emit")
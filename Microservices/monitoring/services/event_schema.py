@@ -0,0 +1,190 @@
+import os
+import threading
+from datetime import datetime
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+from config.database import get_collection
+from helpers.log import get_logger
+
+# Storage schema of device_events (v2). The message payload is not stored as is,
+# every event is normalized into short top-level fields :
+#     d    device id
+#     t    receive time : indexed, TTL and archive tiering field
+#     ts   the payload timestamp, as sent (device clock, spooled replays)
+#     k    routing key, as an index of ROUTING_KINDS when it is a known one
+#     tp, hu, cpu, ram, dsk    the metrics every sensor sends, numbers as sent
+#     x    anything else (power_usage, network_in, ...), only when present
+#     md   the name/type/city of the payload, only when they differ from the
+#          metadata the device first sent for this kind of event
+# The first metadata of every device and kind is kept once in the devices
+# collection (m.<k>) and never changes afterwards, an event expands to the
+# metadata it carried even after the device is renamed or moved.
+# expand() gives back the historical {routing_key, data, timestamp} shape, for
+# v2 and legacy documents alike, so readers never see the storage schema.
+ROUTING_KINDS = (
+    "device.telemetry", "device.created", "device.updated", "device.deleted",
+    # "{}" is the device id the edge appends to its routing keys
+    "cloud-security-iot.iot.telemetry.{}", "cloud-security-iot.iot.temperature.{}",
+    "device.anomaly"
+)
+METRICS = {"temperature": "tp", "humidity": "hu", "cpu_usage": "cpu", "ram_usage": "ram", "disk_usage": "dsk"}
+METADATA = ("name", "type", "city")
+MIGRATION_BATCH = int(os.getenv("MIGRATION_BATCH", 1000))
+logger = get_logger("event_schema")
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def routing_kind(routing_key: str, device_id):
+    for i, kind in enumerate(ROUTING_KINDS):
+        if kind.format(device_id) == routing_key:
+            return i
+    return routing_key
+
+
+def split_event(routing_key: str, data: dict, received: datetime):
+    """(v2 document without md, metadata of the payload) of one event payload"""
+    document = {"d": data.get("device_id"), "t": received}
+    document["k"] = routing_kind(routing_key, document["d"])
+    metadata, extras = {}, {}
+    for key, value in data.items():
+        if key in METRICS and is_number(value):
+            document[METRICS[key]] = value
+        elif key in METADATA:
+            metadata[key] = value
+        elif key == "timestamp" and is_number(value):
+            document["ts"] = value
+        elif key != "device_id":
+            extras[key] = value
+    if extras:
+        document["x"] = extras
+    return document, metadata
+
+
+def expand(document: dict, baseline: dict = None) -> dict:
+    """Event in the {routing_key, data, timestamp} shape. baseline : the first
+    metadata of the device for the kind of the document (DeviceCatalog)"""
+    if "data" in document:
+        # legacy document, stored as received
+        return {key: document[key] for key in ("routing_key", "data", "timestamp") if key in document}
+    device_id = document.get("d")
+    kind = document.get("k")
+    data = {"device_id": device_id} if device_id is not None else {}
+    data.update(document["md"] if "md" in document else baseline or {})
+    for key, short in METRICS.items():
+        if short in document:
+            data[key] = document[short]
+    if "ts" in document:
+        data["timestamp"] = document["ts"]
+    data.update(document.get("x") or {})
+    return {
+        "routing_key": ROUTING_KINDS[kind].format(device_id) if isinstance(kind, int) else kind,
+        "data": data,
+        "timestamp": document["t"]
+    }
+
+
+class DeviceCatalog:
+    """First metadata of every device and kind of event, written once"""
+
+    def __init__(self):
+        # (device id, kind) -> metadata
+        self._known = {}
+        self._lock = threading.Lock()
+
+    def baseline(self, device_id, kind, metadata: dict) -> dict:
+        """The stored metadata of (device, kind), metadata when it is the first"""
+        key = (device_id, kind)
+        with self._lock:
+            known = self._known.get(key)
+        if known is not None:
+            return known
+        field = f"m.{kind}"
+        try:
+            # only set when absent : replicas racing on a new device keep the first one
+            get_collection("devices").update_one(
+                {"_id": device_id, field: {"$exists": False}}, {"$set": {field: metadata}}, upsert=True
+            )
+            known = metadata
+        except DuplicateKeyError:
+            record = get_collection("devices").find_one({"_id": device_id}, {field: 1})
+            known = ((record or {}).get("m") or {}).get(str(kind), metadata)
+        with self._lock:
+            self._known[key] = known
+        return known
+
+    def remember(self, document: dict, metadata: dict):
+        """Adds md to a v2 document whose metadata differs from the baseline"""
+        device_id, kind = document["d"], document["k"]
+        if device_id is None or not isinstance(kind, int):
+            # no catalog entry to refer to
+            if metadata:
+                document["md"] = metadata
+            return document
+        if self.baseline(device_id, kind, metadata) != metadata:
+            document["md"] = metadata
+        return document
+
+    def lookup(self, device_ids) -> dict:
+        """device id -> {kind: baseline}"""
+        ids = list({device_id for device_id in device_ids if device_id is not None})
+        if not ids:
+            return {}
+        return {
+            document["_id"]: {int(kind): metadata for kind, metadata in (document.get("m") or {}).items()}
+            for document in get_collection("devices").find({"_id": {"$in": ids}}, {"m": 1})
+        }
+
+
+catalog = DeviceCatalog()
+
+
+def compact(routing_key: str, data: dict, received: datetime = None) -> dict:
+    """v2 document of an incoming event"""
+    document, metadata = split_event(routing_key, data, received or datetime.utcnow())
+    return catalog.remember(document, metadata)
+
+
+def expand_all(documents, batch: int = 1000):
+    """Expanded events of an iterable of stored documents, baselines read a batch at a time"""
+    pending = []
+    for document in documents:
+        pending.append(document)
+        if len(pending) >= batch:
+            yield from _expand_batch(pending)
+            pending = []
+    yield from _expand_batch(pending)
+
+
+def _expand_batch(documents: list):
+    baselines = catalog.lookup(document.get("d") for document in documents if "md" not in document)
+    for document in documents:
+        yield expand(document, baselines.get(document.get("d"), {}).get(document.get("k")))
+
+
+def migrate_events(batch: int = MIGRATION_BATCH) -> int:
+    """Rewrites the legacy documents in the v2 schema, in place. Idempotent and
+    resumable : only documents still holding a data field are read"""
+    collection = get_collection()
+    migrated = 0
+    last_id = None
+    while True:
+        query = {"data": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        documents = list(collection.find(query).sort("_id", 1).limit(batch))
+        if not documents:
+            return migrated
+        requests = []
+        for legacy in documents:
+            data = legacy.get("data") or {}
+            document, metadata = split_event(legacy.get("routing_key", ""), data, legacy.get("timestamp"))
+            catalog.remember(document, metadata)
+            document["_id"] = legacy["_id"]
+            requests.append(ReplaceOne({"_id": legacy["_id"], "data": {"$exists": True}}, document))
+        collection.bulk_write(requests, ordered=False)
+        migrated += len(requests)
+        last_id = documents[-1]["_id"]
+        logger.info("Migrated %d events to the compact schema", migrated)
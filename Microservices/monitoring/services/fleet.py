@@ -0,0 +1,199 @@
+import heapq
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from config.database import get_collection
+from helpers.log import get_logger
+
+# Fleet-wide summary (devices by status/city/type, average usage, hottest
+# cities) kept up to date event by event, a read does not scan the fleet.
+# The state of every device (one record in the devices collection, next to its
+# metadata) is written back every FLEET_PERSIST_INTERVAL. Each sync also reads
+# the records other replicas changed since the previous one, so every replica
+# serves the whole fleet from memory.
+FLEET_PERSIST_INTERVAL = float(os.getenv("FLEET_PERSIST_INTERVAL", 5))
+FLEET_HOTTEST_CITIES = int(os.getenv("FLEET_HOTTEST_CITIES", 5))
+# records written within this window of the last sync are read again
+SYNC_OVERLAP = timedelta(seconds=2)
+FIELDS = ("status", "city", "type")
+AVERAGED = ("cpu_usage", "ram_usage")
+logger = get_logger("monitoring.fleet")
+
+
+def ensure_indexes():
+    get_collection("devices").create_index("u", name="updated_at")
+
+
+def device_changes(routing_key: str, data: dict):
+    """(changes of the device state, deleted) carried by an event"""
+    if routing_key == "device.deleted":
+        return {}, True
+    # enum statuses arrive as is on the in-process memory bus
+    changes = {
+        key: getattr(data[key], "value", data[key])
+        for key in FIELDS + AVERAGED + ("temperature",) if data.get(key) is not None
+    }
+    if routing_key not in ("device.created", "device.updated"):
+        # the status of a sensor payload is its on/off flag, not the device status
+        changes.pop("status", None)
+    return changes, False
+
+
+class FleetSummary:
+    def __init__(self):
+        self.devices = {}
+        # device id -> fields to write back, None once deleted
+        self.dirty = {}
+        self.counters = {field: Counter() for field in FIELDS}
+        self.totals = {metric: [0.0, 0] for metric in AVERAGED}
+        # city -> [sum of the latest temperatures, devices]
+        self.cities = {}
+        self.synced_until = None
+        self.updated_at = None
+        self._lock = threading.Lock()
+
+    def _count(self, state: dict, sign: int):
+        for field, counter in self.counters.items():
+            key = str(state.get(field) or "unknown")
+            counter[key] += sign
+            if not counter[key]:
+                del counter[key]
+        for metric, total in self.totals.items():
+            if state.get(metric) is not None:
+                total[0] += sign * state[metric]
+                total[1] += sign
+        if state.get("temperature") is not None:
+            city = self.cities.setdefault(str(state.get("city") or "unknown"), [0.0, 0])
+            city[0] += sign * state["temperature"]
+            city[1] += sign
+            if not city[1]:
+                del self.cities[str(state.get("city") or "unknown")]
+
+    def update(self, device_id, changes: dict, deleted: bool = False, persist: bool = True):
+        """Swaps the contribution of one device, O(1)"""
+        if device_id is None:
+            return
+        with self._lock:
+            previous = self.devices.get(device_id)
+            if previous is not None:
+                self._count(previous, -1)
+            if deleted:
+                self.devices.pop(device_id, None)
+            else:
+                state = dict(previous or {})
+                state.update(changes)
+                self.devices[device_id] = state
+                self._count(state, 1)
+            if persist:
+                if deleted:
+                    self.dirty[device_id] = None
+                elif device_id in self.dirty and self.dirty[device_id] is None:
+                    self.dirty[device_id] = set(state)
+                else:
+                    self.dirty.setdefault(device_id, set()).update(changes)
+            self.updated_at = datetime.utcnow()
+
+    def apply(self, routing_key: str, data: dict):
+        changes, deleted = device_changes(routing_key, data)
+        if changes or deleted:
+            self.update(data.get("device_id"), changes, deleted)
+
+    def summary(self) -> dict:
+        with self._lock:
+            hottest = heapq.nlargest(
+                FLEET_HOTTEST_CITIES, self.cities.items(), key=lambda item: item[1][0] / item[1][1]
+            )
+            return {
+                "devices": len(self.devices),
+                **{f"by_{field}": dict(counter) for field, counter in self.counters.items()},
+                **{f"avg_{metric}": round(total / count, 2) if count else None
+                   for metric, (total, count) in self.totals.items()},
+                "hottest_cities": [
+                    {"city": city, "temperature": round(total / count, 2), "devices": count}
+                    for city, (total, count) in hottest
+                ],
+                "updated_at": self.updated_at
+            }
+
+    def flush(self, until: datetime = None) -> int:
+        """Writes back the devices changed since the last flush. until : the
+        end of a replay, records written live since then are left as they are"""
+        with self._lock:
+            dirty, self.dirty = self.dirty, {}
+            requests = []
+            for device_id, fields in dirty.items():
+                state = self.devices.get(device_id)
+                if fields is None or state is None:
+                    update = {"$set": {"deleted": True}}
+                else:
+                    # only the fields changed here, other replicas may own the others
+                    update = {"$set": dict({field: state[field] for field in fields}, deleted=False)}
+                update["$currentDate"] = {"u": True}
+                selector = {"_id": device_id}
+                if until is not None:
+                    selector["$or"] = [{"u": {"$lt": until}}, {"u": {"$exists": False}}]
+                requests.append(UpdateOne(selector, update, upsert=True))
+        if requests:
+            try:
+                get_collection("devices").bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                # a newer record fails the selector, its upsert hits the existing _id
+                if until is None or e.details.get("writeConcernErrors") or any(
+                        error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                    self._restore(dirty)
+                    raise
+            except Exception:
+                self._restore(dirty)
+                raise
+        return len(requests)
+
+    def _restore(self, dirty: dict):
+        with self._lock:
+            for device_id, fields in dirty.items():
+                self.dirty.setdefault(device_id, fields)
+
+    def sync(self) -> int:
+        """Reads the device records changed since the last sync (all of them the first time)"""
+        query = {"u": {"$gt": self.synced_until - SYNC_OVERLAP}} if self.synced_until else {"u": {"$exists": True}}
+        applied = 0
+        for record in get_collection("devices").find(query):
+            device_id = record.pop("_id")
+            updated = record.pop("u")
+            self.synced_until = max(self.synced_until or updated, updated)
+            if device_id in self.dirty:
+                # changed here meanwhile, the next flush wins
+                continue
+            changes = {key: record[key] for key in FIELDS + AVERAGED + ("temperature",) if record.get(key) is not None}
+            self.update(device_id, changes, record.get("deleted", False), persist=False)
+            applied += 1
+        return applied
+
+
+fleet = FleetSummary()
+
+
+class FleetPersister(threading.Thread):
+    def __init__(self, summary: FleetSummary = fleet, interval: float = FLEET_PERSIST_INTERVAL):
+        threading.Thread.__init__(self, name="fleet-persister", daemon=True)
+        self.summary = summary
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.summary.flush()
+                self.summary.sync()
+            except Exception:
+                logger.exception("Fleet summary sync failed")
+            self._stopped.wait(self.interval)
+        try:
+            self.summary.flush()
+        except Exception:
+            logger.exception("Fleet summary flush failed")
+
+    def stop(self):
+        self._stopped.set()
@@ -1,8 +1,11 @@
 import requests
 from datetime import datetime
+from functools import lru_cache
 
 class PredictionService:
     def __init__(self):
+        # one keep-alive session for the Open-Meteo calls
+        self.session = requests.Session()
         # Mapping cities to Lat/Lon for Open-Meteo
         self.city_coords = {
             "Paris": {"lat": 48.8566, "lon": 2.3522},
@@ -46,7 +49,7 @@ class PredictionService:
         url = f"https://api.open-meteo.com/v1/forecast?latitude={coords['lat']}&longitude={coords['lon']}&daily=temperature_2m_max,temperature_2m_min,weathercode&hourly=temperature_2m,relative_humidity_2m&timezone=auto"
         
         try:
-            response = requests.get(url)
+            response = self.session.get(url, timeout=10)
             data = response.json()
             
             daily = data.get("daily", {})
@@ -111,4 +114,7 @@ class PredictionService:
         if code in [95, 96, 99]: return "Thunderstorm"
         return "Unknown"
 
-prediction_service = PredictionService()
+@lru_cache(maxsize=None)
+def get_prediction_service() -> PredictionService:
+    # built on the first prediction request, not at import
+    return PredictionService()
@@ -0,0 +1,29 @@
+# The service modules import each other from the service root (config, helpers,
+# services), as in the image. Run from the service directory : python -m pytest tests
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def without_sort(method):
+    def call(self, *args, sort=None, **kwargs):
+        assert sort is None, "mongomock can not sort bulk updates"
+        return method(self, *args, **kwargs)
+    return call
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """In-memory database behind config.database, the device catalog starts empty"""
+    mongomock = pytest.importorskip("mongomock")
+    from config import database
+    from services.event_schema import catalog
+    # pymongo >= 4.11 passes sort to the bulk builder, mongomock does not take it yet
+    for name in ("add_update", "add_replace"):
+        method = getattr(mongomock.collection.BulkOperationBuilder, name)
+        monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, name, without_sort(method))
+    monkeypatch.setattr(database, "_client", mongomock.MongoClient())
+    monkeypatch.setattr(catalog, "_known", {})
+    return database.get_db()
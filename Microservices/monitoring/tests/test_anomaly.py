@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from services.anomaly import ANOMALY_METRICS, AnomalyDetector
+
+TEMPERATURE = ANOMALY_METRICS.index("temperature")
+
+
+def detector(**options) -> AnomalyDetector:
+    settings = dict(capacity=2, alpha=0.1, z_threshold=3, warmup=5, min_std=0.5, cooldown=60, thresholds="temperature=80")
+    settings.update(options)
+    return AnomalyDetector(**settings)
+
+
+def samples(device_id, temperatures, **extra) -> list:
+    return [dict(extra, device_id=device_id, temperature=value) for value in temperatures]
+
+
+def test_moving_averages_follow_the_ewma_recurrence():
+    instance = detector()
+    values = [20.0, 22.0, 19.0, 25.0, 21.0]
+    for value in values:
+        instance.alerts(samples("d1", [value]), now=0)
+    mean, var = values[0], 0.0
+    for value in values[1:]:
+        deviation = value - mean
+        mean += 0.1 * deviation
+        var = 0.9 * (var + 0.1 * deviation ** 2)
+    assert instance.mean[0, TEMPERATURE] == pytest.approx(mean)
+    assert instance.var[0, TEMPERATURE] == pytest.approx(var)
+    assert instance.count[0, TEMPERATURE] == len(values)
+
+
+def test_a_repeated_device_is_updated_in_order_within_a_batch():
+    batched, single = detector(), detector()
+    values = [20.0, 22.0, 19.0, 25.0]
+    batched.alerts(samples("d1", values) + samples("d2", [30.0]), now=0)
+    for value in values:
+        single.alerts(samples("d1", [value]), now=0)
+    assert batched.mean[0] == pytest.approx(single.mean[0], nan_ok=True)
+    assert batched.var[0] == pytest.approx(single.var[0], nan_ok=True)
+    assert batched.mean[1, TEMPERATURE] == 30.0
+
+
+def test_z_score_alerts_only_after_the_warmup():
+    instance = detector()
+    assert instance.alerts(samples("d1", [20.0, 21.0, 20.0, 60.0]), now=0) == []
+    instance.alerts(samples("d1", [20.0, 21.0, 20.0, 21.0]), now=0)
+    alerts = instance.alerts(samples("d1", [60.0]), now=0)
+    assert [(alert["metric"], alert["reason"], alert["row"]) for alert in alerts] == [("temperature", "z_score", 0)]
+    assert alerts[0]["z_score"] > 3
+
+
+def test_flat_signals_do_not_alert_on_noise():
+    instance = detector()
+    instance.alerts(samples("d1", [20.0] * 10), now=0)
+    # std 0 is under the floor, a small step is not an anomaly
+    assert instance.alerts(samples("d1", [20.4]), now=0) == []
+
+
+def test_thresholds_alert_from_the_first_sample_then_cool_down():
+    instance = detector()
+    assert [alert["reason"] for alert in instance.alerts(samples("d1", [85.0]), now=100)] == ["threshold"]
+    assert instance.alerts(samples("d1", [86.0]), now=130) == []
+    assert len(instance.alerts(samples("d1", [87.0]), now=160)) == 1
+
+
+def test_missing_metrics_leave_the_state_unchanged():
+    instance = detector()
+    instance.alerts([{"device_id": "d1", "temperature": 20.0, "cpu_usage": "n/a"}], now=0)
+    cpu = ANOMALY_METRICS.index("cpu_usage")
+    assert instance.count[0, cpu] == 0
+    assert instance.alerts([{"device_id": "d1"}], now=0) == []
+    assert instance.count[0, TEMPERATURE] == 1
+
+
+def test_slots_grow_past_the_capacity():
+    instance = detector(capacity=1)
+    instance.alerts([{"device_id": f"d{i}", "temperature": 20.0 + i} for i in range(5)], now=0)
+    assert len(instance.mean) >= 5
+    assert [instance.mean[instance.slots[f"d{i}"], TEMPERATURE] for i in range(5)] == [20.0 + i for i in range(5)]
+    assert np.isneginf(instance.last_alert[:5]).all()
+
+
+def test_score_timestamps_alerts_like_their_sample():
+    instance = detector()
+    alerts = instance.score(samples("d1", [20.0, 90.0], timestamp=1772368200), now=0)
+    assert [(alert["device_id"], alert["timestamp"]) for alert in alerts] == [("d1", 1772368200)]
+    assert "row" not in alerts[0]
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+import pytest
+from services import archive
+from services.archive import (Archiver, device_file, export_events, find_events, hot_ttl, legacy_device_file, read_archive,
+                              write_partition)
+from services.event_schema import compact
+
+pytest.importorskip("pyarrow")
+
+
+def frozen_at(now: datetime):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return now
+    return FrozenDatetime
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_hot_ttl_outlives_the_archiving_of_the_day():
+    # a day is archived once the horizon is past its end, at most 1 day after its first event
+    assert hot_ttl() >= (archive.HOT_RETENTION_DAYS + 1) * 86400 + archive.ARCHIVE_INTERVAL
+
+
+@pytest.mark.parametrize("offset", [timedelta(0), timedelta(hours=13), timedelta(hours=23, minutes=59)])
+def test_events_are_archived_before_they_expire(mongo, archive_dir, monkeypatch, offset):
+    received = datetime(2026, 3, 1) + offset
+    mongo["device_events"].insert_one(compact("device.telemetry", {"device_id": "d1", "temperature": 21}, received))
+    # the last archiver run before the TTL monitor may delete the event
+    last_run = received + timedelta(seconds=hot_ttl() - archive.ARCHIVE_INTERVAL)
+    monkeypatch.setattr(archive, "datetime", frozen_at(last_run))
+    Archiver().run_once()
+    assert archive.archived_until() > received
+    assert (archive_dir / "day=2026-03-01" / device_file("d1")).exists()
+
+
+def test_archived_and_hot_events_expand_to_the_payload(mongo, archive_dir, monkeypatch):
+    day = datetime(2026, 3, 1)
+    payloads = [
+        (day + timedelta(hours=1), {"device_id": "d1", "name": "probe", "temperature": 21, "timestamp": 1772326800}),
+        (day + timedelta(days=9), {"device_id": "d1", "name": "probe", "temperature": 22.5, "power_usage": 3}),
+    ]
+    for received, data in payloads:
+        mongo["device_events"].insert_one(compact("device.telemetry", data, received))
+    monkeypatch.setattr(archive, "datetime", frozen_at(day + timedelta(days=9, hours=2)))
+    Archiver().run_once()
+    assert archive.archived_until() == day + timedelta(days=2)
+    events = list(export_events("d1"))
+    assert events == [
+        {"routing_key": "device.telemetry", "data": data, "timestamp": received} for received, data in payloads
+    ]
+    assert type(events[0]["data"]["temperature"]) is int
+
+
+COLLIDING = ["a/b", "a b", "a_b"]
+
+
+def test_ids_sanitized_alike_are_archived_apart(mongo, archive_dir, monkeypatch):
+    day = datetime(2026, 3, 1)
+    for i, device_id in enumerate(COLLIDING):
+        data = {"device_id": device_id, "temperature": 20 + i}
+        mongo["device_events"].insert_one(compact("device.telemetry", data, day + timedelta(hours=i)))
+    monkeypatch.setattr(archive, "datetime", frozen_at(day + timedelta(days=9)))
+    Archiver().run_once()
+    assert len({device_file(device_id) for device_id in COLLIDING}) == len(COLLIDING)
+    assert len(list((archive_dir / "day=2026-03-01").iterdir())) == len(COLLIDING)
+    for i, device_id in enumerate(COLLIDING):
+        assert [event["data"] for event in find_events(10, device_id=device_id)] == \
+            [{"device_id": device_id, "temperature": 20 + i}]
+    assert len(find_events(10)) == len(COLLIDING)
+
+
+def test_legacy_files_only_return_the_requested_device(mongo, archive_dir):
+    day = datetime(2026, 3, 1)
+    # archived before the digest : both ids ended up in the same file
+    write_partition(day, "a/b", [
+        {"routing_key": "device.telemetry", "data": {"device_id": device_id, "temperature": 20}, "timestamp": day}
+        for device_id in ("a/b", "a b")
+    ])
+    (archive_dir / "day=2026-03-01" / device_file("a/b")).rename(archive_dir / "day=2026-03-01" / legacy_device_file("a/b"))
+    mongo["archive_state"].insert_one({"_id": archive.STATE_ID, "archived_until": day + timedelta(days=1)})
+    assert [event["data"]["device_id"] for event in find_events(10, device_id="a b")] == ["a b"]
+    assert [event["data"]["device_id"] for event in find_events(10, device_id="a/b")] == ["a/b"]
+
+
+@pytest.fixture
+def small_groups(archive_dir, monkeypatch):
+    """3 devices archived on 2026-03-01, a sample a minute, row groups of 10 rows"""
+    import pyarrow.parquet as pq
+    monkeypatch.setattr(archive, "ARCHIVE_ROW_GROUP", 10)
+    monkeypatch.setattr(archive, "ARCHIVE_READ_BATCH", 4)
+    day = datetime(2026, 3, 1)
+    for device in range(3):
+        write_partition(day, f"d{device}", [
+            {"routing_key": "device.telemetry", "data": {"device_id": f"d{device}", "temperature": minute},
+             "timestamp": day + timedelta(minutes=minute, seconds=device)}
+            for minute in range(100)
+        ])
+    reads = []
+    iter_batches = pq.ParquetFile.iter_batches
+
+    def counted(self, *args, **kwargs):
+        reads.append(kwargs.get("row_groups"))
+        return iter_batches(self, *args, **kwargs)
+    monkeypatch.setattr(pq.ParquetFile, "iter_batches", counted)
+    return reads
+
+
+def test_archive_reads_stop_at_the_limit(mongo, small_groups):
+    mongo["archive_state"].insert_one({"_id": archive.STATE_ID, "archived_until": datetime(2026, 3, 2)})
+    events = find_events(5)
+    assert [(event["data"]["device_id"], event["data"]["temperature"]) for event in events] == \
+        [("d2", 99), ("d1", 99), ("d0", 99), ("d2", 98), ("d1", 98)]
+    # the last row group of each device file, not the whole day
+    assert small_groups == [[9], [9], [9]]
+
+
+def test_archive_reads_skip_the_row_groups_out_of_range(archive_dir, small_groups):
+    since, until = datetime(2026, 3, 1, 0, 25), datetime(2026, 3, 1, 0, 35)
+    events = list(read_archive(since, until, device_id="d1", descending=False))
+    assert [event["data"]["temperature"] for event in events] == list(range(25, 35))
+    assert small_groups == [[2], [3]]
+    everything = list(read_archive())
+    assert len(everything) == 300
+    assert [event["timestamp"] for event in everything] == sorted((event["timestamp"] for event in everything), reverse=True)
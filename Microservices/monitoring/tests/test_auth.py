@@ -0,0 +1,44 @@
+import io
+import json
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwt
+from helpers import auth
+from helpers.auth import JWKSVerifier
+
+KEY = {"kty": "oct", "kid": "k1", "alg": "HS256", "k": "c2VjcmV0"}
+TOKEN = jwt.encode({"sub": "alice"}, "secret", algorithm="HS256", headers={"kid": "k1"})
+
+
+def serve(monkeypatch, *bodies):
+    """urlopen answers each body in turn, an exception instance is raised"""
+    answers = list(bodies)
+
+    def urlopen(url, timeout):
+        body = answers.pop(0)
+        if isinstance(body, Exception):
+            raise body
+        return io.BytesIO(body.encode())
+    monkeypatch.setattr(auth.urllib.request, "urlopen", urlopen)
+    return answers
+
+
+@pytest.mark.parametrize("body", ["<html>502 Bad Gateway</html>", '{"keys": [{"kty": "oct"}]}', "[]",
+                                  OSError("connection refused")])
+def test_a_failed_refresh_keeps_the_cached_keys(monkeypatch, body):
+    verifier = JWKSVerifier(url="http://signing/jwks", cache_seconds=0)
+    answers = serve(monkeypatch, json.dumps({"keys": [KEY]}), body)
+    assert verifier.verify(TOKEN)["sub"] == "alice"
+    assert verifier.verify(TOKEN)["sub"] == "alice"
+    assert answers == []
+
+
+@pytest.mark.parametrize("body", ["<html>502 Bad Gateway</html>", '{"keys": [{"kty": "oct"}]}'])
+def test_no_usable_keys_is_unavailable_not_an_error(monkeypatch, body):
+    monkeypatch.setattr(auth, "AUTH_REQUIRED", True)
+    monkeypatch.setattr(auth, "verifier", JWKSVerifier(url="http://signing/jwks"))
+    serve(monkeypatch, body)
+    with pytest.raises(HTTPException) as error:
+        auth.require_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=TOKEN))
+    assert error.value.status_code == 503
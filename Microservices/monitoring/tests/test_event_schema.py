@@ -0,0 +1,51 @@
+from datetime import datetime
+import pytest
+from services.event_schema import compact, expand, expand_all, migrate_events, split_event
+
+RECEIVED = datetime(2026, 3, 1, 12, 30)
+PAYLOADS = [
+    ("device.telemetry", {"device_id": "d1", "name": "probe", "type": "Sensor", "city": "Lyon", "temperature": 21,
+                          "humidity": 40.5, "cpu_usage": 3, "timestamp": 1772368200, "power_usage": 1.5}),
+    ("cloud-security-iot.iot.telemetry.d1", {"device_id": "d1", "temperature": 20.25, "status": True}),
+    ("device.deleted", {"device_id": "d1"}),
+    ("custom.event", {"message": "no device", "temperature": "n/a"}),
+]
+
+
+@pytest.mark.parametrize("routing_key, data", PAYLOADS)
+def test_split_then_expand_gives_back_the_payload(routing_key, data):
+    document, metadata = split_event(routing_key, data, RECEIVED)
+    document["md"] = metadata
+    event = expand(document)
+    assert event == {"routing_key": routing_key, "data": data, "timestamp": RECEIVED}
+    for key, value in data.items():
+        assert type(event["data"][key]) is type(value)
+
+
+def test_known_routing_keys_are_stored_as_kinds():
+    assert isinstance(split_event("cloud-security-iot.iot.telemetry.d1", {"device_id": "d1"}, RECEIVED)[0]["k"], int)
+    # a routing key built for another device is not a known kind for this one
+    assert split_event("cloud-security-iot.iot.telemetry.d2", {"device_id": "d1"}, RECEIVED)[0]["k"] \
+        == "cloud-security-iot.iot.telemetry.d2"
+
+
+def test_metadata_is_stored_once_and_renames_keep_their_history(mongo):
+    first = compact("device.telemetry", {"device_id": "d1", "name": "probe", "city": "Lyon", "temperature": 21}, RECEIVED)
+    same = compact("device.telemetry", {"device_id": "d1", "name": "probe", "city": "Lyon", "temperature": 22}, RECEIVED)
+    moved = compact("device.telemetry", {"device_id": "d1", "name": "probe", "city": "Paris", "temperature": 23}, RECEIVED)
+    assert "md" not in first and "md" not in same
+    assert moved["md"] == {"name": "probe", "city": "Paris"}
+    assert [event["data"]["city"] for event in expand_all([first, same, moved])] == ["Lyon", "Lyon", "Paris"]
+
+
+def test_migration_rewrites_legacy_documents_in_place(mongo):
+    collection = mongo["device_events"]
+    legacy = [
+        {"routing_key": routing_key, "data": data, "timestamp": RECEIVED} for routing_key, data in PAYLOADS
+    ]
+    collection.insert_many([dict(document) for document in legacy])
+    assert migrate_events(batch=2) == len(legacy)
+    assert migrate_events() == 0
+    documents = list(collection.find({}, {"_id": 0}).sort("_id", 1))
+    assert not any("data" in document for document in documents)
+    assert list(expand_all(documents)) == legacy
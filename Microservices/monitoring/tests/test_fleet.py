@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from enum import Enum
+from services.fleet import FleetSummary
+
+
+class Status(Enum):
+    ACTIVE = "active"
+
+
+def recount(summary: FleetSummary) -> FleetSummary:
+    """The same devices counted from scratch"""
+    fresh = FleetSummary()
+    for device_id, state in summary.devices.items():
+        fresh.update(device_id, state)
+    return fresh
+
+
+def test_updates_and_deletes_keep_the_counters_exact():
+    summary = FleetSummary()
+    summary.apply("device.created", {"device_id": "d1", "status": Status.ACTIVE, "city": "Lyon", "type": "Sensor"})
+    summary.apply("device.created", {"device_id": "d2", "status": "inactive", "city": "Lyon", "type": "Camera"})
+    summary.apply("device.telemetry", {"device_id": "d1", "temperature": 30, "cpu_usage": 50, "status": True})
+    summary.apply("device.telemetry", {"device_id": "d2", "temperature": 20, "cpu_usage": 10})
+    summary.apply("device.updated", {"device_id": "d2", "city": "Paris"})
+    summary.apply("device.telemetry", {"device_id": "d3", "temperature": 10})
+    summary.apply("device.deleted", {"device_id": "d3"})
+    result = summary.summary()
+    assert result["devices"] == 2
+    # sensor payloads carry an on/off flag, not the device status
+    assert result["by_status"] == {"active": 1, "inactive": 1}
+    assert result["by_city"] == {"Lyon": 1, "Paris": 1}
+    assert result["avg_cpu_usage"] == 30
+    assert result["avg_ram_usage"] is None
+    assert [(city["city"], city["temperature"]) for city in result["hottest_cities"]] == [("Lyon", 30), ("Paris", 20)]
+    expected = recount(summary)
+    assert summary.counters == expected.counters
+    assert summary.totals == expected.totals
+    assert summary.cities == expected.cities
+
+
+def test_removing_every_device_leaves_no_residue():
+    summary = FleetSummary()
+    for i in range(10):
+        summary.apply("device.created", {"device_id": f"d{i}", "status": "active", "city": f"c{i % 3}", "type": "Sensor"})
+        summary.apply("device.telemetry", {"device_id": f"d{i}", "temperature": i, "ram_usage": 0.1 * i})
+    for i in range(10):
+        summary.apply("device.deleted", {"device_id": f"d{i}"})
+    assert summary.devices == {}
+    assert all(not counter for counter in summary.counters.values())
+    assert summary.totals["ram_usage"][1] == 0
+    assert summary.cities == {}
+
+
+def test_flush_writes_the_changed_fields_and_sync_reads_the_others(mongo):
+    local, remote = FleetSummary(), FleetSummary()
+    local.apply("device.created", {"device_id": "d1", "status": "active", "city": "Lyon", "type": "Sensor"})
+    assert local.flush() == 1
+    assert remote.sync() == 1
+    remote.apply("device.telemetry", {"device_id": "d1", "temperature": 25})
+    remote.apply("device.deleted", {"device_id": "d2"})
+    remote.flush()
+    record = mongo["devices"].find_one({"_id": "d1"})
+    assert (record["city"], record["temperature"], record["deleted"]) == ("Lyon", 25, False)
+    assert mongo["devices"].find_one({"_id": "d2"})["deleted"] is True
+    # changed locally since : the next flush wins over the stored record
+    local.apply("device.updated", {"device_id": "d1", "city": "Paris"})
+    local.synced_until = datetime.utcnow() - timedelta(minutes=1)
+    local.sync()
+    assert local.devices["d1"]["city"] == "Paris"
+    assert remote.summary()["devices"] == 1
+
+
+def test_a_recreated_device_writes_back_every_field(mongo):
+    summary = FleetSummary()
+    summary.apply("device.created", {"device_id": "d1", "status": "active", "city": "Lyon", "type": "Sensor"})
+    summary.flush()
+    summary.apply("device.deleted", {"device_id": "d1"})
+    summary.apply("device.created", {"device_id": "d1", "status": "inactive", "city": "Lyon", "type": "Sensor"})
+    summary.flush()
+    assert {key: value for key, value in mongo["devices"].find_one({"_id": "d1"}).items() if key != "u"} == \
+        {"_id": "d1", "status": "inactive", "city": "Lyon", "type": "Sensor", "deleted": False}
@@ -0,0 +1,92 @@
+import threading
+import time
+from helpers.message_bus import partition_of
+from helpers.partitions import PartitionCoordinator, assign
+
+PARTITIONS = 64
+MEMBERS = ["monitoring-a", "monitoring-b", "monitoring-c", "monitoring-d"]
+
+
+def test_every_partition_has_exactly_one_owner():
+    owned = [assign(PARTITIONS, MEMBERS, member) for member in MEMBERS]
+    assert sum(len(partitions) for partitions in owned) == PARTITIONS
+    assert set().union(*owned) == set(range(PARTITIONS))
+
+
+def test_assignment_ignores_the_member_order():
+    for member in MEMBERS:
+        assert assign(PARTITIONS, MEMBERS, member) == assign(PARTITIONS, list(reversed(MEMBERS)), member)
+
+
+def test_a_leaving_member_only_moves_its_own_partitions():
+    before = {member: assign(PARTITIONS, MEMBERS, member) for member in MEMBERS}
+    remaining = MEMBERS[1:]
+    for member in remaining:
+        after = assign(PARTITIONS, remaining, member)
+        assert before[member] <= after
+        assert after - before[member] <= before[MEMBERS[0]]
+
+
+def test_partition_of_is_stable_and_in_range():
+    assert partition_of("device-42", PARTITIONS) == partition_of("device-42", PARTITIONS)
+    assert all(0 <= partition_of(f"device-{i}", PARTITIONS) < PARTITIONS for i in range(1000))
+    assert len({partition_of(f"device-{i}", PARTITIONS) for i in range(1000)}) == PARTITIONS
+
+
+class Recorder:
+    def __init__(self):
+        self.assigned, self.revoked = [], []
+
+
+def coordinator(recorder: Recorder, members) -> PartitionCoordinator:
+    coordinator = PartitionCoordinator("tests", 8, recorder.assigned.append, recorder.revoked.append, redis_url="")
+    # a fixed name, the generated one has a random suffix
+    coordinator.member = "monitoring-d"
+    coordinator.members = members
+    return coordinator
+
+
+def unavailable():
+    raise ConnectionError("redis down")
+
+
+def test_unknown_membership_at_start_consumes_every_partition():
+    recorder = Recorder()
+    coordinator(recorder, unavailable).rebalance()
+    assert recorder.assigned == list(range(8))
+
+
+def test_membership_loss_keeps_the_owned_partitions():
+    recorder = Recorder()
+    instance = coordinator(recorder, lambda: MEMBERS)
+    instance.rebalance()
+    owned = set(instance.owned)
+    assert owned == {0, 4}
+    instance.members = unavailable
+    instance.rebalance()
+    assert instance.owned == owned
+    assert recorder.revoked == []
+
+
+def test_stop_waits_for_the_rebalance_in_flight():
+    recorder = Recorder()
+    inside, release = threading.Event(), threading.Event()
+
+    def slow_members():
+        inside.set()
+        release.wait(5)
+        return MEMBERS
+    instance = coordinator(recorder, slow_members)
+    instance.start()
+    assert inside.wait(5)
+    stopping = threading.Thread(target=instance.stop)
+    stopping.start()
+    time.sleep(0.1)
+    release.set()
+    stopping.join(5)
+    assert not stopping.is_alive() and not instance.is_alive()
+    # whatever the rebalance assigned was revoked by stop, nothing consumes after it
+    assert sorted(recorder.assigned) == sorted(recorder.revoked) == [0, 4]
+    assert instance.owned == set()
+    instance.rebalance()
+    assert recorder.assigned == [0, 4]
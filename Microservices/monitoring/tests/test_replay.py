@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta
+from replay import FleetReplay
+
+UNTIL = datetime(2026, 3, 1)
+
+
+def test_fleet_replay_leaves_the_records_written_live_since(mongo):
+    devices = mongo["devices"]
+    devices.insert_many([
+        {"_id": "stale", "city": "Lyon", "deleted": False, "u": UNTIL - timedelta(days=1)},
+        {"_id": "deleted-live", "city": "Lyon", "deleted": True, "u": UNTIL + timedelta(hours=1)},
+        {"_id": "catalog-only", "m": {"0": {"name": "probe"}}},
+    ])
+    stage = FleetReplay(["stale", "deleted-live", "catalog-only", "new"], None, UNTIL)
+    for device_id in ("stale", "deleted-live", "catalog-only", "new"):
+        stage.process({"routing_key": "device.updated", "data": {"device_id": device_id, "city": "Paris"}})
+    stage.finish()
+    assert {record["_id"]: record.get("city") for record in devices.find()} == {
+        "stale": "Paris", "deleted-live": "Lyon", "catalog-only": "Paris", "new": "Paris"
+    }
+    assert devices.find_one({"_id": "deleted-live"})["deleted"] is True
+    assert devices.find_one({"_id": "catalog-only"})["m"] == {"0": {"name": "probe"}}
+    # the kept records are not retried by a later flush
+    assert stage.summary.dirty == {}
@@ -1,41 +1,84 @@
 from datetime import datetime
-from fastapi import APIRouter,Depends,HTTPException,Security,Request,Response
+from fastapi import APIRouter,Depends,HTTPException,Security,Request,Response,Query
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer,HTTPAuthorizationCredentials
 
-from helpers.config import session_factory
-from dal.user_dao import get_all_users,create_user,authenticate
-from dto.users_dto import UserResponse,UserRequest,TokenResponse,TokenRequest
+from helpers.config import session_factory,LocalSession
+from dal.user_dao import get_users_page,iter_users,create_user,authenticate
+from dto.users_dto import UserResponse,UserRequest,TokenResponse,TokenRequest,RefreshRequest,BatchTokenRequest,BatchTokenResponse,TokenVerification
 from entities.user import User
-from helpers.utils import create_token,decode_token
-from helpers.config import logger
-from dal.black_listed_dao import add_token_to_blacklist,is_blacklist_token
+from helpers.utils import create_token,decode_token,revocation_key
+from helpers.config import REVOCATION_FAIL_OPEN
+from helpers.log import get_logger,LOG_SAMPLE_RATE,LOG_RATE_LIMIT
+from helpers.token_cache import token_cache
+from dal.black_listed_dao import add_token_to_blacklist,is_blacklist_token,are_blacklist_tokens,RevocationCheckError
+from helpers.password_pool import PasswordPoolBusy
+from dal.refresh_token_dao import (create_refresh_family,rotate_refresh_token,revoke_refresh_family,
+                                   RefreshStoreError,REFRESH_OK,REFRESH_REUSED)
 router=APIRouter(prefix="/users",tags=["users"])  
+# one INFO record per request : sampled and rate limited so logging never throttles the API
+logger=get_logger('auth.requests',sample_rate=LOG_SAMPLE_RATE,rate_limit=LOG_RATE_LIMIT)
+# failures are rare and all of them matter : neither sampled nor rate limited
+error_logger=get_logger('auth')
 http_bearer=HTTPBearer()
 
-def check_token(session=Depends(session_factory),token:HTTPAuthorizationCredentials=Security(http_bearer)):
+def check_token(token:HTTPAuthorizationCredentials=Security(http_bearer)):
     credentials=token.credentials
-    payload=decode_token(credentials)
-    if is_blacklist_token(credentials):
+    payload=token_cache.get(credentials)
+    cached=payload is not None
+    if not cached:
+        payload=decode_token(credentials)
+        if not payload :
+            raise HTTPException(status_code=404,detail='Invalid token')
+    key=revocation_key(credentials,payload)
+    if token_cache.is_revoked(key):
         raise HTTPException(status_code=401,detail='Token is blacklisted')
-    if not payload :
-        raise HTTPException(status_code=404,detail='Invalid token')
+    if cached:
+        return payload
+    try:
+        revoked=is_blacklist_token(key)
+    except RevocationCheckError:
+        if not REVOCATION_FAIL_OPEN:
+            raise HTTPException(status_code=503,detail='Revocation store unavailable')
+        revoked=False
+    if revoked:
+        token_cache.revoke(key,payload.get('exp',0))
+        raise HTTPException(status_code=401,detail='Token is blacklisted')
+    token_cache.put(credentials,payload)
     return payload
 
-@router.get("/",response_model=list[UserResponse])
-def get_all(session=Depends(session_factory),
-            payload=Depends(check_token)
-            ):
-    
-    
-    users:list[User]=get_all_users(session)
-    results:list[UserResponse]=[]
-    for user in users:
-        results.append(UserResponse(
+def to_user_response(user)->UserResponse:
+    return UserResponse(
             email=str(user.email),
             is_admin=bool(user.is_admin),
             created_at=str(user.created_at),
             updated_at=str(user.updated_at)
-        ))
+        )
+
+def stream_users():
+    # own session : the request scoped one may be closed while the body streams
+    session=LocalSession()
+    try:
+        for user in iter_users(session):
+            yield to_user_response(user).model_dump_json()+'\n'
+    finally:
+        session.close()
+
+@router.get("/",response_model=list[UserResponse])
+def get_all(response:Response,
+            cursor:int|None=Query(default=None,description="id of the last user of the previous page"),
+            limit:int=Query(default=100,ge=1,le=1000),
+            stream:bool=Query(default=False,description="stream every user as NDJSON"),
+            session=Depends(session_factory),
+            payload=Depends(check_token)
+            ):
+    if stream:
+        logger.info('stream all users')
+        return StreamingResponse(stream_users(),media_type="application/x-ndjson")
+    users=get_users_page(session,cursor,limit)
+    results:list[UserResponse]=[to_user_response(user) for user in users]
+    if len(users)==limit:
+        response.headers["X-Next-Cursor"]=str(users[-1].id)
     logger.info('get all users from ip :')
     return results
 @router.post("/add",response_model=UserResponse)
@@ -44,17 +87,16 @@ def register_user(userRequest:UserRequest,session=Depends(session_factory)):
         email=userRequest.email,
         password=userRequest.password
     )
-    add_ok=create_user(session,user_entity)
+    try:
+        add_ok=create_user(session,user_entity)
+    except PasswordPoolBusy as e:
+        error_logger.error('registration rejected for user %s : %s',userRequest.email,e)
+        raise HTTPException(status_code=503,detail="Server busy, retry later")
     if add_ok :
         logger.info('user register ok %s',userRequest.email)
-        return UserResponse(
-            email=str(user_entity.email),
-            is_admin=bool(user_entity.is_admin),
-            created_at=str(user_entity.created_at),
-            updated_at=str(user_entity.updated_at)
-        )
+        return to_user_response(user_entity)
         
-    logger.error('registration faild for user %s',userRequest.email)
+    error_logger.error('registration faild for user %s',userRequest.email)
     raise HTTPException(status_code=401,detail="registration faild")
 
 @router.post("/auth",response_model=TokenResponse)
@@ -65,34 +107,106 @@ def authenticate_user(userRequest:UserRequest,
         email=userRequest.email,
         password=userRequest.password
     )
-    auth_user=authenticate(session,user_entity)
+    try:
+        auth_user=authenticate(session,user_entity)
+    except PasswordPoolBusy as e:
+        error_logger.error('Authentication rejected for user %s : %s',userRequest.email,e)
+        raise HTTPException(status_code=503,detail="Server busy, retry later")
     if auth_user != False :
         claims:dict={
                 "sub":auth_user.email,
                 "role":auth_user.is_admin
         }
+        refresh_token=None
+        try:
+            family,refresh_token=create_refresh_family(str(auth_user.email),bool(auth_user.is_admin))
+            claims["fam"]=family
+        except RefreshStoreError:
+            # still log the user in, the client will authenticate again when the token expires
+            error_logger.error('no refresh token issued for user %s',userRequest.email)
         token=create_token(claims)
         logger.info('Authetication for user ; %s',userRequest.email)
         return TokenResponse(token=token,
-                             payload=claims)
-    logger.error('Authentication faild fro user : %s',userRequest.email)
+                             payload=claims,
+                             refresh_token=refresh_token)
+    error_logger.error('Authentication faild fro user : %s',userRequest.email)
     raise HTTPException(status_code=401,detail="Authentication faild")
+@router.post("/refresh",response_model=TokenResponse)
+def refresh_user_token(refreshRequest:RefreshRequest):
+    try:
+        status,claims,refresh_token=rotate_refresh_token(refreshRequest.refresh_token)
+    except RefreshStoreError:
+        raise HTTPException(status_code=503,detail="Refresh token store unavailable")
+    if status==REFRESH_REUSED:
+        raise HTTPException(status_code=401,detail="Refresh token reuse detected")
+    if status!=REFRESH_OK:
+        raise HTTPException(status_code=401,detail="Invalid refresh token")
+    token=create_token(claims)
+    return TokenResponse(token=token,payload=claims,refresh_token=refresh_token)
+def verify_tokens(tokens:list[str])->list[TokenVerification]:
+    """Verdict of every token : cache, revocation cache, then a single MGET for the uncached ones"""
+    results:list[TokenVerification]=[]
+    to_check:list[int]=[]
+    keys:list[str]=[]
+    for token in tokens:
+        payload=token_cache.get(token)
+        cached=payload is not None
+        if not cached:
+            payload=decode_token(token)
+        if not payload :
+            results.append(TokenVerification(token=token,valid=False,detail="Invalid token"))
+            continue
+        key=revocation_key(token,payload)
+        if token_cache.is_revoked(key):
+            results.append(TokenVerification(token=token,valid=False,detail="Token is blacklisted"))
+            continue
+        results.append(TokenVerification(token=token,valid=True,payload=payload))
+        if not cached:
+            to_check.append(len(results)-1)
+            keys.append(key)
+    if keys:
+        try:
+            revoked=are_blacklist_tokens(keys)
+        except RevocationCheckError:
+            if not REVOCATION_FAIL_OPEN:
+                raise HTTPException(status_code=503,detail='Revocation store unavailable')
+            revoked=[False]*len(keys)
+        for index,key,is_revoked in zip(to_check,keys,revoked):
+            result=results[index]
+            if is_revoked:
+                token_cache.revoke(key,result.payload.get('exp',0))
+                results[index]=TokenVerification(token=result.token,valid=False,detail="Token is blacklisted")
+            else:
+                token_cache.put(result.token,result.payload)
+    return results
+
 @router.post("/verify-token",response_model=TokenResponse)
 def verify_token(tokenRequest:TokenRequest):
-    payload=decode_token(token=tokenRequest.token)
-    if not payload :
-        raise HTTPException(status_code=404,detail="Invalid token")
-    return TokenResponse(token=tokenRequest.token,payload=payload)
+    # a batch of one : both endpoints give the same verdict for the same token
+    result=verify_tokens([tokenRequest.token])[0]
+    if not result.valid:
+        raise HTTPException(status_code=404 if result.detail=="Invalid token" else 401,detail=result.detail)
+    return TokenResponse(token=tokenRequest.token,payload=result.payload)
+
+@router.post("/verify-token/batch",response_model=BatchTokenResponse)
+def verify_token_batch(batchRequest:BatchTokenRequest):
+    return BatchTokenResponse(results=verify_tokens(batchRequest.tokens))
 
 @router.post("/logout")
 def logout_user(token:HTTPAuthorizationCredentials=Security(http_bearer),
                 session=Depends(session_factory)
                 ):
     credentials=token.credentials
-    
-    add_ok=add_token_to_blacklist(credentials)
+    payload=token_cache.get(credentials) or decode_token(credentials)
+    if not payload :
+        raise HTTPException(status_code=404,detail="Invalid token")
+    key=revocation_key(credentials,payload)
+    add_ok=add_token_to_blacklist(key,payload.get('exp',0))
     if add_ok :
+        token_cache.revoke(key,payload.get('exp',0))
+        if payload.get('fam'):
+            revoke_refresh_family(payload['fam'])
         logger.info('user logged out')
         return Response(status_code=200,content="logout successful")
-    logger.error('logout faild')
+    error_logger.error('logout faild')
     raise HTTPException(status_code=500,detail="logout faild")
\ No newline at end of file
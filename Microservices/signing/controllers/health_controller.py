@@ -0,0 +1,35 @@
+import asyncio
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from helpers.config import get_engine,REVOCATION_FAIL_OPEN
+from helpers.redis_client import redis_client
+
+router=APIRouter(tags=["health"])
+
+@router.get("/healthz")
+def healthz():
+    # liveness : the process answers, dependencies are not checked
+    return {"status":"ok"}
+
+def ping_database():
+    with get_engine().connect() as connection:
+        connection.execute(text('SELECT 1'))
+
+@router.get("/readyz")
+async def readyz():
+    # probes run often : no worker thread is held while Redis answers
+    checks={}
+    try:
+        await asyncio.to_thread(ping_database)
+        checks['database']='ok'
+    except Exception as e:
+        checks['database']=f'error: {e.__class__.__name__}'
+    try:
+        await redis_client.run_async(lambda client:client.ping())
+        checks['redis']='ok'
+    except Exception as e:
+        # tokens can not be checked against the blacklist, unless configured to fail open
+        checks['redis']='degraded' if REVOCATION_FAIL_OPEN else f'error: {e.__class__.__name__}'
+    ready=all(not state.startswith('error') for state in checks.values())
+    return JSONResponse({"status":"ready" if ready else "not ready","checks":checks},status_code=200 if ready else 503)
@@ -0,0 +1,15 @@
+from fastapi import APIRouter,HTTPException
+from fastapi.responses import JSONResponse
+
+from helpers.keys import key_ring
+from helpers.config import JWKS_MAX_AGE
+
+router=APIRouter(tags=["jwks"])
+
+@router.get("/.well-known/jwks.json")
+def get_jwks():
+    if key_ring is None:
+        raise HTTPException(status_code=404,detail="Tokens are signed with a shared secret")
+    # the key set only changes on restart, let clients and proxies cache it
+    return JSONResponse(content=key_ring.jwks,
+                        headers={"Cache-Control":f"public, max-age={JWKS_MAX_AGE}"})
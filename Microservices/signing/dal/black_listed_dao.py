@@ -1,27 +1,54 @@
+import json
+import time
 from helpers.redis_client import redis_client
-from helpers.config import EXPIRE_TIME, logger
+from helpers.config import BLACKLIST_PREFIX, REVOCATION_CHANNEL, logger
+from helpers.token_cache import token_cache
 
-# We can ignore the session argument to maintain backward compatibility if needed, 
-# or prefer to remove it from the caller. 
-# For now, let's allow it but not use it, or just remove it if we update the controller (preferred).
+# Revoked tokens are stored by jti only (BLACKLIST_PREFIX + jti), with a TTL
+# equal to the token's remaining lifetime, instead of the full JWT string.
+# Every call goes through the pooled client's circuit breaker, so an
+# unreachable Redis fails fast with RevocationCheckError.
 
-def is_blacklist_token(token: str) -> bool:
+class RevocationCheckError(Exception):
+    """Raised when the revocation store can not be queried"""
+
+def is_blacklist_token(key: str) -> bool:
+    # A negative answer of the local bloom filter is definitive
+    if not token_cache.might_be_revoked(key):
+        return False
     try:
-        client = redis_client.get_client()
-        if client and client.exists(token):
-            return True
+        return bool(redis_client.run(lambda client: client.exists(BLACKLIST_PREFIX + key)))
     except Exception as e:
         logger.error(f"Error checking blacklist in Redis: {e}")
-    return False
+        raise RevocationCheckError(str(e)) from e
+
+def are_blacklist_tokens(keys: list[str]) -> list[bool]:
+    """Revocation status of several keys with a single MGET round-trip"""
+    results = [False] * len(keys)
+    pending = [i for i, key in enumerate(keys) if token_cache.might_be_revoked(key)]
+    if not pending:
+        return results
+    try:
+        values = redis_client.run(lambda client: client.mget([BLACKLIST_PREFIX + keys[i] for i in pending]))
+    except Exception as e:
+        logger.error(f"Error checking blacklist in Redis: {e}")
+        raise RevocationCheckError(str(e)) from e
+    for i, value in zip(pending, values):
+        results[i] = value is not None
+    return results
 
-def add_token_to_blacklist(token: str, expiration_minutes: int = int(EXPIRE_TIME)) -> bool:
+def add_token_to_blacklist(key: str, exp: float) -> bool:
+    ttl = int(exp - time.time()) + 1
+    if ttl <= 0:
+        # Token already expired, nothing to revoke
+        return True
     try:
-        client = redis_client.get_client()
-        if client:
-            # Set key with expiration
-            # Value can be anything, e.g., "revoked"
-            client.setex(token, expiration_minutes * 60, "revoked")
-            return True
+        # Store and notify every replica in one round-trip
+        redis_client.pipeline(lambda pipe: (
+            pipe.set(BLACKLIST_PREFIX + key, 1, ex=ttl),
+            pipe.publish(REVOCATION_CHANNEL, json.dumps({"key": key, "exp": exp}))
+        ))
+        return True
     except Exception as e:
         logger.error(f"Error adding token to blacklist in Redis: {e}")
     return False
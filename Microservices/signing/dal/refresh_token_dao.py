@@ -0,0 +1,68 @@
+import secrets
+from helpers.redis_client import redis_client
+from helpers.config import REFRESH_EXPIRE_TIME, REFRESH_PREFIX, logger
+from helpers.utils import sign_refresh, parse_refresh
+
+# One Redis key per refresh token family : REFRESH_PREFIX + family -> "counter|role|sub".
+# Each refresh atomically checks and bumps the counter, so a refresh token is
+# accepted once ; presenting an already rotated token revokes the whole family.
+
+ROTATE_SCRIPT = redis_client.client.register_script("""
+local value = redis.call('GET', KEYS[1])
+if not value then return {0} end
+local sep = string.find(value, '|', 1, true)
+if string.sub(value, 1, sep - 1) ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return {-1}
+end
+local rest = string.sub(value, sep)
+redis.call('SET', KEYS[1], tostring(tonumber(ARGV[1]) + 1) .. rest, 'KEEPTTL')
+return {1, string.sub(rest, 2)}
+""")
+
+REFRESH_OK = 1
+REFRESH_UNKNOWN = 0
+REFRESH_REUSED = -1
+
+class RefreshStoreError(Exception):
+    """Raised when the refresh token store can not be reached"""
+
+def create_refresh_family(sub: str, role: bool) -> tuple[str, str]:
+    """Start a new refresh token family, returns (family, refresh_token)"""
+    family = secrets.token_urlsafe(12)
+    try:
+        redis_client.run(lambda client: client.set(
+            REFRESH_PREFIX + family, f"0|{int(role)}|{sub}", ex=int(REFRESH_EXPIRE_TIME) * 60))
+    except Exception as e:
+        logger.error(f"Error storing refresh token in Redis: {e}")
+        raise RefreshStoreError(str(e)) from e
+    return family, sign_refresh(family, 0)
+
+def rotate_refresh_token(refresh_token: str) -> tuple[int, dict | None, str | None]:
+    """Returns (status, claims, next_refresh_token)"""
+    parsed = parse_refresh(refresh_token)
+    if parsed is None:
+        return REFRESH_UNKNOWN, None, None
+    family, counter = parsed
+    try:
+        result = redis_client.run(lambda client: ROTATE_SCRIPT(
+            keys=[REFRESH_PREFIX + family], args=[counter], client=client))
+    except Exception as e:
+        logger.error(f"Error rotating refresh token in Redis: {e}")
+        raise RefreshStoreError(str(e)) from e
+    status = int(result[0])
+    if status != REFRESH_OK:
+        if status == REFRESH_REUSED:
+            logger.warning('refresh token reuse detected, family %s revoked', family)
+        return status, None, None
+    role, sub = result[1].split('|', 1)
+    claims = {"sub": sub, "role": role == "1", "fam": family}
+    return REFRESH_OK, claims, sign_refresh(family, counter + 1)
+
+def revoke_refresh_family(family: str) -> bool:
+    try:
+        redis_client.run(lambda client: client.delete(REFRESH_PREFIX + family))
+        return True
+    except Exception as e:
+        logger.error(f"Error revoking refresh token family in Redis: {e}")
+    return False
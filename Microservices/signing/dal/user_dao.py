@@ -2,12 +2,15 @@
 from typing import Optional
 from entities.user import User
 from sqlalchemy.orm import Session
+from helpers.password_pool import password_pool
+from helpers.config import logger
 
 def create_user(session:Session,user:User):
     # Fix: correct filter syntax
     filtred_user=session.query(User).filter(User.email == user.email).one_or_none()
     if filtred_user != None :
         return False
+    user.password=password_pool.hash(str(user.password))
     session.add(user)
     try :
         session.commit()
@@ -16,13 +19,41 @@ def create_user(session:Session,user:User):
     except Exception as e:
         session.rollback()   
         return False
-def get_all_users(session:Session):
-    return session.query(User).all()
+# listing columns, password hashes are never loaded
+USER_LISTING_COLUMNS=(User.id,User.email,User.is_admin,User.created_at,User.updated_at)
+
+def get_users_page(session:Session,after_id:int|None=None,limit:int=100):
+    """Keyset page of users ordered by id, starting after after_id"""
+    query=session.query(*USER_LISTING_COLUMNS)
+    if after_id is not None:
+        query=query.filter(User.id>after_id)
+    return query.order_by(User.id).limit(limit).all()
+
+def iter_users(session:Session,batch_size:int=500):
+    """Yields every user page by page, memory stays bounded by batch_size"""
+    after_id=None
+    while True:
+        rows=get_users_page(session,after_id,batch_size)
+        if not rows:
+            return
+        yield from rows
+        after_id=rows[-1].id
 
 def authenticate(session:Session,user:User):
-    filtred_user:User=session.query(User).filter(
-        User.email==user.email,User.password==user.password
-        ).one_or_none()
-    if filtred_user:
-        return filtred_user
-    return False
\ No newline at end of file
+    filtred_user:User=session.query(User).filter(User.email==user.email).one_or_none()
+    if filtred_user is None:
+        return False
+    ok,new_hash=password_pool.verify(str(filtred_user.password),str(user.password))
+    if not ok:
+        return False
+    if new_hash:
+        # transparent upgrade of legacy or outdated hashes
+        filtred_user.password=new_hash
+        try:
+            session.commit()
+            session.refresh(filtred_user)
+        except Exception:
+            # the login still succeeds, the upgrade is retried on the next one
+            logger.exception('password rehash failed for user %s',filtred_user.id)
+            session.rollback()
+    return filtred_user
\ No newline at end of file
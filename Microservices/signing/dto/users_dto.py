@@ -13,5 +13,17 @@ class UserResponse(BaseModel):
 class TokenResponse(BaseModel):
     token:str
     payload:dict
+    refresh_token:str|None=None
+class RefreshRequest(BaseModel):
+    refresh_token:str
 class TokenRequest(BaseModel):
-    token:str
\ No newline at end of file
+    token:str
+class BatchTokenRequest(BaseModel):
+    tokens:list[str]=Field(min_length=1,max_length=1000)
+class TokenVerification(BaseModel):
+    token:str
+    valid:bool
+    payload:dict|None=None
+    detail:str|None=None
+class BatchTokenResponse(BaseModel):
+    results:list[TokenVerification]
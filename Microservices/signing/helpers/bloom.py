@@ -0,0 +1,52 @@
+
+import hashlib
+import threading
+
+# bits per key giving ~1% false positives with 7 hashes
+BITS_PER_KEY=10
+
+class BloomFilter:
+    """Fixed size bloom filter, used as a local pre-check before asking Redis
+    whether a token is revoked. A negative answer is definitive"""
+    def __init__(self,size_bits:int,hashes:int):
+        self.size_bits=size_bits
+        self.hashes=hashes
+        self._bits=bytearray((size_bits+7)//8)
+        self._lock=threading.Lock()
+        self.count=0
+
+    def _positions(self,key:str):
+        digest=hashlib.blake2b(key.encode(),digest_size=16).digest()
+        h1=int.from_bytes(digest[:8],'little')
+        h2=int.from_bytes(digest[8:],'little')|1
+        return [(h1+i*h2)%self.size_bits for i in range(self.hashes)]
+
+    def add(self,key:str):
+        with self._lock:
+            added=False
+            for pos in self._positions(key):
+                mask=1<<(pos&7)
+                if not self._bits[pos>>3]&mask:
+                    self._bits[pos>>3]|=mask
+                    added=True
+            # a key whose bits were all set already (duplicate) is not counted
+            if added:
+                self.count+=1
+
+    def __contains__(self,key:str)->bool:
+        bits=self._bits
+        return all(bits[pos>>3]&(1<<(pos&7)) for pos in self._positions(key))
+
+    @classmethod
+    def sized_for(cls,keys:int,min_bits:int,hashes:int)->'BloomFilter':
+        """Filter holding keys at BITS_PER_KEY, with room to double before it is full"""
+        return cls(max(min_bits,2*keys*BITS_PER_KEY),hashes)
+
+    @property
+    def full(self)->bool:
+        return self.count>self.size_bits//BITS_PER_KEY
+
+    def clear(self):
+        with self._lock:
+            self._bits=bytearray(len(self._bits))
+            self.count=0
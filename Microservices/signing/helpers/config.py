@@ -4,10 +4,23 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base,sessionmaker
 import logging
-import os
+from helpers.log import setup_logging
 #environement variables
-EXPIRE_TIME:Final[str]=os.getenv("EXPIRE_TIME","30")
+# access token lifetime (minutes), kept short since clients renew through /users/refresh
+EXPIRE_TIME:Final[str]=os.getenv("EXPIRE_TIME","15")
+# refresh token family lifetime (minutes), rotated on every use
+REFRESH_EXPIRE_TIME:Final[str]=os.getenv("REFRESH_EXPIRE_TIME","10080")
 SECRET_KEY:Final[str]=os.getenv("SECRET_KEY","$argon2id$v=19$m=65536,t=3,p=4$hT18aCPZ5AFxQ2ncYkRkWg$5UvBttA1brZmn6Bmf1T0NgKaYaqUzMV1pvWNxDp5pFc")
+# JWT signing : RS256 with keys from JWT_KEYS_DIR (<name>.pem, retired keys as <name>.pub.pem), HS256 uses SECRET_KEY.
+# RS256 refuses to start without a private key, generate one with
+#     openssl genpkey -algorithm RSA -pkeyopt rsa_keygen_bits:2048 -out keys/$(date +%Y-%m).pem
+# JWT_ACTIVE_KID is a file name or a kid, the last file name in order by default
+JWT_ALGORITHM:Final[str]=os.getenv("JWT_ALGORITHM","RS256")
+JWT_KEYS_DIR:Final[str]=os.getenv("JWT_KEYS_DIR","./keys")
+JWT_ACTIVE_KID:Final[str]=os.getenv("JWT_ACTIVE_KID","")
+JWKS_MAX_AGE:Final[int]=int(os.getenv("JWKS_MAX_AGE","300"))
+REFRESH_SECRET:Final[str]=os.getenv("REFRESH_SECRET",SECRET_KEY)
+REFRESH_PREFIX:Final[str]=os.getenv("REFRESH_PREFIX","rt:")
 USER_DB:Final[str]=os.getenv('USER_DB','admin')
 PASSWORD_DB:Final[str]=os.getenv('PASSWORD_DB','1234')
 NAME_DB:Final[str]=os.getenv('NAME_DB','db_auth')
@@ -18,20 +31,49 @@ URL_DB:Final[str]='postgresql+psycopg2://'+USER_DB+':'+PASSWORD_DB+'@'+SERVER_DB
 REDIS_HOST:Final[str]=os.getenv("REDIS_HOST", "redis")
 REDIS_PORT:Final[str]=os.getenv("REDIS_PORT", "6379")
 
-#sqlalchemy
-engine=create_engine(URL_DB,pool_size=10)
-LocalSession=sessionmaker(bind=engine)
+# local token cache
+TOKEN_CACHE_SIZE:Final[int]=int(os.getenv("TOKEN_CACHE_SIZE","10000"))
+REVOCATION_CHANNEL:Final[str]=os.getenv("REVOCATION_CHANNEL","auth:revocations")
+# when true, tokens are accepted if the revocation store can not be reached
+REVOCATION_FAIL_OPEN:Final[bool]=os.getenv("REVOCATION_FAIL_OPEN","false").lower()=="true"
+# blacklist keys are stored as BLACKLIST_PREFIX+jti
+BLACKLIST_PREFIX:Final[str]=os.getenv("BLACKLIST_PREFIX","bl:")
+# optional local bloom filter pre-check of revoked jti
+BLACKLIST_BLOOM:Final[bool]=os.getenv("BLACKLIST_BLOOM","false").lower()=="true"
+BLACKLIST_BLOOM_BITS:Final[int]=int(os.getenv("BLACKLIST_BLOOM_BITS",str(1<<20)))
+BLACKLIST_BLOOM_HASHES:Final[int]=int(os.getenv("BLACKLIST_BLOOM_HASHES","7"))
+# minimum seconds between two rebuilds of the bloom filter from Redis
+BLACKLIST_BLOOM_REBUILD_INTERVAL:Final[float]=float(os.getenv("BLACKLIST_BLOOM_REBUILD_INTERVAL","60"))
+
+# Argon2 password hashing
+ARGON2_TIME_COST:Final[int]=int(os.getenv("ARGON2_TIME_COST","3"))
+ARGON2_MEMORY_COST:Final[int]=int(os.getenv("ARGON2_MEMORY_COST","65536"))
+ARGON2_PARALLELISM:Final[int]=int(os.getenv("ARGON2_PARALLELISM","4"))
+# password worker pool : number of workers, max pending jobs and max queue wait (seconds)
+PWD_POOL_WORKERS:Final[int]=int(os.getenv("PWD_POOL_WORKERS",str(os.cpu_count() or 1)))
+PWD_POOL_MAX_PENDING:Final[int]=int(os.getenv("PWD_POOL_MAX_PENDING","64"))
+PWD_POOL_QUEUE_TIMEOUT:Final[float]=float(os.getenv("PWD_POOL_QUEUE_TIMEOUT","2"))
+
+DB_CONNECT_TIMEOUT:Final[int]=int(os.getenv("DB_CONNECT_TIMEOUT","3"))
+
+#sqlalchemy : the engine is built on first use (startup hook), importing the app opens nothing
+LocalSession=sessionmaker()
 Base=declarative_base()
+_engine=None
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine=create_engine(URL_DB,pool_size=10,pool_pre_ping=True,
+                              connect_args={'connect_timeout':DB_CONNECT_TIMEOUT})
+        LocalSession.configure(bind=_engine)
+    return _engine
 def session_factory():
+    get_engine()
     session=LocalSession()
     try:
         yield session
     finally:
         session.close()
-#logs
-formater=logging.Formatter(fmt='%(asctime)s-%(levelname)s-%(message)s')
-handler=logging.FileHandler('./logs/auth.log')
-handler.setFormatter(formater)
-logger=logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(handler)
+#logs : JSON lines written by a background listener (see helpers/log.py)
+LOG_FILE:Final[str]=os.getenv("LOG_FILE","./logs/auth.log")
+logger=setup_logging(logging.FileHandler(LOG_FILE),logging.StreamHandler())
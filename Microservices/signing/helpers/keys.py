@@ -0,0 +1,77 @@
+
+import os
+import glob
+import json
+import hashlib
+import base64
+from cryptography.hazmat.primitives import serialization
+from jose import jwk
+from helpers.config import JWT_ALGORITHM,JWT_KEYS_DIR,JWT_ACTIVE_KID,logger
+
+# members of the RFC 7638 thumbprint, by key type
+THUMBPRINT_MEMBERS={"RSA":("e","kty","n"),"EC":("crv","kty","x","y")}
+
+class KeyRing:
+    """Signing keys indexed by kid, the RFC 7638 thumbprint of the public key, so
+    every replica mounting the same key pair publishes the same kid. <name>.pem
+    files hold private keys usable for signing, <name>.pub.pem files hold retired
+    public keys still accepted for verification until their tokens expire. Every
+    public key is published in the JWKS"""
+    def __init__(self,keys_dir:str=JWT_KEYS_DIR,active_kid:str=JWT_ACTIVE_KID,algorithm:str=JWT_ALGORITHM):
+        self.algorithm=algorithm
+        self.private_keys:dict[str,str]={}
+        self.public_keys:dict[str,str]={}
+        self._jwks={"keys":[]}
+        # file name -> kid, JWT_ACTIVE_KID may name either
+        names:dict[str,str]={}
+        for path in sorted(glob.glob(os.path.join(keys_dir,'*.pem'))):
+            name=os.path.basename(path)
+            with open(path) as f:
+                pem=f.read()
+            if name.endswith('.pub.pem'):
+                self._add_public(pem)
+            else:
+                kid=self._add_public(self._public_pem(pem))
+                self.private_keys[kid]=pem
+                names[name[:-len('.pem')]]=kid
+        if not self.private_keys:
+            # tokens signed with a per-process key fail on every other replica and after a restart
+            raise RuntimeError(f'no {algorithm} signing key found in {keys_dir}, mount the key pair or set JWT_ALGORITHM=HS256')
+        self.active_kid=names.get(active_kid,active_kid) if active_kid else names[sorted(names)[-1]]
+        if self.active_kid not in self.private_keys:
+            raise ValueError(f'active signing key {active_kid} not found')
+        logger.info('signing with key %s, %d keys published',self.active_kid,len(self.public_keys))
+
+    @staticmethod
+    def _public_pem(private_pem:str)->str:
+        key=serialization.load_pem_private_key(private_pem.encode(),password=None)
+        return key.public_key().public_bytes(serialization.Encoding.PEM,
+                                             serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+    @staticmethod
+    def thumbprint(entry:dict)->str:
+        members={member:entry[member] for member in THUMBPRINT_MEMBERS[entry["kty"]]}
+        digest=hashlib.sha256(json.dumps(members,separators=(',',':'),sort_keys=True).encode()).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    def _add_public(self,pem:str)->str:
+        entry=jwk.construct(pem,self.algorithm).to_dict()
+        kid=self.thumbprint(entry)
+        if kid not in self.public_keys:
+            self.public_keys[kid]=pem
+            entry.update({"kid":kid,"use":"sig","alg":self.algorithm})
+            self._jwks["keys"].append(entry)
+        return kid
+
+    @property
+    def signing_key(self)->tuple[str,str]:
+        return self.active_kid,self.private_keys[self.active_kid]
+
+    def verification_key(self,kid:str)->str|None:
+        return self.public_keys.get(kid)
+
+    @property
+    def jwks(self)->dict:
+        return self._jwks
+
+key_ring=KeyRing() if JWT_ALGORITHM!='HS256' else None
@@ -0,0 +1,68 @@
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor,CancelledError
+from helpers.config import PWD_POOL_WORKERS,PWD_POOL_MAX_PENDING,PWD_POOL_QUEUE_TIMEOUT,logger
+from helpers.utils import hash_pwd,verify_pwd,needs_rehash
+
+# argon2-cffi releases the GIL while hashing, so a thread pool sized on the
+# number of cores keeps password work off the request threadpool while
+# bounding the CPU it may take.
+
+class PasswordPoolBusy(Exception):
+    """Raised when a password job can not be scheduled or waited too long in queue"""
+
+class PasswordPool:
+    def __init__(self,workers:int=PWD_POOL_WORKERS,
+                 max_pending:int=PWD_POOL_MAX_PENDING,
+                 queue_timeout:float=PWD_POOL_QUEUE_TIMEOUT):
+        self.executor=ThreadPoolExecutor(max_workers=workers,thread_name_prefix='pwd')
+        self.slots=threading.BoundedSemaphore(max_pending)
+        self.queue_timeout=queue_timeout
+
+    def _run(self,enqueued_at:float,fn,*args):
+        waited=time.monotonic()-enqueued_at
+        if waited>self.queue_timeout:
+            raise PasswordPoolBusy(f'password job waited {waited:.2f}s in queue')
+        return fn(*args)
+
+    def _submit(self,fn,*args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordPoolBusy('password pool is full')
+        try:
+            future=self.executor.submit(self._run,time.monotonic(),fn,*args)
+        except RuntimeError:
+            # submit after shutdown
+            self.slots.release()
+            raise PasswordPoolBusy('password pool is shut down')
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _:self.slots.release())
+        try:
+            return future.result()
+        except CancelledError:
+            # pending jobs are cancelled by shutdown, the client can retry on another instance
+            raise PasswordPoolBusy('password pool is shutting down')
+
+    def hash(self,password:str)->str:
+        return self._submit(hash_pwd,password)
+
+    def verify(self,hash_password:str,password:str)->tuple[bool,str|None]:
+        """Verify a password, returns (ok,new_hash) where new_hash is set when
+        the stored hash uses outdated parameters and must be replaced"""
+        return self._submit(self._verify_and_rehash,hash_password,password)
+
+    @staticmethod
+    def _verify_and_rehash(hash_password:str,password:str):
+        if not verify_pwd(hash_password,password):
+            return False,None
+        if needs_rehash(hash_password):
+            return True,hash_pwd(password)
+        return True,None
+
+    def shutdown(self):
+        logger.info('shutting down password pool')
+        self.executor.shutdown(wait=False,cancel_futures=True)
+
+password_pool=PasswordPool()
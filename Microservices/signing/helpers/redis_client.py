@@ -1,6 +1,9 @@
 
 import redis
+import redis.asyncio
 import os
+import time
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,6 +11,68 @@ logger = logging.getLogger(__name__)
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.5))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 0.5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+# circuit breaker : open after N consecutive failures, try again after RESET seconds
+REDIS_BREAKER_THRESHOLD = int(os.getenv("REDIS_BREAKER_THRESHOLD", 5))
+REDIS_BREAKER_RESET = float(os.getenv("REDIS_BREAKER_RESET", 10))
+
+
+class RedisUnavailable(Exception):
+    """Raised without touching the network while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = REDIS_BREAKER_THRESHOLD, reset_after: float = REDIS_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            # half-open : let a single probe through
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Redis circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error("Redis circuit opened after %s failures", self.failures)
+                self.opened_at = time.monotonic()
+
 
 class RedisClient:
     _instance = None
@@ -15,27 +80,73 @@ class RedisClient:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(RedisClient, cls).__new__(cls)
-            cls._instance.client = None
+            cls._instance._init()
         return cls._instance
 
-    def connect(self):
-        if self.client is None:
-            try:
-                self.client = redis.Redis(
-                    host=REDIS_HOST,
-                    port=REDIS_PORT,
-                    db=REDIS_DB,
-                    decode_responses=True
-                )
-                self.client.ping()
-                logger.info("Connected to Redis")
-            except Exception as e:
-                logger.error(f"Failed to connect to Redis: {e}")
-                self.client = None
-
-    def get_client(self):
-        if self.client is None:
-            self.connect()
-        return self.client
+    def _init(self):
+        options = dict(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=REDIS_DB,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            decode_responses=True
+        )
+        # connections are opened by the pool on first use, never at import time
+        self.pool = redis.ConnectionPool(**options)
+        self.client = redis.Redis(connection_pool=self.pool)
+        # async routes use their own pool, bound to the event loop of the app
+        self.async_pool = redis.asyncio.ConnectionPool(**options)
+        self.async_client = redis.asyncio.Redis(connection_pool=self.async_pool)
+        self.breaker = CircuitBreaker()
+
+    def run(self, operation):
+        """Run operation(client) through the circuit breaker"""
+        if not self.breaker.allow():
+            raise RedisUnavailable("Redis circuit open")
+        try:
+            result = operation(self.client)
+        except redis.RedisError:
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def pipeline(self, build, transaction: bool = False) -> list:
+        """Queue commands with build(pipe) and send them in a single round-trip"""
+        def operation(client):
+            pipe = client.pipeline(transaction=transaction)
+            build(pipe)
+            return pipe.execute()
+        return self.run(operation)
+
+    async def run_async(self, operation):
+        """Await operation(async_client) through the circuit breaker shared with run()"""
+        if not self.breaker.allow():
+            raise RedisUnavailable("Redis circuit open")
+        try:
+            result = await operation(self.async_client)
+        except redis.RedisError:
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def close(self):
+        self.pool.disconnect()
+
+    async def aclose(self):
+        """Releases both pools, from the event loop the async one was used on"""
+        self.close()
+        await self.async_pool.disconnect()
+
 
 redis_client = RedisClient()
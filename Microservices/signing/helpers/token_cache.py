@@ -0,0 +1,139 @@
+
+import json
+import time
+import threading
+from collections import OrderedDict
+from helpers.config import (TOKEN_CACHE_SIZE,REVOCATION_CHANNEL,BLACKLIST_PREFIX,BLACKLIST_BLOOM,
+                            BLACKLIST_BLOOM_BITS,BLACKLIST_BLOOM_HASHES,BLACKLIST_BLOOM_REBUILD_INTERVAL,logger)
+from helpers.redis_client import redis_client
+from helpers.bloom import BloomFilter
+
+class TokenCache:
+    """In-process LRU of verified token claims plus a local revocation set.
+    Entries never outlive the token's own exp claim. Revocations are keyed by jti"""
+    def __init__(self,maxsize:int=TOKEN_CACHE_SIZE,bloom:BloomFilter|None=None):
+        self.maxsize=maxsize
+        self._claims:OrderedDict[str,dict]=OrderedDict()
+        self._revoked:dict[str,float]={}
+        self._lock=threading.Lock()
+        # the bloom filter only answers once it holds every revoked key
+        self.bloom=bloom
+        self.bloom_ready=False
+
+    def get(self,token:str):
+        now=time.time()
+        with self._lock:
+            claims=self._claims.get(token)
+            if claims is None:
+                return None
+            if claims.get('exp',0)<=now:
+                del self._claims[token]
+                return None
+            self._claims.move_to_end(token)
+            return claims
+
+    def put(self,token:str,claims:dict):
+        if claims.get('exp',0)<=time.time():
+            return
+        with self._lock:
+            self._claims[token]=claims
+            self._claims.move_to_end(token)
+            while len(self._claims)>self.maxsize:
+                self._claims.popitem(last=False)
+
+    def revoke(self,key:str,exp:float):
+        now=time.time()
+        if self.bloom is not None:
+            self.bloom.add(key)
+        with self._lock:
+            if exp>now:
+                self._revoked[key]=exp
+            if len(self._revoked)>self.maxsize:
+                self._revoked={k:e for k,e in self._revoked.items() if e>now}
+
+    def is_revoked(self,key:str)->bool:
+        exp=self._revoked.get(key)
+        return exp is not None and exp>time.time()
+
+    def might_be_revoked(self,key:str)->bool:
+        if self.bloom is None or not self.bloom_ready:
+            return True
+        return key in self.bloom
+
+    def clear(self):
+        self.bloom_ready=False
+        with self._lock:
+            self._claims.clear()
+
+token_cache=TokenCache(bloom=BloomFilter(BLACKLIST_BLOOM_BITS,BLACKLIST_BLOOM_HASHES) if BLACKLIST_BLOOM else None)
+
+class RevocationListener(threading.Thread):
+    """Keeps the local revocation set coherent across replicas through Redis pub/sub.
+    Cached claims are dropped whenever the subscription is lost since
+    revocations published meanwhile were missed"""
+    def __init__(self,cache:TokenCache=token_cache,channel:str=REVOCATION_CHANNEL):
+        threading.Thread.__init__(self,name='revocation-listener')
+        self.cache=cache
+        self.channel=channel
+        self.daemon=True
+        self._stop_event=threading.Event()
+        self._loaded_at=None
+
+    def run(self):
+        while not self._stop_event.is_set():
+            pubsub=None
+            try:
+                # through the breaker : while it is open no connection is attempted,
+                # half-open this subscription is the single probe
+                pubsub=redis_client.run(self._subscribe)
+                while not self._stop_event.is_set():
+                    bloom=self.cache.bloom
+                    if (bloom is not None and bloom.full
+                            and time.monotonic()-self._loaded_at>=BLACKLIST_BLOOM_REBUILD_INTERVAL):
+                        # too many keys, false positives grow : rebuild from Redis
+                        redis_client.run(self._load_bloom)
+                    message=pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    event=json.loads(message['data'])
+                    self.cache.revoke(event['key'],float(event['exp']))
+            except Exception as e:
+                logger.error(f"Revocation listener error: {e}")
+                self.cache.clear()
+                self._stop_event.wait(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _subscribe(self,client):
+        pubsub=client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(self.channel)
+            self._load_bloom(client)
+        except Exception:
+            pubsub.close()
+            raise
+        return pubsub
+
+    def _load_bloom(self,client):
+        if self.cache.bloom is None:
+            return
+        self._loaded_at=time.monotonic()
+        prefix_len=len(BLACKLIST_PREFIX)
+        keys=[key[prefix_len:] for key in client.scan_iter(match=BLACKLIST_PREFIX+'*',count=1000)]
+        # sized on the live keys, so a large blacklist does not trigger a rebuild again at once
+        bloom=BloomFilter.sized_for(len(keys),BLACKLIST_BLOOM_BITS,BLACKLIST_BLOOM_HASHES)
+        for key in keys:
+            bloom.add(key)
+        # the previous filter keeps answering while the new one is built,
+        # revocations published meanwhile are read from the subscription next
+        self.cache.bloom=bloom
+        self.cache.bloom_ready=True
+
+    def stop(self):
+        self._stop_event.set()
+
+revocation_listener=RevocationListener()
@@ -1,29 +1,83 @@
 from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError,InvalidHashError
 
 from jose import jwt,JWTError
 from datetime import datetime,timedelta,timezone
-from helpers.config import EXPIRE_TIME,SECRET_KEY
-pwd_hash=PasswordHasher()
+import hmac
+import hashlib
+import secrets
+from helpers.keys import key_ring
+from helpers.config import EXPIRE_TIME,SECRET_KEY,REFRESH_SECRET,JWT_ALGORITHM,ARGON2_TIME_COST,ARGON2_MEMORY_COST,ARGON2_PARALLELISM
+from helpers.log import get_logger,LOG_RATE_LIMIT
+# invalid tokens come from clients, at volume they must not flood the logs
+token_logger=get_logger('auth.tokens',rate_limit=LOG_RATE_LIMIT)
+pwd_hash=PasswordHasher(time_cost=ARGON2_TIME_COST,
+                        memory_cost=ARGON2_MEMORY_COST,
+                        parallelism=ARGON2_PARALLELISM)
 
 def hash_pwd(password:str):
     return pwd_hash.hash(password)
-def verify_pwd(hash_password:str,password:str):
-    return pwd_hash.verify(hash_password,password)
+def is_hashed(stored_password:str):
+    return stored_password.startswith('$argon2')
+def verify_pwd(hash_password:str,password:str)->bool:
+    # rows created before hashing was wired in still hold the clear password
+    if not is_hashed(hash_password):
+        return hmac.compare_digest(hash_password.encode(),password.encode())
+    try:
+        return pwd_hash.verify(hash_password,password)
+    except (VerificationError,InvalidHashError):
+        return False
+def needs_rehash(hash_password:str)->bool:
+    if not is_hashed(hash_password):
+        return True
+    return pwd_hash.check_needs_rehash(hash_password)
 
 def create_token(data:dict):
     payload=data.copy()
     expire_time=datetime.now(timezone.utc) + timedelta(minutes=int(EXPIRE_TIME))
     payload.update({"exp":expire_time,
-                    "iat":datetime.now(timezone.utc)})
-    return jwt.encode(payload,SECRET_KEY,algorithm='HS256')
+                    "iat":datetime.now(timezone.utc),
+                    "jti":secrets.token_urlsafe(12)})
+    if key_ring is None:
+        return jwt.encode(payload,SECRET_KEY,algorithm='HS256')
+    kid,private_key=key_ring.signing_key
+    return jwt.encode(payload,private_key,algorithm=JWT_ALGORITHM,headers={"kid":kid})
 def decode_token(token:str):
 
     try:
-        payload:dict=jwt.decode(token,SECRET_KEY,algorithms=['HS256'])
+        if key_ring is None:
+            payload:dict=jwt.decode(token,SECRET_KEY,algorithms=['HS256'])
+        else:
+            kid=jwt.get_unverified_header(token).get('kid')
+            public_key=key_ring.verification_key(kid)
+            if public_key is None:
+                raise JWTError(f'unknown kid {kid}')
+            payload=jwt.decode(token,public_key,algorithms=[JWT_ALGORITHM])
         if payload :return payload
     except JWTError as e :
-        print("Faild token decoding")
+        token_logger.warning('Faild token decoding : %s',e)
         return False
+def sign_refresh(family:str,counter:int)->str:
+    """Refresh tokens are <family>.<counter>.<mac> ; the mac lets forged tokens
+    be rejected before any Redis access"""
+    message=f'{family}.{counter}'
+    mac=hmac.new(REFRESH_SECRET.encode(),message.encode(),hashlib.sha256).hexdigest()[:32]
+    return f'{message}.{mac}'
+def parse_refresh(refresh_token:str)->tuple[str,int]|None:
+    parts=refresh_token.split('.')
+    if len(parts)!=3 or not parts[1].isdigit():
+        return None
+    family,counter=parts[0],int(parts[1])
+    if not hmac.compare_digest(sign_refresh(family,counter),refresh_token):
+        return None
+    return family,counter
+def revocation_key(token:str,payload:dict)->str:
+    """Short key identifying a token in the blacklist : its jti, or a truncated
+    digest for tokens issued before jti was added"""
+    jti=payload.get('jti')
+    if jti:
+        return str(jti)
+    return hashlib.blake2b(token.encode(),digest_size=12).hexdigest()
     
    
 if __name__ =='__main__':
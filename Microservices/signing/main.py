@@ -3,7 +3,12 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from controllers.auth_controller import router
-from helpers.config import Base,engine
+from controllers.jwks_controller import router as jwks_router
+from controllers.health_controller import router as health_router
+from helpers.config import get_engine
+from helpers.password_pool import password_pool
+from helpers.token_cache import revocation_listener
+from helpers.redis_client import redis_client
 
 app=FastAPI(
     title="Authentication app",
@@ -16,11 +21,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-#create one time
-Base.metadata.create_all(bind=engine)
+# the schema is created by migrate.py, run once before the app
 app.include_router(router)
+app.include_router(jwks_router)
+app.include_router(health_router)
+
+@app.on_event("startup")
+def startup_event():
+    # no connection is opened here : the pools connect on first use
+    get_engine()
+    revocation_listener.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    revocation_listener.stop()
+    await redis_client.aclose()
+    password_pool.shutdown()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,7 @@
+# one-shot schema creation, run before the app starts (k8s init container, compose migrate service)
+from helpers.config import Base,get_engine,logger
+import entities.user
+
+if __name__ == '__main__':
+    Base.metadata.create_all(bind=get_engine())
+    logger.info('schema up to date')
@@ -0,0 +1,11 @@
+# The service modules import each other from the service root (helpers, dal, ...),
+# as in the image. Run from the service directory : python -m pytest tests
+import os
+import sys
+import tempfile
+
+SERVICE_DIR=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,SERVICE_DIR)
+# no key pair and no logs directory are needed to import the helpers
+os.environ.setdefault('JWT_ALGORITHM','HS256')
+os.environ.setdefault('LOG_FILE',os.path.join(tempfile.gettempdir(),'signing-tests.log'))
@@ -0,0 +1,48 @@
+import asyncio
+import json
+import pytest
+import redis
+fakeredis=pytest.importorskip('fakeredis')
+from helpers.redis_client import RedisClient,RedisUnavailable,CircuitBreaker,redis_client
+from controllers import health_controller
+
+@pytest.fixture
+def async_redis(monkeypatch):
+    client=fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(redis_client,'async_client',client)
+    monkeypatch.setattr(redis_client,'breaker',CircuitBreaker(threshold=1,reset_after=60))
+    return client
+
+def test_run_async_shares_the_breaker_with_run(async_redis):
+    async def failing(client):
+        raise redis.ConnectionError('down')
+    assert asyncio.run(redis_client.run_async(lambda client:client.ping())) is True
+    with pytest.raises(redis.ConnectionError):
+        asyncio.run(redis_client.run_async(failing))
+    # open : neither variant touches the network
+    with pytest.raises(RedisUnavailable):
+        asyncio.run(redis_client.run_async(lambda client:client.ping()))
+    with pytest.raises(RedisUnavailable):
+        redis_client.run(lambda client:client.ping())
+
+def test_readyz_checks_redis_on_the_async_client(async_redis,monkeypatch):
+    monkeypatch.setattr(health_controller,'ping_database',lambda:None)
+    response=asyncio.run(health_controller.readyz())
+    assert response.status_code==200
+    assert json.loads(response.body)['checks']=={'database':'ok','redis':'ok'}
+
+def test_aclose_releases_both_pools(monkeypatch):
+    released=[]
+    class Pool:
+        def __init__(self,name):
+            self.name=name
+        def disconnect(self):
+            released.append(self.name)
+    class AsyncPool(Pool):
+        async def disconnect(self):
+            released.append(self.name)
+    client=RedisClient()
+    monkeypatch.setattr(client,'pool',Pool('sync'))
+    monkeypatch.setattr(client,'async_pool',AsyncPool('async'))
+    asyncio.run(client.aclose())
+    assert released==['sync','async']
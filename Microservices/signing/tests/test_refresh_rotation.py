@@ -0,0 +1,45 @@
+import pytest
+fakeredis=pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+from helpers.redis_client import redis_client
+from helpers.utils import sign_refresh
+from dal import refresh_token_dao
+from dal.refresh_token_dao import create_refresh_family,rotate_refresh_token,REFRESH_OK,REFRESH_UNKNOWN,REFRESH_REUSED
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    client=fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_client,'client',client)
+    redis_client.breaker.record_success()
+    return client
+
+def test_rotation_accepts_each_token_once():
+    family,token=create_refresh_family('alice',True)
+    status,claims,next_token=rotate_refresh_token(token)
+    assert status==REFRESH_OK
+    assert claims=={'sub':'alice','role':True,'fam':family}
+    assert next_token==sign_refresh(family,1)
+    status,claims,_=rotate_refresh_token(next_token)
+    assert (status,claims['sub'],claims['role'])==(REFRESH_OK,'alice',True)
+
+def test_reused_token_revokes_the_family(fake_redis):
+    family,token=create_refresh_family('bob',False)
+    _,_,next_token=rotate_refresh_token(token)
+    assert rotate_refresh_token(token)[0]==REFRESH_REUSED
+    assert not fake_redis.exists(refresh_token_dao.REFRESH_PREFIX+family)
+    # the legitimate holder is logged out too
+    assert rotate_refresh_token(next_token)[0]==REFRESH_UNKNOWN
+
+def test_subject_with_separator_and_ttl_are_kept(fake_redis):
+    family,token=create_refresh_family('a|b',False)
+    key=refresh_token_dao.REFRESH_PREFIX+family
+    ttl=fake_redis.ttl(key)
+    status,claims,_=rotate_refresh_token(token)
+    assert (status,claims['sub'],claims['role'])==(REFRESH_OK,'a|b',False)
+    assert fake_redis.get(key)=='1|0|a|b'
+    assert 0<fake_redis.ttl(key)<=ttl
+
+def test_forged_or_unknown_tokens_are_rejected():
+    family,token=create_refresh_family('carol',False)
+    assert rotate_refresh_token(token[:-1]+('0' if token[-1]!='0' else '1'))[0]==REFRESH_UNKNOWN
+    assert rotate_refresh_token(sign_refresh('missing',0))[0]==REFRESH_UNKNOWN
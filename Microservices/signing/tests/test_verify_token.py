@@ -0,0 +1,50 @@
+import pytest
+from fastapi import HTTPException
+fakeredis=pytest.importorskip('fakeredis')
+from helpers.config import BLACKLIST_PREFIX
+from helpers.redis_client import redis_client
+from helpers.token_cache import token_cache
+from helpers.utils import create_token,decode_token,revocation_key
+from dto.users_dto import TokenRequest,BatchTokenRequest
+from controllers.auth_controller import verify_token,verify_token_batch
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    client=fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_client,'client',client)
+    redis_client.breaker.record_success()
+    token_cache.clear()
+    monkeypatch.setattr(token_cache,'_revoked',{})
+    return client
+
+def verdicts(token:str)->tuple:
+    batch=verify_token_batch(BatchTokenRequest(tokens=[token])).results[0]
+    try:
+        single=verify_token(TokenRequest(token=token)).payload is not None
+    except HTTPException as e:
+        single=e.detail
+    return (batch.detail if not batch.valid else True),single
+
+def test_both_endpoints_accept_a_valid_token():
+    token=create_token({'sub':'alice','role':False})
+    assert verdicts(token)==(True,True)
+    # cached by the first call
+    assert verdicts(token)==(True,True)
+
+def test_both_endpoints_reject_a_logged_out_token(fake_redis):
+    token=create_token({'sub':'alice','role':False})
+    fake_redis.set(BLACKLIST_PREFIX+revocation_key(token,decode_token(token)),1)
+    assert verdicts(token)==('Token is blacklisted','Token is blacklisted')
+
+def test_both_endpoints_reject_a_forged_token():
+    assert verdicts('not.a.token')==('Invalid token','Invalid token')
+
+def test_the_single_endpoint_keeps_its_status_codes(fake_redis):
+    with pytest.raises(HTTPException) as error:
+        verify_token(TokenRequest(token='not.a.token'))
+    assert error.value.status_code==404
+    token=create_token({'sub':'alice','role':False})
+    fake_redis.set(BLACKLIST_PREFIX+revocation_key(token,decode_token(token)),1)
+    with pytest.raises(HTTPException) as error:
+        verify_token(TokenRequest(token=token))
+    assert error.value.status_code==401
@@ -0,0 +1,39 @@
+"""The helpers device-management and monitoring share are copied into each
+service (every image is built from its own directory). all_in_one.py imports
+them once for both services, a fix applied to one copy only would silently
+change the behavior of the other service. The edge scripts share the trace
+context module the same way. Run from the repository root:
+
+    python -m pytest Microservices/tests
+"""
+import difflib
+import os
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SERVICES = ("Microservices/monitoring", "Microservices/device-management")
+# file -> directories holding a copy, the first one is the reference
+SHARED = {
+    "helpers/message_bus.py": SERVICES,
+    "helpers/tracing.py": SERVICES,
+    "helpers/log.py": SERVICES + ("Microservices/signing",),
+    "helpers/auth.py": SERVICES,
+    "trace_context.py": ("iot-devices", "end-devices"),
+}
+
+
+def read(directory: str, path: str) -> list:
+    with open(os.path.join(ROOT_DIR, directory, path)) as f:
+        return f.readlines()
+
+
+@pytest.mark.parametrize("path", sorted(SHARED))
+def test_shared_copies_are_identical(path):
+    reference, *copies = SHARED[path]
+    expected = read(reference, path)
+    for directory in copies:
+        actual = read(directory, path)
+        diff = "".join(difflib.unified_diff(
+            expected, actual, f"{reference}/{path}", f"{directory}/{path}"
+        ))
+        assert not diff, f"{directory}/{path} diverged from {reference}/{path}, apply the change to every copy:\n{diff}"
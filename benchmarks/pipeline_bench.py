@@ -0,0 +1,268 @@
+"""End-to-end benchmark of the telemetry pipeline
+
+    MQTT -> device-management bridge -> RabbitMQ -> DeviceEventConsumer -> Mongo + Socket.IO
+
+The real service code (device-management ``forward_telemetry`` and the monitoring
+``DeviceEventConsumer``) runs in-process against local stand-ins: an in-memory
+MQTT hop, the memory message bus (serializing like a broker), mongomock (or a local mongod with
+--mongo-url) and a fake Socket.IO server. Every message is stamped at each stage
+and the run reports p50/p95/p99 latency per hop and end to end, plus the
+sustained msgs/sec of every stage. Results are written as JSON so runs can be
+compared with --compare.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/pipeline_bench.py --messages 20000 --output bench.json
+    python benchmarks/pipeline_bench.py --compare bench.json
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import queue
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEVICE_MANAGEMENT_DIR = os.path.join(ROOT, "Microservices", "device-management")
+MONITORING_DIR = os.path.join(ROOT, "Microservices", "monitoring")
+
+STAGES = ["inject", "bridge_receive", "broker_publish", "consumer_receive", "mongo_write", "socket_emit"]
+STAGE_INDEX = {stage: i for i, stage in enumerate(STAGES)}
+# service packages share names (config, helpers, ...), each service is imported in turn
+SERVICE_PACKAGES = ("config", "helpers", "business", "dal", "dto", "models", "controllers", "services")
+
+
+def load_service_module(service_dir: str, module: str):
+    for name in list(sys.modules):
+        if name.split(".")[0] in SERVICE_PACKAGES:
+            del sys.modules[name]
+    sys.path.insert(0, service_dir)
+    try:
+        return importlib.import_module(module)
+    finally:
+        sys.path.remove(service_dir)
+
+
+class Stamps:
+    def __init__(self, size: int):
+        self.values = [[0] * len(STAGES) for _ in range(size)]
+
+    def stamp(self, seq: int, stage: str):
+        self.values[seq][STAGE_INDEX[stage]] = time.perf_counter_ns()
+
+
+def make_bus(message_bus, stamps: Stamps):
+    """MemoryBus that serializes like a real broker, stamped on publish and delivery"""
+
+    class StampedBus(message_bus.MemoryBus):
+        def publish(self, routing_key, message, headers=None):
+            stamps.stamp(message["bench_seq"], "broker_publish")
+            super().publish(routing_key, message, headers)
+
+        def subscribe(self, queue_name, bindings, handler, prefetch=100):
+            super().subscribe(queue_name, bindings, stamped(handler), prefetch)
+
+        def subscribe_partition(self, queue_name, partition, handler, prefetch=100):
+            return super().subscribe_partition(queue_name, partition, stamped(handler), prefetch)
+
+    def stamped(handler):
+        def receive(message):
+            stamps.stamp(message.body["bench_seq"], "consumer_receive")
+            handler(message)
+        return receive
+
+    return StampedBus(serialize=True)
+
+
+class StampedCollection:
+    def __init__(self, collection, stamps: Stamps):
+        self.collection = collection
+        self.stamps = stamps
+
+    def insert_one(self, document):
+        result = self.collection.insert_one(document)
+        self.stamps.stamp(document["x"]["bench_seq"], "mongo_write")
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+class FakeSocketIO:
+    def __init__(self, stamps: Stamps, expected: int):
+        self.stamps = stamps
+        self.expected = expected
+        self.received = 0
+        self.done = threading.Event()
+
+    def emit(self, event, data):
+        self.stamps.stamp(data["data"]["bench_seq"], "socket_emit")
+        self.received += 1
+        if self.received >= self.expected:
+            self.done.set()
+
+
+def make_db(mongo_url: str | None):
+    if mongo_url:
+        import pymongo
+        db = pymongo.MongoClient(mongo_url)["pipeline_bench"]
+        db.drop_collection("device_events")
+        db.drop_collection("devices")
+        return db
+    import mongomock
+    return mongomock.MongoClient()["pipeline_bench"]
+
+
+def percentiles(samples_ns: list) -> dict:
+    if not samples_ns:
+        return {}
+    ordered = sorted(samples_ns)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] / 1e6
+
+    return {
+        "p50_ms": round(pick(0.50), 4),
+        "p95_ms": round(pick(0.95), 4),
+        "p99_ms": round(pick(0.99), 4),
+        "max_ms": round(ordered[-1] / 1e6, 4),
+        "mean_ms": round(sum(ordered) / len(ordered) / 1e6, 4)
+    }
+
+
+def summarize(stamps: Stamps) -> dict:
+    complete = [row for row in stamps.values if all(row)]
+    hops = {}
+    for previous, stage in zip(STAGES, STAGES[1:]):
+        i, j = STAGE_INDEX[previous], STAGE_INDEX[stage]
+        hops[f"{previous}->{stage}"] = percentiles([row[j] - row[i] for row in complete])
+    throughput = {}
+    for stage, i in STAGE_INDEX.items():
+        column = [row[i] for row in stamps.values if row[i]]
+        span = (max(column) - min(column)) / 1e9 if len(column) > 1 else 0
+        throughput[stage] = round(len(column) / span, 1) if span else None
+    return {
+        "completed": len(complete),
+        "lost": len(stamps.values) - len(complete),
+        "end_to_end": percentiles([row[-1] - row[0] for row in complete]),
+        "hops": hops,
+        "throughput_msgs_per_s": throughput
+    }
+
+
+def run(messages: int, rate: float, mongo_url: str | None, quiet: bool, timeout: float) -> dict:
+    stamps = Stamps(messages)
+    mqtt_queue = queue.Queue()
+
+    bridge = load_service_module(DEVICE_MANAGEMENT_DIR, "business.telemetry_bridge")
+    bus = make_bus(sys.modules["helpers.message_bus"], stamps)
+    sys.modules["helpers.message_bus"].set_bus(bus)
+
+    consumer_module = load_service_module(MONITORING_DIR, "services.consumer")
+    db = make_db(mongo_url)
+    collection = StampedCollection(db["device_events"], stamps)
+    consumer_module.get_collection = lambda: collection
+    sys.modules["services.event_schema"].get_collection = lambda name="device_events": db[name]
+    sio = FakeSocketIO(stamps, messages)
+    consumer = consumer_module.DeviceEventConsumer(sio, bus)
+
+    def bridge_loop():
+        while True:
+            item = mqtt_queue.get()
+            if item is None:
+                return
+            seq, payload = item
+            stamps.stamp(seq, "bridge_receive")
+            bridge.forward_telemetry(payload)
+
+    output = open(os.devnull, "w") if quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        consumer.start()
+        threading.Thread(target=bridge_loop, daemon=True).start()
+        started = time.perf_counter()
+        for seq in range(messages):
+            if rate:
+                delay = started + seq / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            payload = {
+                "device_id": f"bench-{seq % 1000:04d}",
+                "city": "Casablanca",
+                "temperature": 21.5,
+                "humidity": 40.2,
+                "cpu_usage": 12.3,
+                "ram_usage": 45.6,
+                "disk_usage": 30.1,
+                "timestamp": time.time(),
+                "bench_seq": seq
+            }
+            stamps.stamp(seq, "inject")
+            mqtt_queue.put((seq, json.dumps(payload).encode()))
+        sio.done.wait(timeout)
+        elapsed = time.perf_counter() - started
+        mqtt_queue.put(None)
+        bus.close()
+    if quiet:
+        output.close()
+    result = summarize(stamps)
+    result["elapsed_s"] = round(elapsed, 3)
+    result["sustained_msgs_per_s"] = round(result["completed"] / elapsed, 1) if elapsed else None
+    return result
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict):
+    print(f"{'metric':45} {'baseline':>12} {'current':>12} {'delta':>9}")
+    rows = [("end_to_end " + k, baseline["end_to_end"].get(k), current["end_to_end"].get(k))
+            for k in ("p50_ms", "p95_ms", "p99_ms")]
+    rows += [(f"throughput {stage}", baseline["throughput_msgs_per_s"].get(stage), value)
+             for stage, value in current["throughput_msgs_per_s"].items()]
+    for name, before, after in rows:
+        if before and after:
+            print(f"{name:45} {before:>12} {after:>12} {(after - before) / before:>+9.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=0, help="injected msgs/sec, 0 for as fast as possible")
+    parser.add_argument("--mongo-url", default=None, help="use a local mongod instead of mongomock")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--verbose", action="store_true", help="keep the services' stdout output")
+    parser.add_argument("--output", default=None, help="write the JSON results to this file")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    result = run(args.messages, args.rate, args.mongo_url, not args.verbose, args.timeout)
+    result["meta"] = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "messages": args.messages,
+        "rate": args.rate,
+        "mongo": "mongod" if args.mongo_url else "mongomock"
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    return result
+
+
+if __name__ == "__main__":
+    main()
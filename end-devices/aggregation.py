@@ -0,0 +1,58 @@
+import time
+
+
+class WindowAggregator:
+    """Collects high-frequency samples and summarizes them per window"""
+
+    def __init__(self, metrics):
+        self.metrics = list(metrics)
+        self.reset()
+
+    def reset(self):
+        self.values = {metric: [] for metric in self.metrics}
+        self.started = time.time()
+
+    def add(self, sample: dict):
+        for metric in self.metrics:
+            self.values[metric].append(sample[metric])
+
+    def __len__(self):
+        return len(self.values[self.metrics[0]])
+
+    def summary(self) -> dict:
+        stats = {}
+        for metric, values in self.values.items():
+            ordered = sorted(values)
+            stats[metric] = {
+                "min": round(ordered[0], 1),
+                "max": round(ordered[-1], 1),
+                "mean": round(sum(ordered) / len(ordered), 1),
+                "p95": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 1)
+            }
+        return stats
+
+
+class Deadband:
+    """Suppresses reports until a metric moves beyond threshold from the last
+    reported value, or keepalive seconds have passed"""
+
+    def __init__(self, threshold: float, keepalive: float):
+        self.threshold = threshold
+        self.keepalive = keepalive
+        self.last_values = None
+        self.last_sent = 0.0
+
+    def should_send(self, stats: dict) -> bool:
+        now = time.monotonic()
+        if self.last_values is None or now - self.last_sent >= self.keepalive:
+            return True
+        for metric, window in stats.items():
+            reference = self.last_values[metric]
+            # a short spike inside the window is reported even if the mean stays flat
+            if abs(window["mean"] - reference) > self.threshold or abs(window["max"] - reference) > self.threshold:
+                return True
+        return False
+
+    def sent(self, stats: dict):
+        self.last_values = {metric: window["mean"] for metric, window in stats.items()}
+        self.last_sent = time.monotonic()
@@ -5,6 +5,9 @@ import os
 import requests
 import psutil
 from dotenv import load_dotenv
+from spool import DiskSpool
+from aggregation import WindowAggregator, Deadband
+from trace_context import trace_headers
 
 load_dotenv()
 
@@ -18,18 +21,62 @@ RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD", "guest")
 DEVICE_API_URL = os.getenv("DEVICE_API_URL", "http://localhost:8001").rstrip("/")
 EXCHANGE_NAME = "device_events"
 
-def get_connection():
+# Store-and-forward spool, used while RabbitMQ is unreachable
+SPOOL_PATH = os.getenv("SPOOL_PATH", "./spool/local_monitor.db")
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", 64 * 1024 * 1024))
+SPOOL_BATCH_SIZE = int(os.getenv("SPOOL_BATCH_SIZE", 500))
+RECONNECT_INTERVAL = float(os.getenv("RECONNECT_INTERVAL", 5))
+
+# Sampling : one sample every SAMPLE_INTERVAL seconds, one report per WINDOW_SECONDS window
+SAMPLE_INTERVAL = float(os.getenv("SAMPLE_INTERVAL", 0.5))
+WINDOW_SECONDS = float(os.getenv("WINDOW_SECONDS", 5))
+# REPORT_MODE=window publishes every window, REPORT_MODE=deadband only when a metric
+# moves more than DEADBAND points, with at least one report every KEEPALIVE_SECONDS
+REPORT_MODE = os.getenv("REPORT_MODE", "window")
+DEADBAND = float(os.getenv("DEADBAND", 2.0))
+KEEPALIVE_SECONDS = float(os.getenv("KEEPALIVE_SECONDS", 60))
+METRICS = ("cpu_usage", "ram_usage", "disk_usage")
+
+def open_channel():
+    """Connect once, without retrying : sampling must go on while the broker is down"""
     credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-    parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, port=RABBITMQ_PORT, credentials=credentials)
-    
-    while True:
-        try:
-            connection = pika.BlockingConnection(parameters)
-            print("Connected to RabbitMQ!")
-            return connection
-        except pika.exceptions.AMQPConnectionError as e:
-            print(f"Connection failed, retrying in 5s: {e}")
-            time.sleep(5)
+    parameters = pika.ConnectionParameters(
+        host=RABBITMQ_HOST, port=RABBITMQ_PORT, credentials=credentials,
+        socket_timeout=5, blocked_connection_timeout=30, connection_attempts=1
+    )
+    try:
+        connection = pika.BlockingConnection(parameters)
+        channel = connection.channel()
+        channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic', durable=True)
+        # basic_publish now raises if the broker does not confirm the message
+        channel.confirm_delivery()
+        print("Connected to RabbitMQ!")
+        return connection, channel
+    except pika.exceptions.AMQPError as e:
+        print(f"Connection failed, spooling to disk: {e}")
+        return None, None
+
+def replay_spool(channel, spool, device_id):
+    """Send spooled samples oldest first, many samples per confirmed message"""
+    while len(spool):
+        rows = spool.peek(SPOOL_BATCH_SIZE)
+        # one message per run of identical routing keys
+        start = 0
+        while start < len(rows):
+            routing_key = rows[start][1]
+            end = start
+            while end < len(rows) and rows[end][1] == routing_key:
+                end += 1
+            body = "[" + ",".join(row[2] for row in rows[start:end]) + "]"
+            channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key=routing_key,
+                body=body,
+                properties=pika.BasicProperties(content_type="application/json", headers={"batch": end - start, "device_id": device_id})
+            )
+            spool.ack(rows[end - 1][0])
+            start = end
+        print(f"[>] Replayed {len(rows)} spooled samples, {len(spool)} left")
 
 def ensure_host_device():
     """Ensure a Host PC device exists"""
@@ -67,70 +114,135 @@ def ensure_host_device():
         print(f"Error ensuring host device: {e}")
     return None
 
-def main():
-    while True:
+def close_connection(connection):
+    try:
+        if connection and connection.is_open:
+            connection.close()
+    except Exception:
+        pass
+
+class Uplink:
+    """Publishes to RabbitMQ, falling back to the disk spool while the broker is down"""
+
+    def __init__(self, spool, device_id):
+        self.spool = spool
+        # partition key of the monitoring queues (device_id header)
+        self.device_id = device_id
+        self.connection, self.channel = None, None
+        self.next_connect = 0.0
+
+    def send(self, routing_key, body):
+        if self.channel is None and time.monotonic() >= self.next_connect:
+            self.connection, self.channel = open_channel()
+            self.next_connect = time.monotonic() + RECONNECT_INTERVAL
+
+        if self.channel is None:
+            self.spool.append(routing_key, body)
+            print(f"[~] Broker down, spooled sample ({len(self.spool)} waiting, {self.spool.evicted} evicted)")
+            return False
         try:
-            connection = get_connection()
-            channel = connection.channel()
-            
-            # Declare exchange
-            channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic', durable=True)
-
-            # Ensure Host Device Exists
-            host_id = ensure_host_device()
-            if not host_id:
-                print("Could not register Host PC. Retrying in 10s...")
-                time.sleep(10)
-                if connection and connection.is_open:
-                    connection.close()
-                continue
-
-            print(f"Monitoring started for device: {host_id}")
-            
-            while True:
-                # Get REAL system stats
-                cpu = psutil.cpu_percent(interval=1)
-                ram = psutil.virtual_memory().percent
-                disk = psutil.disk_usage('/').percent
-                
+            if len(self.spool):
+                # keep ordering : the new sample goes behind the spooled ones
+                self.spool.append(routing_key, body)
+                replay_spool(self.channel, self.spool, self.device_id)
+            else:
+                self.channel.basic_publish(
+                    exchange=EXCHANGE_NAME,
+                    routing_key=routing_key,
+                    body=body,
+                    properties=pika.BasicProperties(content_type="application/json", headers=trace_headers({"device_id": self.device_id}))
+                )
+            return True
+        except pika.exceptions.AMQPError as e:
+            print(f"RabbitMQ Connection lost: {e}. Spooling to disk...")
+            if not len(self.spool):
+                self.spool.append(routing_key, body)
+            self.close()
+            self.next_connect = time.monotonic() + RECONNECT_INTERVAL
+            return False
+
+    def close(self):
+        close_connection(self.connection)
+        self.connection, self.channel = None, None
+
+def sample():
+    # interval=None : CPU usage since the previous call, does not block
+    return {
+        "cpu_usage": psutil.cpu_percent(interval=None),
+        "ram_usage": psutil.virtual_memory().percent,
+        "disk_usage": psutil.disk_usage('/').percent
+    }
+
+def main():
+    spool = DiskSpool(SPOOL_PATH, SPOOL_MAX_BYTES)
+    if len(spool):
+        print(f"Found {len(spool)} spooled samples from a previous run")
+
+    # Ensure Host Device Exists
+    host_id = ensure_host_device()
+    while not host_id:
+        print("Could not register Host PC. Retrying in 10s...")
+        time.sleep(10)
+        host_id = ensure_host_device()
+
+    print(f"Monitoring started for device: {host_id} ({REPORT_MODE} mode, "
+          f"{SAMPLE_INTERVAL}s samples, {WINDOW_SECONDS}s windows)")
+    routing_key = f"cloud-security-iot.iot.telemetry.{host_id}"
+    uplink = Uplink(spool, host_id)
+    window = WindowAggregator(METRICS)
+    deadband = Deadband(DEADBAND, KEEPALIVE_SECONDS) if REPORT_MODE == "deadband" else None
+    psutil.cpu_percent(interval=None)  # first call only primes the counters
+
+    try:
+        next_sample = time.monotonic()
+        window_end = next_sample + WINDOW_SECONDS
+        while True:
+            try:
+                next_sample += SAMPLE_INTERVAL
+                time.sleep(max(0.0, next_sample - time.monotonic()))
+                window.add(sample())
+                if time.monotonic() < window_end:
+                    continue
+                window_end += WINDOW_SECONDS
+
+                stats = window.summary()
+                samples = len(window)
+                window.reset()
+                if deadband is not None and not deadband.should_send(stats):
+                    continue
+
+                # Means keep the historical payload shape, the window carries the spikes
                 payload = {
                     "device_id": host_id,
                     "city": "Local",
-                    "cpu_usage": round(cpu, 1),
-                    "ram_usage": round(ram, 1),
-                    "disk_usage": round(disk, 1),
+                    "cpu_usage": stats["cpu_usage"]["mean"],
+                    "ram_usage": stats["ram_usage"]["mean"],
+                    "disk_usage": stats["disk_usage"]["mean"],
                     "temperature": 0,
                     "humidity": 0,
-                    "timestamp": time.time()
+                    "timestamp": time.time(),
+                    "window": {"seconds": WINDOW_SECONDS, "samples": samples, **stats}
                 }
-                
-                routing_key = f"cloud-security-iot.iot.telemetry.{host_id}"
-                
-                channel.basic_publish(
-                    exchange=EXCHANGE_NAME,
-                    routing_key=routing_key,
-                    body=json.dumps(payload)
-                )
-                print(f"[>] Published Host Stats: CPU {cpu}% | RAM {ram}% | Disk {disk}%")
-                
-                time.sleep(4) 
-
-        except pika.exceptions.AMQPConnectionError as e:
-            print(f"RabbitMQ Connection lost: {e}. Retrying in 5s...")
-            time.sleep(5)
-        except KeyboardInterrupt:
-            print("Stopping monitor")
-            if 'connection' in locals() and connection and connection.is_open:
-                connection.close()
-            break
-        except Exception as e:
-            print(f"Unexpected Error: {e}. Retrying in 5s...")
-            time.sleep(5)
-            try:
-                if 'connection' in locals() and connection and connection.is_open:
-                    connection.close()
-            except:
-                pass
+                if uplink.send(routing_key, json.dumps(payload)):
+                    print(f"[>] Published Host Stats: CPU {payload['cpu_usage']}% (max {stats['cpu_usage']['max']}%) "
+                          f"| RAM {payload['ram_usage']}% | Disk {payload['disk_usage']}%")
+                if deadband is not None:
+                    deadband.sent(stats)
+            except Exception as e:
+                # broker errors are handled by the uplink, anything else (spool I/O,
+                # sockets, psutil...) must not stop the monitor : reconnect and go on
+                print(f"Unexpected Error: {e}. Retrying in {RECONNECT_INTERVAL}s...")
+                uplink.close()
+                time.sleep(RECONNECT_INTERVAL)
+                window.reset()
+                next_sample = time.monotonic()
+                window_end = next_sample + WINDOW_SECONDS
+
+    except KeyboardInterrupt:
+        print("Stopping monitor")
+    finally:
+        uplink.close()
+        spool.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import threading
+
+
+class DiskSpool:
+    """Durable FIFO of outgoing messages, stored in SQLite (WAL mode).
+
+    Used by local_monitor while RabbitMQ is unreachable. The total size of the
+    stored bodies is bounded by max_bytes, the oldest messages are evicted first.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, routing_key TEXT NOT NULL, body TEXT NOT NULL)"
+        )
+        self.count, self.size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM spool"
+        ).fetchone()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, routing_key: str, body: str):
+        with self._lock:
+            self._db.execute("INSERT INTO spool (routing_key, body) VALUES (?, ?)", (routing_key, body))
+            self.count += 1
+            self.size += len(body)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # drop the oldest rows, a tenth of the spool at a time
+        chunk = max(1, self.count // 10)
+        while self.size > self.max_bytes and self.count:
+            last_id, rows, size = self._db.execute(
+                "SELECT MAX(id), COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM "
+                "(SELECT id, body FROM spool ORDER BY id LIMIT ?)", (chunk,)
+            ).fetchone()
+            self._db.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self.count -= rows
+            self.size -= size
+            self.evicted += rows
+
+    def peek(self, limit: int):
+        """Oldest messages as (id, routing_key, body) tuples"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, routing_key, body FROM spool ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+
+    def ack(self, last_id: int):
+        """Remove every message up to last_id once the broker confirmed them"""
+        with self._lock:
+            rows, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM spool WHERE id <= ?", (last_id,)
+            ).fetchone()
+            self._db.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self.count -= rows
+            self.size -= size
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,21 @@
+import json
+import os
+import random
+import secrets
+import time
+
+# Starts the pipeline traces of the messages published by the edge scripts,
+# in the "x-trace" header format of Microservices/*/helpers/tracing.py.
+# This file is shared verbatim by iot-devices and end-devices (each image is
+# built from its own directory), Microservices/tests/test_shared_helpers.py
+# fails when the copies diverge.
+TRACE_HEADER = "x-trace"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+
+
+def trace_headers(headers: dict) -> dict:
+    """headers, plus the context starting a pipeline trace for sampled messages"""
+    if random.random() < TRACE_SAMPLE_RATE:
+        context = {"trace_id": secrets.token_hex(16), "stamps": [["source_publish", time.time_ns()]]}
+        headers[TRACE_HEADER] = json.dumps(context)
+    return headers
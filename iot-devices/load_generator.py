@@ -0,0 +1,333 @@
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+from dotenv import load_dotenv
+from trace_context import trace_headers
+
+load_dotenv()
+
+# RabbitMQ Config
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", 5672))
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
+RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD", "guest")
+
+# MQTT Config (device-management bridges sensors/data to RabbitMQ)
+MQTT_BROKER = os.getenv("MQTT_BROKER", "mosquitto")
+MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "sensors/data")
+
+EXCHANGE_NAME = "device_events"
+
+# Supervisor : a worker still running this long after --duration is killed
+WORKER_GRACE = float(os.getenv("LOADGEN_WORKER_GRACE", 30))
+
+CITIES = np.array([
+    "Casablanca", "Rabat", "Marrakech", "Tanger", "Agadir", "Fes", "Meknes", "Oujda",
+    "Paris", "London", "New York", "Tokyo", "Berlin", "Madrid", "Dubai", "Singapore"
+])
+DEVICE_TYPES = np.array(["Sensor", "Server", "Actuator", "Gateway"])
+TICKS_PER_SECOND = 20
+
+
+class VirtualFleet:
+    """Synthetic devices, never registered through the REST API.
+    Ids, cities and types only depend on the seed and the device index"""
+
+    def __init__(self, size: int, seed: int, indices=None):
+        self.seed = seed
+        self.indices = np.arange(size) if indices is None else np.asarray(indices)
+        static_rng = np.random.default_rng(seed)
+        all_cities = static_rng.integers(0, len(CITIES), size)
+        all_types = static_rng.integers(0, len(DEVICE_TYPES), size)
+        self.cities = CITIES[all_cities[self.indices]]
+        self.types = DEVICE_TYPES[all_types[self.indices]]
+        self.ids = np.array([device_id(seed, i) for i in self.indices])
+        # per-fleet stream, so shards of the same fleet draw different values
+        self.rng = np.random.default_rng([seed, int(self.indices[0]) if len(self.indices) else 0])
+
+    def __len__(self):
+        return len(self.indices)
+
+    def payloads(self, start: int, count: int):
+        """Generate count payloads for the devices following start (round robin)"""
+        slots = (start + np.arange(count)) % len(self)
+        rng = self.rng
+        temperature = np.round(rng.uniform(5.0, 45.0, count), 2)
+        humidity = np.round(rng.uniform(20.0, 90.0, count), 2)
+        cpu = np.round(rng.uniform(5, 30, count), 1)
+        ram = np.round(rng.uniform(20, 60, count), 1)
+        disk = np.round(rng.uniform(10, 40, count), 1)
+        connected = rng.integers(5, 201, count)
+        processes = rng.integers(50, 151, count)
+        power = np.round(rng.uniform(10.0, 500.0, count), 1)
+        status = (rng.random(count) > 0.1).astype(int)
+        net_in = np.round(rng.uniform(0.1, 100.0, count), 2)
+        net_out = np.round(rng.uniform(0.1, 50.0, count), 2)
+        now = time.time()
+        ids = self.ids[slots]
+        cities = self.cities[slots]
+        types = self.types[slots]
+        for i in range(count):
+            payload = {
+                "device_id": ids[i],
+                "city": cities[i],
+                "temperature": float(temperature[i]),
+                "humidity": float(humidity[i]),
+                "cpu_usage": float(cpu[i]),
+                "ram_usage": float(ram[i]),
+                "disk_usage": float(disk[i]),
+                "timestamp": now
+            }
+            device_type = types[i]
+            if device_type == "Server":
+                payload["connected_users"] = int(connected[i])
+                payload["active_processes"] = int(processes[i])
+            elif device_type == "Actuator":
+                payload["power_usage"] = float(power[i])
+                payload["status"] = int(status[i])
+            elif device_type == "Gateway":
+                payload["network_in"] = float(net_in[i])
+                payload["network_out"] = float(net_out[i])
+            yield str(ids[i]), payload
+
+
+def device_id(seed: int, index: int) -> str:
+    return f"sim-{seed}-{index:07d}"
+
+
+def stable_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of device ids onto workers, with virtual nodes
+    so shards stay balanced and only ~1/N devices move when N changes"""
+
+    def __init__(self, workers: int, replicas: int = 128):
+        points = sorted((stable_hash(f"worker-{w}#{r}"), w) for w in range(workers) for r in range(replicas))
+        self.hashes = [h for h, _ in points]
+        self.owners = [w for _, w in points]
+
+    def owner(self, key: str) -> int:
+        i = bisect.bisect(self.hashes, stable_hash(key)) % len(self.hashes)
+        return self.owners[i]
+
+
+def shard_devices(size: int, seed: int, workers: int) -> list:
+    ring = HashRing(workers)
+    shards = [[] for _ in range(workers)]
+    for index in range(size):
+        shards[ring.owner(device_id(seed, index))].append(index)
+    return shards
+
+
+class AmqpPublisher:
+    async def connect(self):
+        import aio_pika
+        self._aio_pika = aio_pika
+        self.connection = await aio_pika.connect_robust(
+            host=RABBITMQ_HOST, port=RABBITMQ_PORT, login=RABBITMQ_USER, password=RABBITMQ_PASSWORD
+        )
+        self.channel = await self.connection.channel(publisher_confirms=False)
+        self.exchange = await self.channel.declare_exchange(
+            EXCHANGE_NAME, aio_pika.ExchangeType.TOPIC, durable=True
+        )
+
+    async def publish(self, device: str, body: bytes):
+        await self.exchange.publish(
+            self._aio_pika.Message(
+                body=body, content_type="application/json", headers=trace_headers({"device_id": device})
+            ),
+            routing_key=f"cloud-security-iot.iot.temperature.{device}"
+        )
+
+    async def close(self):
+        await self.connection.close()
+
+
+class MqttPublisher:
+    async def connect(self):
+        import aiomqtt
+        self.client = aiomqtt.Client(hostname=MQTT_BROKER, port=MQTT_PORT)
+        await self.client.__aenter__()
+
+    async def publish(self, device: str, body: bytes):
+        await self.client.publish(MQTT_TOPIC, payload=body, qos=0)
+
+    async def close(self):
+        await self.client.__aexit__(None, None, None)
+
+
+PUBLISHERS = {"amqp": AmqpPublisher, "mqtt": MqttPublisher}
+
+
+class LoadGenerator:
+    def __init__(self, fleet: VirtualFleet, transport: str = "amqp", rate: float = 10000,
+                 duration: float = 60, report_every: float = 5, label: str = "loadgen"):
+        self.fleet = fleet
+        self.transport = transport
+        self.rate = rate
+        self.duration = duration
+        self.report_every = report_every
+        self.label = label
+        self.sent = 0
+        self.errors = 0
+
+    async def _send_batch(self, publisher, count: int, start: int):
+        coros = [publisher.publish(device, json.dumps(payload).encode())
+                 for device, payload in self.fleet.payloads(start, count)]
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        failed = sum(1 for r in results if isinstance(r, Exception))
+        self.errors += failed
+        self.sent += count - failed
+
+    async def run(self) -> dict:
+        publisher = PUBLISHERS[self.transport]()
+        await publisher.connect()
+        per_tick = self.rate / TICKS_PER_SECOND
+        budget = 0.0
+        cursor = 0
+        started = time.perf_counter()
+        next_tick = started
+        next_report = started + self.report_every
+        last_sent = 0
+        try:
+            while time.perf_counter() - started < self.duration:
+                budget += per_tick
+                count = int(budget)
+                budget -= count
+                if count:
+                    await self._send_batch(publisher, count, cursor)
+                    cursor = (cursor + count) % len(self.fleet)
+                now = time.perf_counter()
+                if now >= next_report:
+                    window = self.sent - last_sent
+                    print(f"[{self.label}] {window / self.report_every:.0f} msg/s "
+                          f"(sent {self.sent}, errors {self.errors})", flush=True)
+                    last_sent = self.sent
+                    next_report += self.report_every
+                next_tick += 1 / TICKS_PER_SECOND
+                # when late, do not sleep : the next batches catch up on the budget
+                await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+        finally:
+            await publisher.close()
+        elapsed = time.perf_counter() - started
+        return {
+            "label": self.label,
+            "transport": self.transport,
+            "devices": len(self.fleet),
+            "target_rate": self.rate,
+            "sent": self.sent,
+            "errors": self.errors,
+            "elapsed": round(elapsed, 3),
+            "achieved_rate": round(self.sent / elapsed, 1) if elapsed else 0.0
+        }
+
+
+def run_worker(worker: int, indices: list, args, results):
+    """Worker process : own fleet shard, own broker connection"""
+    fleet = VirtualFleet(args.devices, args.seed, indices)
+    rate = args.rate * len(indices) / args.devices
+    generator = LoadGenerator(fleet, args.transport, rate, args.duration, args.report_every, label=f"worker-{worker}")
+    try:
+        results.put(asyncio.run(generator.run()))
+    except Exception as e:
+        results.put({"label": f"worker-{worker}", "error": str(e), "sent": generator.sent, "errors": generator.errors})
+
+
+def collect_results(processes: dict, results, deadline: float) -> list:
+    """Stats of every worker (label -> process). A worker that died without
+    reporting (killed, out of memory) or outlived the deadline is reported as
+    failed instead of blocking the supervisor"""
+    pending = dict(processes)
+    workers, dead = [], set()
+    while pending:
+        try:
+            stats = results.get(timeout=1)
+        except queue.Empty:
+            for label, process in list(pending.items()):
+                if process.exitcode is None and time.monotonic() < deadline:
+                    continue
+                if process.exitcode is None:
+                    process.terminate()
+                    error = "timed out"
+                elif label in dead:
+                    # seen dead on two polls in a row : its result is not on its way
+                    error = f"exited with code {process.exitcode}"
+                else:
+                    dead.add(label)
+                    continue
+                workers.append({"label": label, "error": error, "sent": 0, "errors": 0})
+                del pending[label]
+            continue
+        workers.append(stats)
+        pending.pop(stats["label"], None)
+    return workers
+
+
+def supervise(args) -> dict:
+    shards = shard_devices(args.devices, args.seed, args.workers)
+    results = multiprocessing.Queue()
+    processes = {
+        f"worker-{worker}": multiprocessing.Process(target=run_worker, args=(worker, shard, args, results), daemon=True)
+        for worker, shard in enumerate(shards) if shard
+    }
+    print(f"Supervisor: {len(processes)} workers, shard sizes {[len(shard) for shard in shards]}", flush=True)
+    for process in processes.values():
+        process.start()
+    workers = collect_results(processes, results, time.monotonic() + args.duration + WORKER_GRACE)
+    for process in processes.values():
+        process.join()
+    workers.sort(key=lambda stats: stats["label"])
+    elapsed = max((stats.get("elapsed", 0) for stats in workers), default=0)
+    sent = sum(stats["sent"] for stats in workers)
+    return {
+        "label": "supervisor",
+        "transport": args.transport,
+        "devices": args.devices,
+        "target_rate": args.rate,
+        "sent": sent,
+        "errors": sum(stats["errors"] for stats in workers),
+        "elapsed": elapsed,
+        "achieved_rate": round(sum(stats.get("achieved_rate", 0) for stats in workers), 1),
+        "workers": workers
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="High-throughput IoT telemetry load generator")
+    parser.add_argument("--devices", type=int, default=int(os.getenv("LOADGEN_DEVICES", 100000)))
+    parser.add_argument("--rate", type=float, default=float(os.getenv("LOADGEN_RATE", 10000)),
+                        help="target messages per second")
+    parser.add_argument("--duration", type=float, default=float(os.getenv("LOADGEN_DURATION", 60)),
+                        help="seconds to run")
+    parser.add_argument("--transport", choices=sorted(PUBLISHERS), default=os.getenv("LOADGEN_TRANSPORT", "amqp"))
+    parser.add_argument("--seed", type=int, default=int(os.getenv("LOADGEN_SEED", 42)))
+    parser.add_argument("--report-every", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("LOADGEN_WORKERS", 1)),
+                        help="worker processes, devices are split by consistent hashing of device_id")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    print(f"Load generator: {args.devices} virtual devices, target {args.rate:.0f} msg/s over {args.transport}", flush=True)
+    if args.workers > 1:
+        stats = supervise(args)
+    else:
+        fleet = VirtualFleet(args.devices, args.seed)
+        stats = asyncio.run(LoadGenerator(fleet, args.transport, args.rate, args.duration, args.report_every).run())
+    print(json.dumps(stats), flush=True)
+    return stats
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ import os
 import requests
 import psutil
 from dotenv import load_dotenv
+from trace_context import trace_headers
 
 load_dotenv()
 
@@ -133,7 +134,8 @@ def main():
                 channel.basic_publish(
                     exchange=EXCHANGE_NAME,
                     routing_key=routing_key,
-                    body=json.dumps(payload)
+                    body=json.dumps(payload),
+                    properties=pika.BasicProperties(content_type="application/json", headers=trace_headers({"device_id": device_id}))
                 )
                 print(f"[>] Published for {name} ({city}): {json.dumps(payload)}", flush=True)
                 
@@ -146,4 +148,9 @@ def main():
         connection.close()
 
 if __name__ == "__main__":
-    main()
+    # SIMULATOR_MODE=load synthesizes a large virtual fleet instead of the registered devices
+    if os.getenv("SIMULATOR_MODE", "devices") == "load":
+        import load_generator
+        load_generator.main()
+    else:
+        main()